@@ -0,0 +1,76 @@
+"""
+v0604_anti_infinit_loop.py의 import 시간을 측정한다.
+
+매번 새 파이썬 프로세스에서 import하므로 캐시된 모듈의 영향을 받지 않는다.
+import 중에 임베딩 모델이나 Chroma가 만들어지면(부작용) 실패로 본다.
+
+    python benchmark_startup.py --runs 5 --budget 3.0
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import json
+import os
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+
+# 자식 프로세스에서 실행할 코드: import 시간과 lazy 초기화 여부를 json으로 출력
+probe = """
+import json, time, sys
+started = time.perf_counter()
+import v0604_anti_infinit_loop
+elapsed = time.perf_counter() - started
+import tools
+print(json.dumps({
+    "seconds": elapsed,
+    "embedding_created": tools.embedding is not None,
+    "vectorstore_created": tools.vectorstore is not None,
+    "url_index_created": tools.url_index is not None,
+}))
+"""
+
+
+def measure_once(module_dir):
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark") # 키가 없어도 import는 되어야 한다.
+    result = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=module_dir, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="멀티 에이전트 앱의 import 시간 측정")
+    parser.add_argument("--runs", type=int, default=5, help="측정 횟수")
+    parser.add_argument("--budget", type=float, default=3.0, help="import 시간 목표(초, 중앙값 기준)")
+    args = parser.parse_args()
+
+    samples = []
+    side_effects = set()
+
+    for i in range(args.runs):
+        measured = measure_once(current_path)
+        samples.append(measured["seconds"])
+        side_effects |= {key for key, created in measured.items() if key.endswith("_created") and created}
+        print(f"run {i + 1}: {measured['seconds']:.3f}s")
+
+    median = statistics.median(samples)
+    print(f"median: {median:.3f}s | min: {min(samples):.3f}s | max: {max(samples):.3f}s | budget: {args.budget:.1f}s")
+
+    failed = False
+    if side_effects:
+        print(f"FAIL: import 중에 초기화됨: {sorted(side_effects)}")
+        failed = True
+    if median > args.budget:
+        print(f"FAIL: import 시간이 목표({args.budget:.1f}s)를 넘었습니다.")
+        failed = True
+
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from contextvars import ContextVar
+from collections import defaultdict
+import threading
+import time
+
+from usage import usage_from_result
+
+# 한 턴(사용자 입력 한 번)의 기본 예산
+default_deadline_seconds = 120
+default_max_tokens = 60000
+
+# agent를 한 번 실행하고 supervisor로 돌아올 때까지의 예상 비용 (business_analyst, supervisor 포함)
+# 남은 예산이 이보다 적으면 더 싼 작업으로 바꾼다.
+agent_costs = {
+    "communicator": {"seconds": 15, "tokens": 5000},
+    "vector_search_agent": {"seconds": 15, "tokens": 6000},
+    "web_search_agent": {"seconds": 40, "tokens": 10000},
+    "content_strategist": {"seconds": 60, "tokens": 30000}, # outline_reviewer 포함
+}
+
+# 예산이 부족할 때 대신할 작업 (마지막은 항상 communicator)
+cheaper_agents = {
+    "content_strategist": "communicator",
+    "web_search_agent": "vector_search_agent",
+    "vector_search_agent": "communicator",
+}
+
+# 지금 실행 중인 턴의 예산 (노드가 실행되는 동안 설정된다. LLM 콜백에서 토큰을 기록할 때 사용)
+current_budget = ContextVar("current_budget", default=None)
+
+
+class TurnBudget:
+    """
+    한 턴의 마감 시간(deadline)과 토큰 예산.
+
+    State["budget"]으로 모든 노드가 볼 수 있고, supervisor는 남은 예산으로 감당할 수 있는 작업만 고른다.
+    마감 시간이 지나거나 토큰을 다 쓰면 communicator가 지금까지의 결과를 보고한다.
+    (communicator 한 번의 비용은 항상 남겨 둔다)
+    """
+
+    def __init__(self, deadline_seconds=default_deadline_seconds, max_tokens=default_max_tokens):
+        self.deadline_seconds = deadline_seconds
+        self.max_tokens = max_tokens
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.tokens = 0
+        self.node_tokens = defaultdict(int)
+        self.downgrades = [] # (원래 agent, 바꾼 agent)
+        self.handed_off = False # 예산이 부족해 communicator로 넘겼는지
+
+    def charge(self, node, tokens):
+        with self.lock:
+            self.tokens += tokens
+            self.node_tokens[node] += tokens
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining_seconds(self):
+        return self.deadline_seconds - self.elapsed()
+
+    def remaining_tokens(self):
+        with self.lock:
+            return self.max_tokens - self.tokens
+
+    def remaining_ratio(self):
+        # 시간과 토큰 중 더 많이 쓴 쪽 기준으로 남은 비율
+        ratio = min(self.remaining_seconds() / self.deadline_seconds, self.remaining_tokens() / self.max_tokens)
+        return max(0.0, ratio)
+
+    def exhausted(self):
+        return self.remaining_seconds() <= 0 or self.remaining_tokens() <= 0
+
+    def can_afford(self, agent):
+        # agent를 실행한 뒤에도 communicator로 보고할 예산이 남는지
+        cost = agent_costs.get(agent, agent_costs["communicator"])
+        reserve = agent_costs["communicator"] if agent != "communicator" else {"seconds": 0, "tokens": 0}
+        return (
+            self.remaining_seconds() >= cost["seconds"] + reserve["seconds"]
+            and self.remaining_tokens() >= cost["tokens"] + reserve["tokens"]
+        )
+
+    def choose(self, agent):
+        """
+        남은 예산으로 감당할 수 있는 작업을 고른다. agent를 감당할 수 없으면 더 싼 작업으로 바꾼다.
+
+        Args:
+            agent (str): supervisor가 고른 agent
+
+        Returns:
+            str: 실행할 agent (바꿀 필요가 없으면 agent 그대로)
+        """
+        chosen = agent
+        while chosen != "communicator" and not self.can_afford(chosen):
+            chosen = cheaper_agents.get(chosen, "communicator")
+        # supervisor가 처음부터 communicator를 골랐더라도 예산이 없어서라면 보고로 넘긴 것으로 본다.
+        handed_off = chosen == "communicator" and self.must_report()
+        with self.lock:
+            if chosen != agent:
+                self.downgrades.append((agent, chosen))
+            self.handed_off = self.handed_off or handed_off
+        return chosen
+
+    def must_report(self):
+        # 남은 예산으로 communicator 외에는 아무 agent도 실행할 수 없는지
+        return self.exhausted() or not any(self.can_afford(agent) for agent in cheaper_agents)
+
+    def status(self):
+        # supervisor 프롬프트에 넣는 남은 예산 설명
+        return (
+            f"남은 시간 {max(0.0, self.remaining_seconds()):.0f}/{self.deadline_seconds}초, "
+            f"남은 토큰 {max(0, self.remaining_tokens())}/{self.max_tokens} ({self.remaining_ratio():.0%})"
+        )
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "deadline_seconds": self.deadline_seconds,
+                "elapsed_seconds": round(self.elapsed(), 2),
+                "max_tokens": self.max_tokens,
+                "tokens": self.tokens,
+                "node_tokens": dict(self.node_tokens),
+                "downgrades": [f"{agent}->{chosen}" for agent, chosen in self.downgrades],
+                "exhausted": self.elapsed() >= self.deadline_seconds or self.tokens >= self.max_tokens,
+                "handed_off": self.handed_off,
+            }
+
+    def report(self):
+        snapshot = self.snapshot()
+        lines = [
+            f"이번 턴 예산: 시간 {snapshot['elapsed_seconds']:.1f}/{snapshot['deadline_seconds']}초 "
+            f"| 토큰 {snapshot['tokens']}/{snapshot['max_tokens']}" + (" | 예산 부족으로 보고" if snapshot["handed_off"] else "")
+        ]
+        for node, tokens in sorted(snapshot["node_tokens"].items()):
+            lines.append(f"- {node}: 토큰 {tokens}")
+        if snapshot["downgrades"]:
+            lines.append("- 더 싼 작업으로 바꿈: " + ", ".join(snapshot["downgrades"]))
+        return "\n".join(lines)
+
+
+class BudgetCallbackHandler(BaseCallbackHandler):
+    """
+    LLM 호출이 끝날 때마다 실제 사용한 토큰을 호출한 턴의 예산(current_budget)에 기록한다.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {} # run_id -> (예산, 노드 이름)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        budget = current_budget.get()
+        if budget is None:
+            return
+        with self.lock:
+            self.runs[run_id] = (budget, (metadata or {}).get("langgraph_node", "unknown"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            run = self.runs.pop(run_id, None)
+        usage = usage_from_result(response)
+        if run is None or usage is None:
+            return
+        budget, node = run
+        budget.charge(node, usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.runs.pop(run_id, None)
@@ -0,0 +1,260 @@
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from models import Task
+from references import ReferenceStore
+from history import HistoryManager
+
+from datetime import datetime
+import hashlib
+import json
+import os
+
+# 메시지 클래스 이름 -> 복원할 클래스 (스트리밍으로 모은 AIMessageChunk는 AIMessage로 복원)
+message_classes = {
+    "SystemMessage": SystemMessage,
+    "HumanMessage": HumanMessage,
+    "AIMessage": AIMessage,
+    "AIMessageChunk": AIMessage,
+}
+
+scalar_keys = ["user_request", "ai_recommandation", "supervisor_call_count"]
+
+
+def serialize_message(message):
+    if isinstance(message, str):
+        return ["AIMessage", message]
+    return [message.__class__.__name__, message.content]
+
+
+def deserialize_message(item):
+    class_name, content = item
+    return message_classes.get(class_name, AIMessage)(content)
+
+
+def text_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class CheckpointJournal:
+    """
+    노드가 끝날 때마다 바뀐 부분(delta)만 journal.jsonl에 한 줄씩 덧붙이고,
+    snapshot_every개마다 전체 상태를 snapshot.json으로 압축하는 체크포인트 저장소.
+
+    세션마다 data/checkpoints/<session_id>/ 폴더를 사용한다.
+    """
+
+    def __init__(self, root_dir, session_id=None, snapshot_every=50):
+        self.root_dir = root_dir
+        self.session_id = session_id or datetime.now().strftime('%Y_%m%d_%H%M%S')
+        self.session_dir = os.path.join(root_dir, self.session_id)
+        self.journal_path = os.path.join(self.session_dir, "journal.jsonl")
+        self.snapshot_path = os.path.join(self.session_dir, "snapshot.json")
+        self.snapshot_every = snapshot_every
+
+        self.seq = 0               # 마지막으로 기록한 순번
+        self.entries_since_snapshot = 0
+        self.last = self.empty_marker()
+
+        os.makedirs(self.session_dir, exist_ok=True)
+
+    @classmethod
+    def latest(cls, root_dir, **kwargs):
+        # 가장 최근 세션의 journal을 연다. 세션이 없으면 None
+        if not os.path.isdir(root_dir):
+            return None
+        sessions = sorted(d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d)))
+        if not sessions:
+            return None
+        return cls(root_dir, session_id=sessions[-1], **kwargs)
+
+    def empty_marker(self):
+        # 마지막 체크포인트 시점의 상태를 delta 계산에 필요한 만큼만 기억한다.
+        return {
+            "message_count": 0,
+            "tasks": [],
+            "query_count": 0,
+            "scalars": {},
+            "history": {},
+            "outline_hash": None,
+        }
+
+    def make_delta(self, state, outline=None):
+        delta = {}
+        last = self.last
+
+        messages = state.get("messages", [])
+        if len(messages) > last["message_count"]:
+            delta["messages"] = [serialize_message(m) for m in messages[last["message_count"]:]]
+
+        tasks = [task.to_dict() for task in state.get("task_history", [])]
+        changed_tasks = {
+            str(i): task for i, task in enumerate(tasks)
+            if i >= len(last["tasks"]) or last["tasks"][i] != task
+        }
+        if changed_tasks:
+            delta["tasks"] = changed_tasks
+
+        # 참고자료는 ReferenceStore가 기록해 둔 바뀐 문서만 (새 문서는 본문 포함, 나머지는 점수만)
+        references = state.get("references")
+        if references is not None:
+            new_queries = references.queries[last["query_count"]:]
+            changed_docs = references.dirty_docs()
+            if new_queries or changed_docs:
+                delta["references"] = {"queries": new_queries, "docs": changed_docs}
+
+        scalars = {key: state.get(key) for key in scalar_keys if key in state}
+        changed_scalars = {k: v for k, v in scalars.items() if last["scalars"].get(k) != v}
+        if changed_scalars:
+            delta["scalars"] = changed_scalars
+
+        # 메시지는 위에서 덧붙였으므로, 요약은 바뀐 값(digest, summarized_until)만 기록한다.
+        history = state.get("history")
+        if history is not None:
+            changed_history = {
+                key: value for key, value in [("digest", history.digest), ("summarized_until", history.summarized_until)]
+                if last["history"].get(key) != value
+            }
+            if changed_history:
+                delta["history"] = changed_history
+
+        if outline is not None and text_hash(outline) != last["outline_hash"]:
+            delta["outline"] = outline
+
+        return delta
+
+    def update_marker(self, state, outline=None):
+        references = state.get("references")
+        history = state.get("history")
+        if references is not None:
+            references.clear_dirty()
+        self.last = {
+            "message_count": len(state.get("messages", [])),
+            "tasks": [task.to_dict() for task in state.get("task_history", [])],
+            "query_count": len(references.queries) if references is not None else 0,
+            "scalars": {key: state.get(key) for key in scalar_keys if key in state},
+            "history": {"digest": history.digest, "summarized_until": history.summarized_until} if history is not None else {},
+            "outline_hash": text_hash(outline) if outline is not None else self.last["outline_hash"],
+        }
+
+    def record(self, node, state, outline=None):
+        """
+        노드 실행 후의 상태에서 바뀐 부분만 journal에 덧붙인다.
+
+        Args:
+            node (str): 노드 이름
+            state (dict): 노드 결과가 반영된 상태
+            outline (str): 현재 목차 (바뀌었을 때만 기록된다)
+
+        Returns:
+            dict: 기록한 delta (바뀐 것이 없으면 빈 dict)
+        """
+        delta = self.make_delta(state, outline=outline)
+        if not delta:
+            return delta
+
+        self.seq += 1
+        entry = {
+            "seq": self.seq,
+            "node": node,
+            "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "delta": delta,
+        }
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        self.update_marker(state, outline=outline)
+        self.entries_since_snapshot += 1
+
+        if self.entries_since_snapshot >= self.snapshot_every:
+            self.compact()
+
+        return delta
+
+    def compact(self):
+        # snapshot + journal을 합쳐 새 snapshot을 만들고 journal을 비운다.
+        data = self.load_data()
+
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
+
+        # snapshot에 반영된 seq 이하의 기록은 resume 시에도 무시되므로, 여기서 중단되어도 안전하다.
+        open(self.journal_path, "w", encoding="utf-8").close()
+        self.entries_since_snapshot = 0
+
+    def load_data(self):
+        # snapshot을 읽고 그 이후의 journal delta를 순서대로 적용한다.
+        data = {
+            "seq": 0,
+            "messages": [],
+            "tasks": [],
+            "references": {"queries": [], "docs": []},
+            "scalars": {},
+            "history": None,
+            "outline": None,
+        }
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+
+        docs_by_id = {item["id"]: item for item in data["references"]["docs"]}
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break # 기록 중에 중단된 마지막 줄은 버린다.
+                    if entry["seq"] <= data["seq"]:
+                        continue
+
+                    delta = entry["delta"]
+                    data["messages"] += delta.get("messages", [])
+                    for index, task in delta.get("tasks", {}).items():
+                        index = int(index)
+                        if index < len(data["tasks"]):
+                            data["tasks"][index] = task
+                        else:
+                            data["tasks"].append(task)
+                    if "references" in delta:
+                        data["references"]["queries"] += delta["references"]["queries"]
+                        for item in delta["references"]["docs"]:
+                            docs_by_id.setdefault(item["id"], {}).update(item) # 본문이 없으면 점수만 바뀐 것
+                    data["scalars"].update(delta.get("scalars", {}))
+                    if "history" in delta:
+                        data["history"] = {**(data["history"] or {}), **delta["history"]}
+                    if "outline" in delta:
+                        data["outline"] = delta["outline"]
+                    data["seq"] = entry["seq"]
+
+        data["references"]["docs"] = list(docs_by_id.values())
+        return data
+
+    def resume(self):
+        """
+        저장된 snapshot과 journal로 State를 다시 만든다.
+
+        Returns:
+            tuple: (state dict, outline 문자열 또는 None)
+        """
+        data = self.load_data()
+
+        state = {
+            "messages": [deserialize_message(item) for item in data["messages"]],
+            "task_history": [Task(**task) for task in data["tasks"]],
+            "references": ReferenceStore.from_dict(data["references"]),
+            "history": HistoryManager.from_dict(data["history"]) if data["history"] else HistoryManager(),
+        }
+        for key in scalar_keys:
+            state[key] = data["scalars"].get(key, "" if key != "supervisor_call_count" else 0)
+
+        # 이어서 기록할 수 있도록 marker와 순번을 맞춘다.
+        self.seq = data["seq"]
+        self.update_marker(state, outline=data["outline"])
+
+        return state, data["outline"]
@@ -0,0 +1,176 @@
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+from collections import defaultdict
+from contextlib import contextmanager
+import codecs
+import threading
+import time
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 웹페이지 수집 설정
+connect_timeout = 5       # 연결 타임아웃(초)
+read_timeout = 10         # 읽기 타임아웃(초)
+total_timeout = 20        # 한 페이지를 내려받는 데 허용하는 전체 시간(초)
+max_bytes = 2_000_000     # 한 페이지에서 읽을 최대 바이트 수
+per_host_limit = 2        # 같은 호스트에 동시에 보낼 수 있는 최대 요청 수
+chunk_size = 16_384       # 스트리밍으로 읽을 때의 청크 크기
+
+headers = {
+    "User-Agent": "Mozilla/5.0 (compatible; llm-book-agent/1.0)",
+    "Accept": "text/html,application/xhtml+xml,text/plain;q=0.9,*/*;q=0.5",
+}
+
+# 본문으로 보지 않는 태그
+skip_tags = {"script", "style", "noscript", "template", "svg", "head"}
+
+# 줄바꿈으로 바꿔줄 블록 태그
+block_tags = {
+    "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+    "header", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre",
+}
+
+# 3개 이상 연속된 줄바꿈/탭을 2개로 줄이는 정규식 (한 번에 처리)
+multiple_newlines = re.compile(r"\n{3,}")
+multiple_tabs = re.compile(r"\t{3,}")
+
+# <meta charset="..."> 에서 인코딩을 찾는 정규식
+meta_charset = re.compile(rb"""charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+def normalize_whitespace(text):
+    text = multiple_newlines.sub("\n\n", text)
+    text = multiple_tabs.sub("\t\t", text)
+    return text.strip()
+
+
+class HTMLTextExtractor(HTMLParser):
+    # 청크 단위로 feed()하면서 본문 텍스트만 모으는 파서
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in skip_tags:
+            self.skip_depth += 1
+        elif tag in block_tags:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in skip_tags and self.skip_depth > 0:
+            self.skip_depth -= 1
+        elif tag in block_tags:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip_depth == 0:
+            self.parts.append(data)
+
+    def text(self):
+        return "".join(self.parts)
+
+
+# 커넥션 풀을 공유하는 세션 (스레드마다 새로 만들지 않는다)
+session = requests.Session()
+session.headers.update(headers)
+adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=1)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
+# 호스트별 동시 요청 수 제한
+host_semaphores = defaultdict(lambda: threading.BoundedSemaphore(per_host_limit))
+host_semaphores_lock = threading.Lock()
+
+
+@contextmanager
+def host_slot(url):
+    host = urlparse(url).netloc.lower()
+    with host_semaphores_lock:
+        semaphore = host_semaphores[host]
+
+    with semaphore:
+        yield
+
+
+class FetchError(Exception):
+    pass
+
+
+def detect_encoding(content_type, first_chunk):
+    # 헤더에 charset이 있으면 그것을, 없으면 문서 앞부분의 meta 태그를, 그래도 없으면 utf-8을 사용한다.
+    for source in (content_type.encode("latin-1", errors="ignore"), first_chunk[:4096]):
+        match = meta_charset.search(source)
+        if match:
+            encoding = match.group(1).decode("ascii", errors="ignore")
+            try:
+                codecs.lookup(encoding)
+                return encoding
+            except LookupError:
+                pass
+    return "utf-8"
+
+
+def fetch_text(url, max_bytes=max_bytes, total_timeout=total_timeout):
+    """
+    웹페이지를 스트리밍으로 내려받으면서 바로 텍스트로 변환한다.
+    max_bytes를 넘거나 total_timeout이 지나면 그때까지 읽은 내용만 사용한다.
+
+    Args:
+        url (str): 웹페이지 주소
+        max_bytes (int): 읽을 최대 바이트 수
+        total_timeout (float): 전체 다운로드 제한 시간(초)
+
+    Returns:
+        str: 공백이 정리된 본문 텍스트
+    """
+    started = time.monotonic()
+
+    with host_slot(url):
+        with session.get(url, stream=True, timeout=(connect_timeout, read_timeout)) as response:
+            response.raise_for_status()
+
+            content_type = response.headers.get("Content-Type", "").lower()
+            if content_type and "html" not in content_type and "text" not in content_type:
+                raise FetchError(f"지원하지 않는 Content-Type: {content_type} ({url})")
+
+            is_html = "html" in content_type or not content_type
+            decoder = None
+            extractor = HTMLTextExtractor() if is_html else None
+            plain_parts = []
+
+            read_bytes = 0
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if decoder is None:
+                    encoding = detect_encoding(content_type, chunk)
+                    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+                read_bytes += len(chunk)
+                text = decoder.decode(chunk)
+
+                if extractor is not None:
+                    extractor.feed(text)
+                else:
+                    plain_parts.append(text)
+
+                if read_bytes >= max_bytes:
+                    print(f"최대 크기({max_bytes} bytes) 초과로 읽기 중단: {url}")
+                    break
+                if time.monotonic() - started > total_timeout:
+                    print(f"제한 시간({total_timeout}초) 초과로 읽기 중단: {url}")
+                    break
+
+            tail = decoder.decode(b"", final=True) if decoder is not None else ""
+
+    if extractor is not None:
+        extractor.feed(tail)
+        extractor.close()
+        raw_content = extractor.text()
+    else:
+        plain_parts.append(tail)
+        raw_content = "".join(plain_parts)
+
+    return normalize_whitespace(raw_content)
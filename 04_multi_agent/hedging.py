@@ -0,0 +1,245 @@
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from langgraph.constants import TAG_NOSTREAM
+
+from concurrent.futures import wait, FIRST_COMPLETED
+from collections import defaultdict, deque
+import threading
+import asyncio
+import time
+
+from scheduler import scheduler, queue_waits
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Hedger:
+    """
+    같은 요청을 여러 번 보내도 되는(idempotent) 비스트리밍 호출의 꼬리 지연을 줄인다.
+
+    호출 위치(site)마다 최근 지연 시간(요청 스케줄러에서 기다린 시간은 뺀다)을 기록하고,
+    - 첫 요청이 그 위치의 p95를 넘기면 같은 요청을 한 번 더 보내고 먼저 끝난 결과를 쓴다. (hedging)
+      스케줄러에 기다리는 요청이 있으면 대기열만 늘어나므로 hedging하지 않는다.
+    - 그 위치의 p99 * timeout_factor(기록이 적을 때는 default_timeout)가 지나면 타임아웃으로 세고, 응답은 계속 기다린다.
+    """
+
+    def __init__(self, min_samples=20, window=200, timeout_factor=3.0, min_timeout=10.0, default_timeout=120.0, max_workers=16,
+                 scheduler=None):
+        self.min_samples = min_samples         # 이만큼 기록이 쌓이기 전에는 hedging하지 않는다.
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.default_timeout = default_timeout
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(lambda: deque(maxlen=window))  # site -> 요청 한 번의 지연 시간 (hedging 판단용)
+        self.delivered = defaultdict(lambda: deque(maxlen=window))  # site -> 호출자가 결과를 받기까지 걸린 시간
+        self.primary = defaultdict(lambda: deque(maxlen=window))    # site -> hedging이 없었다면 걸렸을 시간 (첫 요청)
+        self.counts = defaultdict(lambda: {"calls": 0, "hedged": 0, "hedge_wins": 0, "queued_skips": 0, "timeouts": 0})
+        self.scheduler = scheduler # 대기열이 있으면 hedging하지 않는다. (None이면 확인하지 않음)
+        self.executor = ContextThreadPoolExecutor(max_workers=max_workers)
+        self.losing_tasks = set() # 비동기 호출에서 진 요청 (끝까지 기다려 지연 시간을 기록한다)
+
+    def hedge_delay(self, site):
+        # 기록이 충분하면 p95, 아니면 None (hedging 안 함)
+        with self.lock:
+            samples = list(self.latencies[site])
+        if not self.enabled or len(samples) < self.min_samples:
+            return None
+        return percentile(samples, 0.95)
+
+    def timeout(self, site):
+        with self.lock:
+            samples = list(self.latencies[site])
+        if len(samples) < self.min_samples:
+            return self.default_timeout
+        return max(self.min_timeout, percentile(samples, 0.99) * self.timeout_factor)
+
+    def record_attempt(self, site, seconds, is_primary):
+        with self.lock:
+            self.latencies[site].append(seconds)
+            if is_primary:
+                self.primary[site].append(seconds)
+
+    def record_call(self, site, seconds, hedged, hedge_won):
+        with self.lock:
+            counts = self.counts[site]
+            counts["calls"] += 1
+            counts["hedged"] += hedged
+            counts["hedge_wins"] += hedge_won
+            self.delivered[site].append(seconds)
+
+    def record_timeout(self, site):
+        with self.lock:
+            self.counts[site]["timeouts"] += 1
+
+    def can_hedge(self, site):
+        # 스케줄러가 요청을 기다리게 하고 있으면 한 번 더 보내도 대기열만 늘어난다.
+        if self.scheduler is not None and self.scheduler.queued():
+            with self.lock:
+                self.counts[site]["queued_skips"] += 1
+            return False
+        return True
+
+    def measured(self, started, waits):
+        # 요청 한 번의 지연 시간 (스케줄러에서 자리를 기다린 시간은 뺀다)
+        return max(0.0, time.perf_counter() - started - sum(waits))
+
+    def call(self, site, fn, *args, hedge_fn=None, **kwargs):
+        """
+        fn(*args, **kwargs)를 실행하고, 느리면 한 번 더 보내서 먼저 끝난 결과를 반환한다.
+
+        Args:
+            site (str): 호출 위치 이름 (지연 시간 통계의 단위)
+            fn (callable): 같은 인자로 여러 번 호출해도 되는 함수
+            hedge_fn (callable): 두 번째 요청에 쓸 함수 (기본값은 fn)
+
+        Returns:
+            fn의 결과 (타임아웃이 지나도 예외를 내지 않고 먼저 끝나는 요청을 기다린다)
+        """
+        started = time.perf_counter()
+        deadline = started + self.timeout(site)
+        delay = self.hedge_delay(site)
+
+        def attempt(is_primary):
+            # 스레드마다 컨텍스트가 복사되므로 요청마다 따로 스케줄러 대기 시간을 모은다.
+            waits = []
+            queue_waits.set(waits)
+            attempt_started = time.perf_counter()
+            result = (fn if is_primary else hedge_fn or fn)(*args, **kwargs)
+            self.record_attempt(site, self.measured(attempt_started, waits), is_primary)
+            return result
+
+        primary = self.executor.submit(attempt, True)
+        pending = {primary}
+        hedged = False
+        errors = []
+
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done and self.can_hedge(site):
+                pending.add(self.executor.submit(attempt, False))
+                hedged = True
+
+        timed_out = False
+        while pending:
+            timeout = None if timed_out else max(0.0, deadline - time.perf_counter())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 한 번 느린 응답 때문에 턴 전체를 실패시키지 않는다. 타임아웃으로 세고 계속 기다린다.
+                self.record_timeout(site)
+                timed_out = True
+                print(f"{site}: {deadline - started:.1f}초 안에 응답이 없어 계속 기다립니다.")
+                continue
+
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                # 늦게 끝난 요청은 결과만 버린다. (스레드는 취소할 수 없으므로 끝까지 실행된다)
+                self.record_call(site, time.perf_counter() - started, hedged=hedged, hedge_won=future is not primary)
+                return future.result()
+
+        raise errors[0]
+
+    async def acall(self, site, fn, *args, hedge_fn=None, **kwargs):
+        """
+        call의 비동기 버전. fn은 코루틴 함수이다.
+        진 요청도 이미 보낸 요청이므로 취소하지 않고 끝까지 기다려 지연 시간을 기록한다.
+        """
+        started = time.perf_counter()
+        deadline = started + self.timeout(site)
+        delay = self.hedge_delay(site)
+
+        async def attempt(is_primary):
+            waits = []
+            queue_waits.set(waits) # task마다 컨텍스트가 따로 있다.
+            attempt_started = time.perf_counter()
+            result = await (fn if is_primary else hedge_fn or fn)(*args, **kwargs)
+            self.record_attempt(site, self.measured(attempt_started, waits), is_primary)
+            return result
+
+        primary = asyncio.ensure_future(attempt(True))
+        pending = {primary}
+        hedged = False
+        errors = []
+
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.can_hedge(site):
+                    pending.add(asyncio.ensure_future(attempt(False)))
+                    hedged = True
+
+            timed_out = False
+            while pending:
+                timeout = None if timed_out else max(0.0, deadline - time.perf_counter())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.record_timeout(site)
+                    timed_out = True
+                    print(f"{site}: {deadline - started:.1f}초 안에 응답이 없어 계속 기다립니다.")
+                    continue
+
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    self.record_call(site, time.perf_counter() - started, hedged=hedged, hedge_won=task is not primary)
+                    for loser in pending:
+                        self.losing_tasks.add(loser)
+                        loser.add_done_callback(self.forget_losing_task)
+                    pending = set()
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        raise errors[0]
+
+    def forget_losing_task(self, task):
+        self.losing_tasks.discard(task)
+        if not task.cancelled():
+            task.exception() # 진 요청의 예외는 무시한다.
+
+    def invoke(self, site, runnable, input):
+        # 두 번째 요청은 LangGraph의 messages 스트림에 나가지 않도록 nostream 태그를 붙인다. (토큰이 두 번 나가지 않게)
+        return self.call(site, runnable.invoke, input, hedge_fn=lambda input: runnable.invoke(input, config={"tags": [TAG_NOSTREAM]}))
+
+    async def ainvoke(self, site, runnable, input):
+        return await self.acall(site, runnable.ainvoke, input, hedge_fn=lambda input: runnable.ainvoke(input, config={"tags": [TAG_NOSTREAM]}))
+
+    def stats(self):
+        with self.lock:
+            sites = {}
+            for site, counts in self.counts.items():
+                delivered = list(self.delivered[site])
+                primary = list(self.primary[site])
+                sites[site] = {
+                    **counts,
+                    "hedge_rate": counts["hedged"] / counts["calls"] if counts["calls"] else 0.0,
+                    "p50": percentile(delivered, 0.5),
+                    "p95": percentile(delivered, 0.95),
+                    "p99": percentile(delivered, 0.99),
+                    "p99_without_hedging": percentile(primary, 0.99),
+                }
+        return sites
+
+    def report(self):
+        lines = ["hedging (p99: 실제 / hedging이 없었다면)"]
+        for site, row in sorted(self.stats().items()):
+            p99 = f"{row['p99']:.2f}s" if row["p99"] is not None else "-"
+            p99_without = f"{row['p99_without_hedging']:.2f}s" if row["p99_without_hedging"] is not None else "-"
+            lines.append(
+                f"- {site}: 호출 {row['calls']}회 | hedge {row['hedged']}회 ({row['hedge_rate']:.0%}, 이김 {row['hedge_wins']}회, "
+                f"대기열 때문에 건너뜀 {row['queued_skips']}회) "
+                f"| 타임아웃 {row['timeouts']}회 | p99 {p99} / {p99_without}"
+            )
+        return "\n".join(lines)
+
+
+# 모듈 전체에서 공유하는 hedger
+hedger = Hedger(scheduler=scheduler)
@@ -0,0 +1,133 @@
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+# 사용자에게 보이지 않는 AI팀 내부 메시지의 머리말
+internal_prefixes = (
+    "[Supervisor]",
+    "[Business Analyst]",
+    "[WEB SEARCH AGENT]",
+    "[VECTOR SEARCH AGENT]",
+    "[OUTLINE REVIEW AGENT]",
+    "[Content Strategist]",
+)
+
+
+def message_text(message):
+    return message if isinstance(message, str) else str(message.content)
+
+
+def message_role(message):
+    if isinstance(message, HumanMessage):
+        return "user"
+    if isinstance(message, SystemMessage):
+        return "system"
+    return "ai"
+
+
+def is_internal(message):
+    return isinstance(message, AIMessage) and message_text(message).lstrip().startswith(internal_prefixes)
+
+
+def format_messages(messages):
+    return "\n".join(f"{message_role(m)}: {message_text(m).strip()}" for m in messages)
+
+
+class HistoryManager:
+    """
+    최근 keep_turns개의 대화 턴은 그대로 두고, 그보다 오래된 메시지는 누적 요약(digest)으로 압축한다.
+    요약은 새로 밀려난 메시지에 대해서만 한 번씩 수행한다.
+    """
+
+    def __init__(self, keep_turns=3, max_recent_messages=30, min_batch=6):
+        self.keep_turns = keep_turns                    # 그대로 보여줄 최근 사용자 턴 수
+        self.max_recent_messages = max_recent_messages  # 한 턴이 길어질 때를 대비한 최근 메시지 상한
+        self.min_batch = min_batch                      # 요약할 메시지가 이만큼 쌓였을 때만 요약
+        self.digest = ""
+        self.summarized_until = 0                       # messages[:summarized_until]는 digest에 반영됨
+
+    def first_index(self, messages):
+        # 맨 앞의 시스템 메시지는 요약하지 않고 항상 보여준다.
+        return 1 if messages and isinstance(messages[0], SystemMessage) else 0
+
+    def recent_start(self, messages):
+        human_indexes = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        start = self.first_index(messages)
+        if len(human_indexes) > self.keep_turns:
+            start = human_indexes[-self.keep_turns]
+        return max(start, len(messages) - self.max_recent_messages)
+
+    def pending(self, messages):
+        # 아직 요약에 반영되지 않았고, 최근 구간에서도 밀려난 메시지
+        start = max(self.summarized_until, self.first_index(messages))
+        end = self.recent_start(messages)
+        if end - start < self.min_batch:
+            return start, start
+        return start, end
+
+    def compact(self, messages, summarize):
+        """
+        Args:
+            messages (list): state["messages"]
+            summarize (callable): (이전 요약, 새로 요약할 대화 문자열) -> 새 요약
+
+        Returns:
+            bool: 요약을 새로 만들었는지 여부
+        """
+        start, end = self.pending(messages)
+        if start == end:
+            return False
+
+        self.digest = summarize(self.digest, format_messages(messages[start:end]))
+        self.summarized_until = end
+        return True
+
+    async def acompact(self, messages, asummarize):
+        start, end = self.pending(messages)
+        if start == end:
+            return False
+
+        self.digest = await asummarize(self.digest, format_messages(messages[start:end]))
+        self.summarized_until = end
+        return True
+
+    def view(self, messages, user_facing=False):
+        """
+        프롬프트에 넣을 대화 내용 문자열을 만든다.
+        user_facing이면 supervisor 메시지와 지난 턴의 내부 메시지를 뺀다.
+        """
+        lines = []
+
+        first = self.first_index(messages)
+        if first:
+            lines.append(f"system: {message_text(messages[0]).strip()}")
+
+        if self.digest:
+            lines.append(f"(이전 대화 요약)\n{self.digest.strip()}")
+
+        recent = messages[max(self.summarized_until, first):]
+
+        # 현재 턴(마지막 사용자 발언 이후)의 시작 위치
+        current_turn = 0
+        for i, m in enumerate(recent):
+            if isinstance(m, HumanMessage):
+                current_turn = i
+
+        for i, m in enumerate(recent):
+            if user_facing and is_internal(m):
+                if i < current_turn or message_text(m).lstrip().startswith("[Supervisor]"):
+                    continue
+            lines.append(f"{message_role(m)}: {message_text(m).strip()}")
+
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "digest": self.digest,
+            "summarized_until": self.summarized_until,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        history = cls()
+        history.digest = data.get("digest", "")
+        history.summarized_until = data.get("summarized_until", 0)
+        return history
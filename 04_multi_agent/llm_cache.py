@@ -0,0 +1,276 @@
+from openai import DefaultHttpxClient, DefaultAsyncHttpxClient
+from openai._constants import DEFAULT_CONNECTION_LIMITS
+
+import threading
+import hashlib
+import asyncio
+import base64
+import httpx
+import gzip
+import json
+import time
+import re
+import os
+
+from scheduler import scheduler
+from tracing import tracer
+
+modes = ["passthrough", "record", "replay"]
+timings = ["original", "fast"]
+
+# 응답을 다시 만들 때 필요한 헤더만 저장한다.
+kept_headers = ["content-type", "content-encoding"]
+
+# 프롬프트에 들어가는 현재 시각(현재시각은 ..., task의 done_at 등). 키를 만들 때는 지운다.
+timestamp_pattern = re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?")
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def request_key(request):
+    """
+    요청 본문(model, messages, tools, temperature 등)이 정확히 같으면 같은 키가 나온다.
+    json의 키 순서와 공백, 프롬프트 안의 시각(YYYY-MM-DD HH:MM:SS)은 무시한다.
+    (시각이 바뀔 때마다 키가 달라지면 기록한 응답을 재생할 수 없다)
+    """
+    body = request.content or b""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except ValueError:
+        pass
+    body = timestamp_pattern.sub("<time>", body.decode("utf-8", errors="replace")).encode("utf-8")
+    return hashlib.sha256(request.method.encode() + b" " + request.url.path.encode() + b"\n" + body).hexdigest()
+
+
+class ResponseCache:
+    """
+    OpenAI API 응답을 디스크에 기록하고 다시 재생하는 캐시. (httpx transport 단계에서 동작)
+
+    - passthrough: 캐시를 사용하지 않는다.
+    - record: 기록된 응답이 있으면 재생하고, 없으면 API를 호출해서 기록한다.
+    - replay: 기록된 응답만 재생한다. 없으면 CacheMiss (CI 벤치마크용)
+
+    스트리밍 응답은 chunk마다 도착 간격을 함께 기록해서, 원래 속도(original) 또는 최대 속도(fast)로 재생한다.
+    """
+
+    def __init__(self, cache_dir, mode="passthrough", timing="fast"):
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.timing = timing
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "recorded": 0}
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, key, request, status_code, headers, chunks):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {
+            "path": request.url.path,
+            "status_code": status_code,
+            "headers": headers,
+            # [앞 chunk로부터의 간격(초), base64로 인코딩한 chunk]
+            "chunks": [[round(delay, 4), base64.b64encode(chunk).decode("ascii")] for delay, chunk in chunks],
+        }
+        # 다른 스레드가 같은 키를 읽는 중에 반쯤 쓴 파일을 보지 않도록 임시 파일에 쓰고 바꾼다.
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+        self.count("recorded")
+
+    def lookup(self, request):
+        # 재생할 응답을 찾는다. record 모드에서 없으면 None (API 호출), replay 모드에서 없으면 CacheMiss
+        key = request_key(request)
+        entry = self.load(key)
+        if entry is not None:
+            self.count("hits")
+            return key, entry
+
+        self.count("misses")
+        if self.mode == "replay":
+            raise CacheMiss(f"기록된 응답이 없습니다: {request.method} {request.url.path} ({key[:12]})")
+        return key, None
+
+    def replay_response(self, request, entry, stream):
+        return httpx.Response(
+            status_code=entry["status_code"],
+            headers=entry["headers"],
+            stream=stream,
+            request=request,
+        )
+
+    def recorded_headers(self, response):
+        return {name: response.headers[name] for name in kept_headers if name in response.headers}
+
+    def http_client(self, event_hooks=None):
+        # ChatOpenAI(http_client=...), OpenAIEmbeddings(http_client=...)에 넘긴다.
+        return DefaultHttpxClient(
+            transport=RecordReplayTransport(self, httpx.HTTPTransport(limits=DEFAULT_CONNECTION_LIMITS)),
+            event_hooks=event_hooks,
+        )
+
+    def async_http_client(self, event_hooks=None):
+        return DefaultAsyncHttpxClient(
+            transport=AsyncRecordReplayTransport(self, httpx.AsyncHTTPTransport(limits=DEFAULT_CONNECTION_LIMITS)),
+            event_hooks=event_hooks,
+        )
+
+    def report(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return f"LLM 응답 캐시 ({self.mode}, {self.timing}): 재생 {counts['hits']}회 | 없음 {counts['misses']}회 | 기록 {counts['recorded']}회"
+
+
+class ReplayStream(httpx.SyncByteStream):
+    def __init__(self, chunks, timing):
+        self.chunks = chunks
+        self.timing = timing
+
+    def __iter__(self):
+        for delay, chunk in self.chunks:
+            if self.timing == "original" and delay > 0:
+                time.sleep(delay)
+            yield base64.b64decode(chunk)
+
+
+class AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, chunks, timing):
+        self.chunks = chunks
+        self.timing = timing
+
+    async def __aiter__(self):
+        for delay, chunk in self.chunks:
+            if self.timing == "original" and delay > 0:
+                await asyncio.sleep(delay)
+            yield base64.b64decode(chunk)
+
+
+class RecordingStream(httpx.SyncByteStream):
+    # 응답을 그대로 넘기면서 chunk와 도착 간격을 모으고, 끝까지 받으면 저장한다.
+    def __init__(self, cache, key, request, response):
+        self.cache = cache
+        self.key = key
+        self.request = request
+        self.response = response
+
+    def __iter__(self):
+        chunks = []
+        last = time.perf_counter()
+        for chunk in self.response.stream:
+            now = time.perf_counter()
+            chunks.append((now - last, chunk))
+            last = now
+            yield chunk
+        if self.response.status_code == 200:
+            self.cache.save(self.key, self.request, self.response.status_code, self.cache.recorded_headers(self.response), chunks)
+
+    def close(self):
+        self.response.close()
+
+
+class AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, cache, key, request, response):
+        self.cache = cache
+        self.key = key
+        self.request = request
+        self.response = response
+
+    async def __aiter__(self):
+        chunks = []
+        last = time.perf_counter()
+        async for chunk in self.response.stream:
+            now = time.perf_counter()
+            chunks.append((now - last, chunk))
+            last = now
+            yield chunk
+        if self.response.status_code == 200:
+            await asyncio.to_thread(
+                self.cache.save, self.key, self.request, self.response.status_code, self.cache.recorded_headers(self.response), chunks
+            )
+
+    async def aclose(self):
+        await self.response.aclose()
+
+
+class RecordReplayTransport(httpx.BaseTransport):
+    def __init__(self, cache, transport):
+        self.cache = cache
+        self.transport = transport
+
+    def handle_request(self, request):
+        if self.cache.mode == "passthrough":
+            return self.transport.handle_request(request)
+
+        key, entry = self.cache.lookup(request)
+        if entry is not None:
+            return self.cache.replay_response(request, entry, ReplayStream(entry["chunks"], self.cache.timing))
+
+        response = self.transport.handle_request(request)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=RecordingStream(self.cache, key, request, response),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRecordReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cache, transport):
+        self.cache = cache
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        if self.cache.mode == "passthrough":
+            return await self.transport.handle_async_request(request)
+
+        # 캐시 파일 읽기는 스레드에서 한다.
+        key, entry = await asyncio.to_thread(self.cache.lookup, request)
+        if entry is not None:
+            return self.cache.replay_response(request, entry, AsyncReplayStream(entry["chunks"], self.cache.timing))
+
+        response = await self.transport.handle_async_request(request)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=AsyncRecordingStream(self.cache, key, request, response),
+            request=request,
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# 모듈 전체에서 공유하는 응답 캐시 (환경변수 또는 --llm-cache 옵션으로 모드를 정한다)
+current_path = os.path.dirname(os.path.abspath(__file__))
+response_cache = ResponseCache(
+    f"{current_path}/data/llm_cache",
+    mode=os.getenv("LLM_CACHE_MODE", "passthrough"),
+    timing=os.getenv("LLM_CACHE_TIMING", "fast"),
+)
+# 응답 헤더의 계정 한도를 요청 스케줄러에 반영하고, openai SDK의 재시도를 tracing span에 기록한다.
+http_client = response_cache.http_client(
+    event_hooks={"request": [tracer.observe_request], "response": [scheduler.observe_response]}
+)
+async_http_client = response_cache.async_http_client(
+    event_hooks={"request": [tracer.aobserve_request], "response": [scheduler.aobserve_response]}
+)
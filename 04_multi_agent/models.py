@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Literal
+from typing import List, Literal
 
 
 class Task(BaseModel):
@@ -30,4 +30,36 @@ class Task(BaseModel):
             "done": self.done,
             "description": self.description,
             "done_at": self.done_at
-        }    
\ No newline at end of file
+        }    
+
+class OutlineRevisionPlan(BaseModel):
+    full_rewrite: bool = Field(
+        ...,
+        description="목차의 전체 구조(chapter 구성, 순서, 책의 방향)를 바꿔야 하면 True. 일부 chapter만 고치면 되면 False."
+    )
+    chapters_to_revise: List[int] = Field(
+        ...,
+        description="내용을 수정해야 하는 chapter 번호(1부터 시작)의 목록. 없으면 []"
+    )
+    chapters_to_add: List[str] = Field(
+        ...,
+        description="목차 끝에 새로 추가할 chapter의 제목 목록. 없으면 []"
+    )
+    revise_preamble: bool = Field(
+        ...,
+        description="기획의도, 책 제목, chapter 소개 등 목차 앞부분을 수정해야 하면 True"
+    )
+    reason: str = Field(..., description="이번 목차 수정의 주안점과 각 chapter를 고치는 이유")
+
+
+class ChapterReview(BaseModel):
+    meets_request: bool = Field(..., description="이 chapter가 사용자의 요구사항을 충족시키는지 여부")
+    issues: List[str] = Field(
+        ...,
+        description="논리적 흐름, 근거 없는 내용, 참고자료 활용 부족 등 문제점 목록. 없으면 []"
+    )
+    urls_to_remove: List[str] = Field(
+        ...,
+        description="example.com 같은 더미 URL이나 실제 페이지가 아닌 대표 URL 등 삭제해야 하는 URL 목록. 없으면 []"
+    )
+    needs_more_references: bool = Field(..., description="이 chapter를 보강하기 위해 자료 검색이 더 필요한지 여부")
@@ -0,0 +1,253 @@
+import numpy as np
+
+import hashlib
+import re
+import os
+
+from utils import sqlite_connection
+
+# MinHash 설정: num_perm = bands * band_rows
+# bands=16, band_rows=8이면 Jaccard 유사도 약 0.7부터 후보로 잡히고, 최종 판정은 threshold로 한다.
+num_perm = 128
+bands = 16
+band_rows = 8
+shingle_size = 5 # 글자 단위 shingle (한국어는 띄어쓰기가 들쭉날쭉하므로 글자 단위가 안정적이다)
+
+mersenne_prime = np.uint64((1 << 61) - 1)
+max_hash = np.uint64((1 << 32) - 1)
+
+# 프로세스가 달라도 같은 서명이 나오도록 고정된 seed로 순열 계수를 만든다.
+permutation_random = np.random.RandomState(1)
+permutation_a = permutation_random.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+permutation_b = permutation_random.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def shingles(text, k=shingle_size):
+    text = normalize_text(text)
+    if len(text) <= k:
+        return {text}
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def minhash(text):
+    """
+    본문의 MinHash 서명을 만든다.
+
+    Returns:
+        np.ndarray: uint32 num_perm개
+    """
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles(text)],
+        dtype=np.uint64,
+    )
+    # (a * h + b) mod p 를 순열마다 계산하고 최솟값을 남긴다.
+    permuted = (np.outer(hashes, permutation_a) + permutation_b) % mersenne_prime
+    return (permuted.min(axis=0) & max_hash).astype(np.uint32)
+
+
+def similarity(signature_a, signature_b):
+    # 서명이 같은 위치의 비율 = Jaccard 유사도 추정값
+    return float(np.mean(signature_a == signature_b))
+
+
+def band_keys(signature):
+    return [(band, signature[band * band_rows:(band + 1) * band_rows].tobytes()) for band in range(bands)]
+
+
+class NearDupIndex:
+    """
+    저장된 chunk의 MinHash 서명과 LSH 버킷을 기록하는 SQLite 인덱스.
+    임베딩하기 전에 이미 저장된 chunk와 거의 같은 chunk를 찾아낸다.
+
+    건너뛴 chunk가 어떤 chunk와 같았는지(duplicates)도 기록해서,
+    대표 chunk가 지워지면 건너뛴 chunk의 URL을 다시 저장하도록 알려준다. (remove_sources)
+    """
+
+    def __init__(self, db_path, threshold=0.85):
+        self.db_path = db_path
+        self.threshold = threshold
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS signatures (
+                    chunk_id TEXT PRIMARY KEY,
+                    source TEXT,
+                    signature BLOB
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS buckets (
+                    band INTEGER,
+                    bucket BLOB,
+                    chunk_id TEXT
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS duplicates (
+                    chunk_id TEXT PRIMARY KEY,
+                    source TEXT,
+                    duplicate_of TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS duplicates_of ON duplicates (duplicate_of)")
+            conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (band, bucket)")
+            conn.execute("CREATE INDEX IF NOT EXISTS signatures_source ON signatures (source)")
+
+    def connect(self):
+        return sqlite_connection(self.db_path)
+
+    def is_empty(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT 1 FROM signatures LIMIT 1").fetchone() is None
+
+    def find(self, conn, signature, exclude_sources=()):
+        # 같은 버킷에 들어간 후보 중 유사도가 threshold 이상인 chunk ID
+        candidates = set()
+        for band, bucket in band_keys(signature):
+            rows = conn.execute("SELECT chunk_id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket))
+            candidates.update(row[0] for row in rows)
+
+        for candidate in candidates:
+            row = conn.execute("SELECT source, signature FROM signatures WHERE chunk_id = ?", (candidate,)).fetchone()
+            if row is None or row[0] in exclude_sources:
+                continue
+            if similarity(signature, np.frombuffer(row[1], dtype=np.uint32)) >= self.threshold:
+                return candidate
+        return None
+
+    def filter(self, chunks, exclude_sources=()):
+        """
+        이미 저장된 chunk나 같은 배치의 앞선 chunk와 거의 같은 chunk를 걸러낸다.
+
+        Args:
+            chunks (list[tuple[str, str, str]]): (chunk_id, source, 본문) 목록
+            exclude_sources (set): 비교 대상에서 뺄 source (본문이 바뀌어 곧 지워질 URL)
+
+        Returns:
+            tuple: (남길 chunk의 (chunk_id, source, 서명) 목록, 건너뛴 {chunk_id: 중복 대상 chunk_id})
+        """
+        kept = []
+        skipped = {}
+        batch_buckets = {} # 같은 배치 안의 중복 확인용
+
+        with self.connect() as conn:
+            for chunk_id, source, text in chunks:
+                signature = minhash(text)
+
+                duplicate_of = self.find(conn, signature, exclude_sources)
+                if duplicate_of is None:
+                    for key in band_keys(signature):
+                        for other_id, other_signature in batch_buckets.get(key, []):
+                            if similarity(signature, other_signature) >= self.threshold:
+                                duplicate_of = other_id
+                                break
+                        if duplicate_of:
+                            break
+
+                if duplicate_of is not None and duplicate_of != chunk_id:
+                    skipped[chunk_id] = duplicate_of
+                    continue
+
+                kept.append((chunk_id, source, signature))
+                for key in band_keys(signature):
+                    batch_buckets.setdefault(key, []).append((chunk_id, signature))
+
+        return kept, skipped
+
+    def add(self, entries):
+        """
+        entries: (chunk_id, source, 서명)의 리스트
+        """
+        with self.connect() as conn:
+            for chunk_id, source, signature in entries:
+                conn.execute("DELETE FROM buckets WHERE chunk_id = ?", (chunk_id,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO signatures (chunk_id, source, signature) VALUES (?, ?, ?)",
+                    (chunk_id, source, signature.tobytes()),
+                )
+                conn.executemany(
+                    "INSERT INTO buckets (band, bucket, chunk_id) VALUES (?, ?, ?)",
+                    [(band, bucket, chunk_id) for band, bucket in band_keys(signature)],
+                )
+
+    def add_duplicates(self, entries):
+        """
+        entries: 건너뛴 chunk의 (chunk_id, source, 중복 대상 chunk_id) 리스트
+        """
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO duplicates (chunk_id, source, duplicate_of) VALUES (?, ?, ?)", entries
+            )
+
+    def remove_sources(self, sources):
+        """
+        chunk를 지운 URL(본문이 바뀌었거나 오래되어 지운 URL)의 서명을 지운다.
+
+        Returns:
+            list[str]: 지운 chunk와 같아서 건너뛰었던 chunk가 있는 다른 URL (이제 저장소에 그 내용이 없다)
+        """
+        sources = set(sources)
+        orphaned = set()
+        with self.connect() as conn:
+            for source in sources:
+                rows = conn.execute(
+                    """
+                    SELECT duplicates.source FROM duplicates
+                    JOIN signatures ON duplicates.duplicate_of = signatures.chunk_id
+                    WHERE signatures.source = ?
+                    """,
+                    (source,),
+                )
+                orphaned.update(row[0] for row in rows)
+                conn.execute(
+                    """
+                    DELETE FROM duplicates WHERE duplicate_of IN (SELECT chunk_id FROM signatures WHERE source = ?)
+                    """,
+                    (source,),
+                )
+                conn.execute("DELETE FROM duplicates WHERE source = ?", (source,))
+                conn.execute(
+                    "DELETE FROM buckets WHERE chunk_id IN (SELECT chunk_id FROM signatures WHERE source = ?)", (source,)
+                )
+                conn.execute("DELETE FROM signatures WHERE source = ?", (source,))
+        return sorted(orphaned - sources)
+
+    def vacuum(self):
+        with self.connect() as conn:
+            conn.execute("VACUUM")
+
+    def backfill(self, ids, sources, texts):
+        # 인덱스가 생기기 전에 Chroma에 저장된 chunk의 서명을 기록한다.
+        self.add([(chunk_id, source, minhash(text)) for chunk_id, source, text in zip(ids, sources, texts)])
+
+
+def collapse_near_duplicates(scored_docs, threshold=0.85):
+    """
+    검색 결과에서 거의 같은 문서는 관련도가 가장 높은 하나만 남긴다.
+
+    Args:
+        scored_docs (list[tuple[Document, float]]): (문서, 관련도) 목록
+
+    Returns:
+        list[tuple[Document, float]]: 관련도 순으로 정렬된 결과
+    """
+    kept = []
+    for doc, relevance in sorted(scored_docs, key=lambda item: item[1], reverse=True):
+        signature = minhash(doc.page_content)
+        if any(similarity(signature, other) >= threshold for _, _, other in kept):
+            continue
+        kept.append((doc, relevance, signature))
+
+    return [(doc, relevance) for doc, relevance, _ in kept]
@@ -0,0 +1,229 @@
+from utils import save_outline
+
+from datetime import datetime
+import json
+import os
+import re
+
+outline_starts_marker = ":---OUTLINE STARTS HERE:---:"
+chapter_divider = ":---CHAPTER DIVIDER---:"
+done_marker = "-----: DONE :-----"
+
+# 세부 목차의 첫 chapter 제목 (예: "## Chapter 1: 제목")
+first_chapter_pattern = re.compile(r"^[ \t]*#+\s*Chapter\s*1\b", re.MULTILINE | re.IGNORECASE)
+
+
+def chapter_title(chapter_text):
+    # chapter 본문에서 첫 번째 제목 줄을 찾는다.
+    for line in chapter_text.splitlines():
+        if line.strip().startswith("#"):
+            return line.strip().lstrip("#").strip()
+    return chapter_text.strip().split("\n", 1)[0][:50]
+
+
+def first_chapter_start(text, divider_index):
+    # 시작 표시 없이 chapter 구분자가 나오면 구분자 앞의 마지막 'Chapter 1' 제목부터 chapter 1로 본다.
+    # (머리말의 chapter 소개에도 같은 제목이 있으므로 마지막 것을 쓴다) 제목이 없으면 구분자 앞은 모두 머리말이다.
+    matches = list(first_chapter_pattern.finditer(text, 0, divider_index))
+    return matches[-1].start() if matches else divider_index
+
+
+def strip_outline_markers(text):
+    # 부분 작성 결과에 구분자가 섞여 있으면 목차 구조가 깨지므로 지운다.
+    for marker in (outline_starts_marker, chapter_divider, done_marker):
+        text = text.replace(marker, "")
+    return text.strip()
+
+
+def parse_outline(text):
+    """
+    목차 문자열을 머리말(preamble), chapter 목록, 작성 후기(review)로 나눈다.
+
+    Returns:
+        dict: {"preamble": str, "chapters": list[str], "review": str}
+    """
+    review = ""
+    if done_marker in text:
+        text, review = text.split(done_marker, 1)
+
+    preamble = ""
+    if outline_starts_marker in text:
+        preamble, text = text.split(outline_starts_marker, 1)
+    elif chapter_divider in text:
+        start = first_chapter_start(text, text.index(chapter_divider))
+        preamble, text = text[:start], text[start:]
+
+    chapters = [chapter.strip() for chapter in text.split(chapter_divider)]
+    chapters = [chapter for chapter in chapters if chapter]
+
+    return {
+        "preamble": preamble.strip(),
+        "chapters": chapters,
+        "review": review.strip(),
+    }
+
+
+def render_outline(outline):
+    parts = []
+    if outline["preamble"]:
+        parts.append(outline["preamble"])
+        parts.append(outline_starts_marker)
+
+    parts.append(f"\n\n{chapter_divider}\n\n".join(outline["chapters"]))
+
+    if outline["review"]:
+        parts.append(done_marker)
+        parts.append(outline["review"])
+
+    return "\n\n".join(parts) + "\n"
+
+
+class OutlineStore:
+    """
+    목차를 chapter 단위로 저장하고, 저장할 때마다 data/outline/versions/ 에 버전을 남긴다.
+    사람이 읽는 data/outline.md도 함께 갱신한다.
+    """
+
+    def __init__(self, current_path):
+        self.current_path = current_path
+        self.outline_dir = f"{current_path}/data/outline"
+        self.versions_dir = f"{self.outline_dir}/versions"
+        self.latest_path = f"{self.outline_dir}/outline.json"
+
+    def load(self):
+        """
+        Returns:
+            dict | None: 최신 버전 목차 (chapter마다 text와 version을 가진다)
+        """
+        if os.path.exists(self.latest_path):
+            with open(self.latest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        # 구조화 저장 이전의 outline.md만 있는 경우
+        outline_md = f"{self.current_path}/data/outline.md"
+        if os.path.exists(outline_md):
+            with open(outline_md, "r", encoding="utf-8") as f:
+                parsed = parse_outline(f.read())
+            return {
+                "version": 0,
+                "preamble": parsed["preamble"],
+                "chapters": [{"text": text, "version": 0} for text in parsed["chapters"]],
+                "review": parsed["review"],
+            }
+
+        return None
+
+    def save(self, preamble, chapter_texts, review, previous=None):
+        """
+        새 버전을 저장한다. 내용이 그대로인 chapter는 이전 chapter 버전을 유지한다.
+
+        Returns:
+            tuple: (저장된 목차 dict, 렌더링된 목차 문자열)
+        """
+        version = (previous["version"] if previous else 0) + 1
+        previous_chapters = previous["chapters"] if previous else []
+
+        chapters = []
+        for i, text in enumerate(chapter_texts):
+            if i < len(previous_chapters) and previous_chapters[i]["text"] == text:
+                chapters.append(previous_chapters[i])
+            else:
+                chapters.append({"text": text, "version": version})
+
+        outline = {
+            "version": version,
+            "saved_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "preamble": preamble,
+            "chapters": chapters,
+            "review": review,
+        }
+
+        os.makedirs(self.versions_dir, exist_ok=True)
+        with open(f"{self.versions_dir}/v{version:04d}.json", "w", encoding="utf-8") as f:
+            json.dump(outline, f, ensure_ascii=False)
+
+        tmp_path = self.latest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(outline, f, ensure_ascii=False)
+        os.replace(tmp_path, self.latest_path)
+
+        rendered = render_outline({
+            "preamble": preamble,
+            "chapters": chapter_texts,
+            "review": review,
+        })
+        save_outline(self.current_path, rendered)
+
+        return outline, rendered
+
+    def save_text(self, text):
+        # 한 번에 생성된 목차 문자열을 chapter 단위로 나눠 저장한다.
+        parsed = parse_outline(text)
+        return self.save(parsed["preamble"], parsed["chapters"], parsed["review"], previous=self.load())
+
+
+class ChapterStreamSplitter:
+    """
+    스트리밍으로 들어오는 목차에서 chapter 구분자가 나올 때마다 완성된 chapter를 꺼내 준다.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.start = None     # 현재 작성 중인 chapter의 시작 위치
+        self.scan_from = 0    # 구분자를 찾기 시작할 위치 (이미 확인한 부분은 다시 찾지 않는다)
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        Returns:
+            list[str]: 이번 chunk로 완성된 chapter 목록
+        """
+        self.buffer += chunk
+        if self.done:
+            return []
+
+        if self.start is None:
+            marker_index = self.buffer.find(outline_starts_marker)
+            if marker_index >= 0:
+                self.start = marker_index + len(outline_starts_marker)
+            elif chapter_divider in self.buffer:
+                # 시작 표시 없이 chapter가 나오는 경우 머리말은 chapter 1에 넣지 않는다.
+                self.start = first_chapter_start(self.buffer, self.buffer.index(chapter_divider))
+            else:
+                return []
+            self.scan_from = self.start
+
+        completed = []
+        while True:
+            divider_index = self.buffer.find(chapter_divider, self.scan_from)
+            done_index = self.buffer.find(done_marker, self.scan_from)
+
+            if done_index >= 0 and (divider_index < 0 or done_index < divider_index):
+                completed += self.take(done_index)
+                self.done = True
+                break
+
+            if divider_index < 0:
+                # 구분자가 chunk 경계에 걸쳐 있을 수 있으므로 끝부분은 다음에 다시 확인한다.
+                longest = max(len(chapter_divider), len(done_marker))
+                self.scan_from = max(self.start, len(self.buffer) - longest)
+                break
+
+            completed += self.take(divider_index)
+            self.start = divider_index + len(chapter_divider)
+            self.scan_from = self.start
+
+        return completed
+
+    def take(self, end):
+        text = self.buffer[self.start:end].strip()
+        return [text] if text else []
+
+    def finish(self):
+        # 스트림이 끝났을 때 남아 있는 마지막 chapter
+        if self.done:
+            return []
+        self.done = True
+        if self.start is None:
+            self.start = 0 # 구분자가 하나도 없으면 전체를 한 chapter로 본다.
+        return self.take(len(self.buffer))
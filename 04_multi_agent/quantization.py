@@ -0,0 +1,349 @@
+import numpy as np
+
+import threading
+import os
+
+modes = ["int8", "binary"]
+
+# 양자화된 코드로 top_k * rescore_factor개의 후보를 고르고, 원래 정밀도(float32)로 다시 점수를 매긴다.
+default_rescore_factor = 4
+
+# 한 번에 점수를 계산할 행 수 (int8 코드를 float로 바꿀 때 메모리가 한꺼번에 늘지 않도록)
+block_rows = 65536
+
+# 바이트별 1의 개수 (binary 코드의 hamming 거리 계산용)
+popcount_table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def truncate(vectors, dimensions):
+    """
+    text-embedding-3 벡터를 앞쪽 dimensions개만 남기고 다시 정규화한다.
+    API의 dimensions 옵션으로 받은 벡터와 같으므로, 저장된 벡터를 다시 임베딩하지 않고 줄일 수 있다.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dimensions is not None:
+        vectors = vectors[..., :dimensions]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors):
+    # 벡터마다 최댓값 기준으로 -127~127에 맞춘다. (점수 = 코드 내적 * scale)
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors):
+    # 부호만 남긴다. (차원당 1bit)
+    return np.packbits(vectors > 0, axis=1)
+
+
+def code_size(mode, dimensions):
+    return dimensions if mode == "int8" else (dimensions + 7) // 8
+
+
+def collection_fetcher(collection):
+    # Chroma 컬렉션에 저장된 임베딩을 ID로 읽는 함수 (후보를 다시 점수 매길 때 사용)
+    def fetch(ids):
+        stored = collection.get(ids=list(ids), include=["embeddings"])
+        return dict(zip(stored["ids"], stored["embeddings"]))
+    return fetch
+
+
+class QuantizedIndex:
+    """
+    정규화된 임베딩을 int8 또는 binary 코드로 메모리에 두고 검색하는 인덱스.
+
+    원래 벡터(float32)는 따로 저장하지 않고, 후보를 다시 점수 매길 때 fetch_vectors로 Chroma에서 읽는다.
+    파일은 모두 덧붙이기만 하고, 지운 행은 deleted.txt에 기록했다가 compact()로 정리한다.
+    """
+
+    def __init__(self, index_dir, dimensions, fetch_vectors, mode="int8", rescore_factor=default_rescore_factor):
+        if mode not in modes:
+            raise ValueError(f"지원하지 않는 양자화 방식입니다: {mode}")
+        self.index_dir = index_dir
+        self.dimensions = dimensions
+        self.fetch_vectors = fetch_vectors # ID 목록 -> {ID: 원래 벡터}
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+        self.row_bytes = code_size(mode, dimensions)
+        self.lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def load(self):
+        with open(self.path("ids.txt"), "a+", encoding="utf-8") as f:
+            f.seek(0)
+            self.ids = f.read().splitlines()
+        rows = len(self.ids)
+
+        # 쓰다가 멈춘 경우 파일 길이가 다를 수 있으므로 ids.txt의 행 수에 맞춘다.
+        self.codes = self.read_rows("codes.bin", np.int8 if self.mode == "int8" else np.uint8, self.row_bytes, rows)
+        self.scales = self.read_rows("scales.bin", np.float32, 1, rows)[:, 0] if self.mode == "int8" else None
+        self.deleted = np.zeros(rows, dtype=bool)
+        if os.path.exists(self.path("deleted.txt")):
+            with open(self.path("deleted.txt"), encoding="utf-8") as f:
+                for line in f:
+                    if line.strip() and int(line) < rows:
+                        self.deleted[int(line)] = True
+        self.rows = {id_: row for row, id_ in enumerate(self.ids) if not self.deleted[row]}
+
+    def read_rows(self, name, dtype, width, rows):
+        path = self.path(name)
+        if not os.path.exists(path) or rows == 0:
+            return np.zeros((0, width), dtype=dtype)
+        return np.fromfile(path, dtype=dtype, count=rows * width).reshape(rows, width)
+
+    def count(self):
+        with self.lock:
+            return len(self.rows)
+
+    def add(self, ids, vectors):
+        """
+        벡터를 정규화, 양자화해서 덧붙인다. 이미 있는 ID는 예전 행을 지우고 새로 추가한다. (upsert)
+
+        Args:
+            ids (list[str]): chunk ID
+            vectors (list[list[float]]): 임베딩 (dimensions보다 길면 잘라서 다시 정규화한다)
+        """
+        if not ids:
+            return
+        vectors = truncate(vectors, self.dimensions)
+        if self.mode == "int8":
+            codes, scales = quantize_int8(vectors)
+        else:
+            codes, scales = quantize_binary(vectors), None
+
+        with self.lock:
+            self.mark_deleted([self.rows[id_] for id_ in ids if id_ in self.rows])
+
+            with open(self.path("codes.bin"), "ab") as f:
+                f.write(codes.tobytes())
+            if scales is not None:
+                with open(self.path("scales.bin"), "ab") as f:
+                    f.write(scales.tobytes())
+            # ids.txt를 마지막에 써야 중간에 멈춰도 다른 파일보다 행이 많아지지 않는다.
+            with open(self.path("ids.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{id_}\n" for id_ in ids))
+
+            start = len(self.ids)
+            self.ids += list(ids)
+            self.codes = np.concatenate([self.codes, codes])
+            if scales is not None:
+                self.scales = np.concatenate([self.scales, scales])
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(ids), dtype=bool)])
+            for offset, id_ in enumerate(ids):
+                self.rows[id_] = start + offset
+
+    def remove(self, ids):
+        with self.lock:
+            self.mark_deleted([self.rows.pop(id_) for id_ in ids if id_ in self.rows])
+
+    def mark_deleted(self, rows):
+        if not rows:
+            return
+        self.deleted[rows] = True
+        with open(self.path("deleted.txt"), "a", encoding="utf-8") as f:
+            f.write("".join(f"{row}\n" for row in rows))
+
+    def coarse_scores(self, query):
+        # 양자화된 코드로 계산한 근사 점수 (클수록 가깝다)
+        if self.mode == "int8":
+            scores = np.empty(len(self.codes), dtype=np.float32)
+            for start in range(0, len(self.codes), block_rows):
+                block = self.codes[start:start + block_rows].astype(np.float32)
+                scores[start:start + block_rows] = (block @ query) * self.scales[start:start + block_rows]
+        else:
+            packed = quantize_binary(query[None, :])[0]
+            scores = -popcount_table[np.bitwise_xor(self.codes, packed)].sum(axis=1, dtype=np.int32).astype(np.float32)
+        scores[self.deleted] = -np.inf
+        return scores
+
+    def search(self, query_vectors, top_k=5):
+        """
+        검색어 벡터마다 가까운 chunk를 찾는다.
+
+        Returns:
+            list[list[tuple]]: 검색어마다 [(chunk ID, 거리)] (거리는 Chroma의 l2 거리 제곱과 같은 2 - 2 * cosine)
+        """
+        queries = truncate(query_vectors, self.dimensions)
+        with self.lock:
+            alive = len(self.rows)
+            if alive == 0:
+                return [[] for _ in queries]
+
+            candidate_ids = []
+            for query in queries:
+                scores = self.coarse_scores(query)
+                n_candidates = min(alive, top_k * self.rescore_factor)
+                candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+                candidate_ids.append([self.ids[row] for row in candidates])
+
+        # 모든 검색어의 후보를 한 번에 읽어서 원래 정밀도로 다시 점수를 매긴다. (Chroma에 없는 후보는 뺀다)
+        stored = self.fetch_vectors(sorted({id_ for ids in candidate_ids for id_ in ids}))
+        results = []
+        for query, ids in zip(queries, candidate_ids):
+            ids = [id_ for id_ in ids if id_ in stored]
+            if not ids:
+                results.append([])
+                continue
+            exact = truncate([stored[id_] for id_ in ids], self.dimensions) @ query
+            order = np.argsort(-exact)[:top_k]
+            results.append([(ids[i], float(2 - 2 * exact[i])) for i in order])
+        return results
+
+    def compact(self):
+        # 지운 행을 빼고 파일을 다시 쓴다.
+        with self.lock:
+            keep = np.flatnonzero(~self.deleted)
+            for name, data in [("codes.bin", self.codes[keep])] + (
+                [("scales.bin", self.scales[keep])] if self.mode == "int8" else []
+            ):
+                data.tofile(self.path(name + ".tmp"))
+                os.replace(self.path(name + ".tmp"), self.path(name))
+            with open(self.path("ids.txt.tmp"), "w", encoding="utf-8") as f:
+                f.write("".join(f"{self.ids[row]}\n" for row in keep))
+            os.replace(self.path("ids.txt.tmp"), self.path("ids.txt"))
+            # deleted.txt와 예전 버전이 만든 원래 벡터 사본(vectors.bin)은 더 이상 필요 없다.
+            for name in ["deleted.txt", "vectors.bin"]:
+                if os.path.exists(self.path(name)):
+                    os.remove(self.path(name))
+        self.load()
+
+    def memory_bytes(self):
+        # 검색할 때 메모리에 올라가는 크기 (코드 + scale)
+        with self.lock:
+            return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def stats(self):
+        rows = self.count()
+        memory = self.memory_bytes()
+        return {
+            "mode": self.mode,
+            "dimensions": self.dimensions,
+            "vectors": rows,
+            "deleted_rows": int(self.deleted.sum()),
+            "memory_bytes": memory,
+            "bytes_per_vector": memory / rows if rows else 0,
+        }
+
+
+def exact_neighbors(vectors, queries, top_k):
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :top_k]
+
+
+def recall_report(vectors, queries, configs, top_k=10, rescore_factor=default_rescore_factor):
+    """
+    원래 벡터(3072차원 float32)의 정확한 top_k를 기준으로, 차원 축소와 양자화 설정별 recall@top_k와 벡터당 크기를 잰다.
+    양자화 설정도 Chroma에 float32 벡터를 그대로 저장하므로, 검색할 때 메모리에 올리는 크기와 저장하는 전체 크기를 따로 잰다.
+
+    Args:
+        vectors (np.ndarray): 저장된 임베딩
+        queries (np.ndarray): 검색어 임베딩
+        configs (list[tuple]): [(dimensions, mode)] (mode가 None이면 float32 그대로)
+
+    Returns:
+        list[dict]: 설정별 {"dimensions", "mode", "bytes_per_vector", "stored_bytes_per_vector", "recall"}
+    """
+    import tempfile
+
+    vectors = truncate(vectors, None)
+    queries = truncate(queries, None)
+    truth = exact_neighbors(vectors, queries, top_k)
+    ids = [str(i) for i in range(len(vectors))]
+
+    rows = []
+    for dimensions, mode in configs:
+        if mode is None:
+            found = exact_neighbors(truncate(vectors, dimensions), truncate(queries, dimensions), top_k)
+            bytes_per_vector = dimensions * 4
+        else:
+            # Chroma 대신 메모리의 벡터에서 후보를 읽는다.
+            stored = truncate(vectors, dimensions)
+            fetch = lambda ids: {id_: stored[int(id_)] for id_ in ids}
+            with tempfile.TemporaryDirectory() as index_dir:
+                index = QuantizedIndex(index_dir, dimensions, fetch, mode=mode, rescore_factor=rescore_factor)
+                index.add(ids, vectors)
+                found = [[int(id_) for id_, _ in result] for result in index.search(queries, top_k)]
+                bytes_per_vector = index.stats()["bytes_per_vector"]
+
+        hits = sum(len(set(truth_row) & set(found_row)) for truth_row, found_row in zip(truth, found))
+        rows.append({
+            "dimensions": dimensions,
+            "mode": mode or "float32",
+            "bytes_per_vector": bytes_per_vector,
+            "stored_bytes_per_vector": dimensions * 4 + (bytes_per_vector if mode is not None else 0),
+            "recall": hits / (len(queries) * top_k),
+        })
+    return rows
+
+
+def format_recall_report(rows, top_k=10):
+    baseline = max(row["bytes_per_vector"] for row in rows)
+    lines = [f"차원/양자화별 recall@{top_k}과 벡터당 크기 (검색 메모리는 가장 큰 설정 기준, 저장은 Chroma의 float32 벡터 포함)"]
+    for row in rows:
+        lines.append(
+            f"- {row['dimensions']:>4}차원 {row['mode']:<7}: recall {row['recall']:.3f} "
+            f"| 검색 메모리 {row['bytes_per_vector']:.0f} bytes/벡터 ({baseline / row['bytes_per_vector']:.1f}배 적음) "
+            f"| 저장 {row['stored_bytes_per_vector']:.0f} bytes/벡터"
+        )
+    return "\n".join(lines)
+
+
+def read_collection(persist_directory, batch_size=1000):
+    # Chroma 저장소의 chunk를 (ids, embeddings, documents, metadatas) 배치로 읽는다.
+    import chromadb
+
+    client = chromadb.PersistentClient(path=persist_directory)
+    collection = client.get_collection("langchain")
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        yield batch["ids"], np.asarray(batch["embeddings"], dtype=np.float32), batch["documents"], batch["metadatas"]
+
+
+if __name__ == "__main__":
+    # 기존 chroma_store를 차원을 줄인 저장소로 옮기고 양자화 인덱스를 만든다. (다시 임베딩하지 않는다)
+    #   python quantization.py --dimensions 1024 --mode int8
+    #   python quantization.py --report-only
+    import argparse
+    import chromadb
+
+    current_path = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="chroma_store를 차원 축소/양자화 저장소로 옮기고 recall과 메모리를 비교한다.")
+    parser.add_argument("--source", default=f"{current_path}/data/chroma_store")
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--mode", choices=modes, default="int8")
+    parser.add_argument("--report-only", action="store_true", help="옮기지 않고 recall/메모리 비교만 출력")
+    parser.add_argument("--queries", type=int, default=200, help="recall을 잴 때 검색어로 쓸 저장된 chunk 수")
+    args = parser.parse_args()
+
+    batches = list(read_collection(args.source))
+    if not batches:
+        raise SystemExit(f"{args.source}에 저장된 chunk가 없습니다.")
+    all_vectors = np.concatenate([vectors for _, vectors, _, _ in batches])
+
+    if not args.report_only:
+        target = f"{args.source}_{args.dimensions}"
+        collection = chromadb.PersistentClient(path=target).get_or_create_collection("langchain")
+        index = QuantizedIndex(f"{target}_{args.mode}", args.dimensions, collection_fetcher(collection), mode=args.mode)
+        for ids, vectors, documents, metadatas in batches:
+            vectors = truncate(vectors, args.dimensions)
+            collection.upsert(ids=ids, embeddings=vectors.tolist(), documents=documents, metadatas=metadatas)
+            index.add(ids, vectors)
+        print(f"{len(all_vectors)}개 chunk를 {target}로 옮겼습니다. {index.stats()}")
+
+    # 저장된 chunk 일부를 검색어로 쓰고 (검색 대상에서는 뺀다), 원래 벡터의 정확한 결과와 비교한다.
+    sample = np.random.RandomState(0).choice(len(all_vectors), size=min(args.queries, len(all_vectors) // 2), replace=False)
+    full_dimensions = all_vectors.shape[1]
+    configs = [(full_dimensions, None)] + [
+        (dimensions, mode) for dimensions in sorted({full_dimensions, 1536, 1024, 512, 256}) if dimensions <= full_dimensions
+        for mode in [None, "int8", "binary"]
+        if (dimensions, mode) != (full_dimensions, None)
+    ]
+    print(format_recall_report(recall_report(np.delete(all_vectors, sample, axis=0), all_vectors[sample], configs)))
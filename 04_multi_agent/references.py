@@ -0,0 +1,142 @@
+from langchain_core.documents import Document
+
+from utils import estimate_tokens
+import hashlib
+
+
+def reference_id(doc):
+    # Chroma chunk ID가 있으면 그대로 쓰고, 없으면 본문 해시를 ID로 쓴다.
+    if doc.id:
+        return doc.id
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()[:32]
+
+
+class ReferenceStore:
+    """
+    검색된 문서를 ID별로 한 번만 저장하고, 노드마다 토큰 예산에 맞는 요약 뷰를 만들어 주는 저장소.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.docs = {}       # id -> Document
+        self.relevance = {}  # id -> 가장 높은 관련도
+        self.hits = {}       # id -> 검색된 횟수
+        self.dirty = {}      # 체크포인트 이후 바뀐 문서 id -> 본문도 기록해야 하는지 (새로 추가된 문서)
+
+    def add(self, queries, scored_docs):
+        """
+        Args:
+            queries (list[str]): 이번에 수행한 검색어
+            scored_docs (list[tuple[Document, float]]): (문서, 관련도) 목록
+
+        Returns:
+            int: 새로 추가된 문서 수
+        """
+        self.queries += queries
+        added = 0
+
+        for doc, relevance in scored_docs:
+            doc_id = reference_id(doc)
+            if doc_id not in self.docs:
+                self.docs[doc_id] = doc
+                self.dirty[doc_id] = True
+                added += 1
+            self.dirty.setdefault(doc_id, False)
+            self.relevance[doc_id] = max(relevance, self.relevance.get(doc_id, 0))
+            self.hits[doc_id] = self.hits.get(doc_id, 0) + 1
+
+        return added
+
+    def ranked_ids(self):
+        # 관련도가 높고 여러 번 검색된 문서가 앞에 온다.
+        return sorted(self.docs, key=lambda doc_id: (self.relevance[doc_id], self.hits[doc_id]), reverse=True)
+
+    def view(self, max_tokens=1500, full_text_top_n=0, snippet_chars=200):
+        """
+        토큰 예산에 맞춘 참고자료 요약 문자열을 만든다.
+        관련도 상위 full_text_top_n개는 본문 전체를, 나머지는 제목/출처/짧은 발췌만 보여준다.
+
+        Args:
+            max_tokens (int): 참고자료에 쓸 수 있는 최대 토큰 수
+            full_text_top_n (int): 본문 전체를 보여줄 상위 문서 수
+            snippet_chars (int): 발췌 길이(글자 수)
+
+        Returns:
+            str: 프롬프트에 넣을 참고자료 문자열
+        """
+        if not self.docs:
+            return "아직 검색된 참고자료가 없습니다."
+
+        lines = [f"검색어: {', '.join(self.queries[-10:])}"]
+        used_tokens = estimate_tokens(lines[0])
+        shown = 0
+
+        ranked = self.ranked_ids()
+        for rank, doc_id in enumerate(ranked):
+            doc = self.docs[doc_id]
+            title = doc.metadata.get('title', '')
+            source = doc.metadata.get('source', '')
+            page = doc.metadata.get('page')
+            if page is not None:
+                source = f"{source} (p.{page})"
+
+            if rank < full_text_top_n:
+                body = doc.page_content
+            else:
+                body = doc.page_content[:snippet_chars].replace('\n', ' ')
+                if len(doc.page_content) > snippet_chars:
+                    body += '...'
+
+            entry = f"[ref:{doc_id[:8]}] {title} | {source}\n{body}"
+            entry_tokens = estimate_tokens(entry)
+            if used_tokens + entry_tokens > max_tokens:
+                break
+
+            lines.append(entry)
+            used_tokens += entry_tokens
+            shown += 1
+
+        if shown < len(ranked):
+            lines.append(f"... 외 {len(ranked) - shown}건 생략")
+
+        return "\n\n".join(lines)
+
+    def doc_dict(self, doc_id, include_content=True):
+        doc = self.docs[doc_id]
+        return {
+            "id": doc_id,
+            "page_content": doc.page_content if include_content else None,
+            "metadata": doc.metadata,
+            "relevance": self.relevance[doc_id],
+            "hits": self.hits[doc_id],
+        }
+
+    def dirty_docs(self):
+        # 체크포인트 이후 바뀐 문서만 (본문은 새로 추가된 문서만 포함하고, 나머지는 관련도/검색 횟수만)
+        return [
+            {key: value for key, value in self.doc_dict(doc_id, include_content=is_new).items() if value is not None}
+            for doc_id, is_new in self.dirty.items()
+        ]
+
+    def clear_dirty(self):
+        self.dirty = {}
+
+    def to_dict(self, include_content=True):
+        return {
+            "queries": self.queries,
+            "docs": [self.doc_dict(doc_id, include_content) for doc_id in self.docs],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        store = cls()
+        store.queries = list(data.get("queries", []))
+        for item in data.get("docs", []):
+            doc_id = item["id"]
+            store.docs[doc_id] = Document(page_content=item.get("page_content") or "", metadata=item["metadata"], id=doc_id)
+            store.relevance[doc_id] = item.get("relevance", 0)
+            store.hits[doc_id] = item.get("hits", 1)
+        return store
+
+    def __len__(self):
+        return len(self.docs)
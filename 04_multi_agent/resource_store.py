@@ -0,0 +1,189 @@
+from datetime import datetime
+import threading
+import struct
+import glob
+import json
+import zlib
+import os
+
+from url_index import content_hash
+from utils import sqlite_connection
+
+# 레코드 한 개 = 길이(4바이트, little endian) + zlib으로 압축한 json
+frame_header = struct.Struct("<I")
+
+
+class ResourceStore:
+    """
+    웹검색 결과(raw_content 포함)를 압축해서 덧붙이기만 하는(append-only) 로그와 URL 인덱스.
+
+    - resources.log: 본문이 같은 레코드는 한 번만 저장한다. (본문 해시로 중복 제거)
+    - resources.sqlite3: 본문 해시 -> 로그 위치, URL -> 최근 본문 해시
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.log_path = os.path.join(store_dir, "resources.log")
+        self.db_path = os.path.join(store_dir, "resources.sqlite3")
+        self.lock = threading.Lock() # 로그에 덧붙이는 순서를 지킨다.
+        os.makedirs(store_dir, exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS contents (
+                    content_hash TEXT PRIMARY KEY,
+                    offset INTEGER,
+                    length INTEGER
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    title TEXT,
+                    content_hash TEXT,
+                    query TEXT,
+                    fetched_at TEXT
+                )
+                """
+            )
+
+    def connect(self):
+        return sqlite_connection(self.db_path)
+
+    def append(self, results, query=None):
+        """
+        검색 결과를 로그에 덧붙이고 URL 인덱스를 갱신한다.
+
+        Args:
+            results (list[dict]): Tavily 검색 결과 (url, title, content, raw_content)
+            query (str): 검색어 (기록용)
+
+        Returns:
+            list[dict]: 저장한 레코드 (content_hash 포함)
+        """
+        fetched_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        records = []
+        appended = 0
+
+        with self.lock, self.connect() as conn, open(self.log_path, "ab") as log:
+            for result in results:
+                record = {
+                    "url": result["url"],
+                    "title": result.get("title") or "",
+                    "content": result.get("content") or "",
+                    "raw_content": result.get("raw_content") or "",
+                }
+                record["content_hash"] = content_hash(record["content"] + "\n" + record["raw_content"])
+
+                stored = conn.execute(
+                    "SELECT 1 FROM contents WHERE content_hash = ?", (record["content_hash"],)
+                ).fetchone()
+                if stored is None:
+                    frame = zlib.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+                    offset = log.tell()
+                    log.write(frame_header.pack(len(frame)) + frame)
+                    conn.execute(
+                        "INSERT INTO contents (content_hash, offset, length) VALUES (?, ?, ?)",
+                        (record["content_hash"], offset, len(frame)),
+                    )
+                    appended += 1
+
+                conn.execute(
+                    """
+                    INSERT INTO urls (url, title, content_hash, query, fetched_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET
+                        title=excluded.title,
+                        content_hash=excluded.content_hash,
+                        query=excluded.query,
+                        fetched_at=excluded.fetched_at
+                    """,
+                    (record["url"], record["title"], record["content_hash"], query, fetched_at),
+                )
+                records.append(record)
+
+            # 인덱스보다 로그가 먼저 디스크에 기록되도록 한다.
+            log.flush()
+            os.fsync(log.fileno())
+
+        print(f"웹 리소스 {len(records)}개 중 새로운 본문 {appended}개를 저장했습니다.")
+        return records
+
+    def read_frame(self, log, offset, length):
+        log.seek(offset + frame_header.size)
+        return json.loads(zlib.decompress(log.read(length)).decode("utf-8"))
+
+    def get(self, url):
+        """
+        URL의 가장 최근 레코드를 반환한다. 없으면 None
+        """
+        with self.connect() as conn:
+            row = conn.execute(
+                """
+                SELECT c.offset, c.length, u.title FROM urls u
+                JOIN contents c ON c.content_hash = u.content_hash
+                WHERE u.url = ?
+                """,
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        with open(self.log_path, "rb") as log:
+            record = self.read_frame(log, row[0], row[1])
+        record.update(url=url, title=row[2])
+        return record
+
+    def iter_records(self):
+        # 로그의 레코드를 처음부터 하나씩 읽는다. (마지막 레코드가 덜 기록된 경우는 건너뛴다)
+        if not os.path.exists(self.log_path):
+            return
+
+        with open(self.log_path, "rb") as log:
+            while True:
+                header = log.read(frame_header.size)
+                if len(header) < frame_header.size:
+                    break
+                (length,) = frame_header.unpack(header)
+                frame = log.read(length)
+                if len(frame) < length:
+                    break
+                yield json.loads(zlib.decompress(frame).decode("utf-8"))
+
+    def import_json_files(self, pattern):
+        # 예전 resources_*.json 파일을 로그로 옮긴다.
+        paths = sorted(glob.glob(pattern))
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                self.append(json.load(f))
+        return paths
+
+    def stats(self):
+        with self.connect() as conn:
+            urls = conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            contents = conn.execute("SELECT COUNT(*) FROM contents").fetchone()[0]
+        log_bytes = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        return {"urls": urls, "contents": contents, "log_bytes": log_bytes}
+
+
+if __name__ == "__main__":
+    # 예전 resources_*.json 파일을 로그로 옮긴다.
+    #   python resource_store.py [--delete]
+    import argparse
+
+    current_path = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="resources_*.json을 압축 로그로 옮긴다.")
+    parser.add_argument("--delete", action="store_true", help="옮긴 json 파일을 지운다.")
+    args = parser.parse_args()
+
+    store = ResourceStore(f"{current_path}/data/resources")
+    imported = store.import_json_files(f"{current_path}/data/resources_*.json")
+    print(f"{len(imported)}개 파일을 옮겼습니다. {store.stats()}")
+
+    if args.delete:
+        for path in imported:
+            os.remove(path)
@@ -0,0 +1,140 @@
+from langchain_core.messages import HumanMessage
+
+from models import Task
+from history import message_text
+
+from collections import Counter
+import threading
+import re
+
+agent_names = ["content_strategist", "communicator", "web_search_agent", "vector_search_agent"]
+
+# 리뷰의 '제안사항:' 줄
+suggestion_pattern = re.compile(r"제안사항\s*:\s*(.*)")
+
+
+def new_task(agent, description):
+    return Task(agent=agent, description=description, done=False, done_at="")
+
+
+def budget_exhausted_rule(state):
+    # 이번 턴의 예산으로 communicator 외에는 아무 agent도 실행할 수 없으면 지금까지의 결과를 보고한다.
+    budget = state.get("budget")
+    if budget is not None and budget.must_report():
+        return new_task("communicator", "이번 턴의 예산을 다 썼으므로 지금까지의 결과를 사용자에게 보고한다.")
+    return None
+
+
+def supervisor_limit_rule(state, max_calls=3):
+    # supervisor 호출 횟수를 넘으면 진행상황을 보고한다.
+    if state.get("supervisor_call_count", 0) > max_calls:
+        return new_task("communicator", "supervisor 호출 횟수 초과했으므로 현재까지의 진행상황을 사용자에게 보고한다.")
+    return None
+
+
+def pending_task_rule(state):
+    # 이번 턴에 만든 마지막 작업이 아직 끝나지 않았으면 그 작업을 이어서 한다.
+    # 지난 턴에 끝내지 못한 작업(예: 중단된 뒤 resume)은 새 메시지를 무시하게 되므로 이어서 하지 않는다.
+    # (web_search_agent가 만든 vector_search_agent 작업은 그래프의 edge로 바로 실행되므로 여기까지 오지 않는다)
+    task_history = state.get("task_history", [])
+    turn_task_start = state.get("turn_task_start", len(task_history))
+    # 새 Task를 만들지 않고 그 작업을 그대로 돌려준다. (finish_supervisor는 이미 이력에 있는 작업을 다시 추가하지 않는다)
+    if len(task_history) > turn_task_start and not task_history[-1].done:
+        return task_history[-1]
+    return None
+
+
+def mentioned_agents(text):
+    return [name for name in agent_names if name in text]
+
+
+def reviewer_suggestion_rule(state):
+    # 직전 작업이 목차 리뷰이고, 리뷰를 받은 business analyst도 리뷰가 제안한 agent 하나만 언급하면 그대로 따른다.
+    # (business analyst가 사용자 요구사항에 비추어 다른 작업을 제안하거나 agent를 정하지 않으면 LLM이 정한다)
+    analysis = None
+    for message in reversed(state.get("messages", [])):
+        if isinstance(message, HumanMessage):
+            return None
+
+        text = message_text(message).lstrip()
+        if text.startswith("[Business Analyst]"):
+            if analysis is None:
+                analysis = text
+            continue
+        if not text.startswith("[OUTLINE REVIEW AGENT]") or analysis is None:
+            return None
+
+        match = suggestion_pattern.search(text)
+        if match is None:
+            return None
+
+        suggested = mentioned_agents(match.group(1))
+        if len(suggested) != 1 or mentioned_agents(analysis) != suggested:
+            return None
+
+        return new_task(suggested[0], f"목차 리뷰와 business analyst의 분석에 따라 작업한다.\n{analysis}")
+
+    return None
+
+
+default_rules = [
+    budget_exhausted_rule,
+    supervisor_limit_rule,
+    pending_task_rule,
+    reviewer_suggestion_rule,
+]
+
+
+class FastPathRouter:
+    """
+    규칙으로 다음 작업이 분명한 경우 supervisor LLM 호출 없이 Task를 정한다.
+    규칙은 state를 받아 Task 또는 None을 반환하는 함수이며, 앞에 있는 규칙이 먼저 적용된다.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = list(default_rules if rules is None else rules)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add_rule(self, rule, first=False):
+        if first:
+            self.rules.insert(0, rule)
+        else:
+            self.rules.append(rule)
+
+    def route(self, state):
+        """
+        Returns:
+            Task | None: 규칙으로 정한 Task. 정할 수 없으면 None (LLM 호출 필요)
+        """
+        for rule in self.rules:
+            task = rule(state)
+            if task is not None:
+                with self.lock:
+                    self.counts[rule.__name__] += 1
+                    self.counts["fast_path"] += 1
+                print(f"Fast path ({rule.__name__}): {task.agent}")
+                return task
+
+        with self.lock:
+            self.counts["llm"] += 1
+        return None
+
+    def stats(self):
+        with self.lock:
+            total = self.counts["fast_path"] + self.counts["llm"]
+            return {
+                "total": total,
+                "fast_path": self.counts["fast_path"],
+                "llm": self.counts["llm"],
+                "fast_path_rate": self.counts["fast_path"] / total if total else 0.0,
+                "rules": {rule.__name__: self.counts[rule.__name__] for rule in self.rules},
+            }
+
+    def report(self):
+        stats = self.stats()
+        rules = ", ".join(f"{name}={count}" for name, count in stats["rules"].items())
+        return (
+            f"Supervisor fast path: {stats['fast_path']}/{stats['total']} "
+            f"({stats['fast_path_rate']:.0%}) | LLM 호출: {stats['llm']} | {rules}"
+        )
@@ -0,0 +1,328 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from contextvars import ContextVar
+from collections import defaultdict, deque
+import itertools
+import threading
+import heapq
+import json
+import time
+import os
+
+from utils import estimate_tokens
+from usage import usage_from_result
+
+# 우선순위 (숫자가 작을수록 먼저 보낸다)
+interactive = 0 # 사용자에게 바로 답하는 작업 (communicator)
+normal = 1      # 그래프 노드의 일반 작업
+background = 2  # 수집(임베딩 저장), 요약 등 미뤄도 되는 작업
+
+priority_names = {interactive: "interactive", normal: "normal", background: "background"}
+
+# OpenAI 계정 사용 tier별 모델의 분당 요청 수(rpm)와 분당 토큰 수(tpm)
+# 실제 한도는 응답 헤더(x-ratelimit-limit-*)로 받아서 바꾼다. (observe_response)
+tier_limits = {
+    1: {
+        "gpt-4o": {"rpm": 500, "tpm": 30000},
+        "gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+        "text-embedding-3-large": {"rpm": 3000, "tpm": 1000000},
+    },
+    2: {
+        "gpt-4o": {"rpm": 5000, "tpm": 450000},
+        "gpt-4o-mini": {"rpm": 5000, "tpm": 2000000},
+        "text-embedding-3-large": {"rpm": 5000, "tpm": 1000000},
+    },
+    3: {
+        "gpt-4o": {"rpm": 5000, "tpm": 800000},
+        "gpt-4o-mini": {"rpm": 5000, "tpm": 4000000},
+        "text-embedding-3-large": {"rpm": 5000, "tpm": 5000000},
+    },
+    4: {
+        "gpt-4o": {"rpm": 10000, "tpm": 2000000},
+        "gpt-4o-mini": {"rpm": 10000, "tpm": 10000000},
+        "text-embedding-3-large": {"rpm": 10000, "tpm": 5000000},
+    },
+    5: {
+        "gpt-4o": {"rpm": 10000, "tpm": 30000000},
+        "gpt-4o-mini": {"rpm": 30000, "tpm": 150000000},
+        "text-embedding-3-large": {"rpm": 10000, "tpm": 10000000},
+    },
+}
+
+# 계정 tier (OPENAI_USAGE_TIER)와 모델별로 직접 정한 한도 (OPENAI_RATE_LIMITS, 예: '{"gpt-4o": {"tpm": 100000}}')
+# 직접 정한 한도는 응답 헤더로 바꾸지 않는다. (여러 프로그램이 한 계정을 나눠 쓰는 경우)
+usage_tier = int(os.getenv("OPENAI_USAGE_TIER", 1))
+override_limits = json.loads(os.getenv("OPENAI_RATE_LIMITS") or "{}")
+
+
+def configured_limits(tier=usage_tier, overrides=None):
+    """
+    tier의 모델별 한도에 직접 정한 한도를 덮어쓴다. 여기에 없는 모델은 제한하지 않는다.
+
+    Args:
+        tier (int): OpenAI 계정 사용 tier (1~5)
+        overrides (dict): 모델 -> {"rpm": ..., "tpm": ...}
+
+    Returns:
+        dict: 모델 -> {"rpm": ..., "tpm": ...}
+    """
+    limits = {model: dict(row) for model, row in tier_limits[tier].items()}
+    for model, row in (override_limits if overrides is None else overrides).items():
+        limits.setdefault(model, dict(tier_limits[1].get(model, {"rpm": 500, "tpm": 30000}))).update(row)
+    return limits
+
+
+model_limits = configured_limits()
+
+# 요청을 보낸 쪽이 스케줄러에서 기다린 시간을 받을 목록 (hedging이 지연 시간에서 대기 시간을 뺄 때 사용)
+queue_waits = ContextVar("queue_waits", default=None)
+
+# 출력 토큰 수를 모를 때(max_tokens 미지정) 예약해 둘 토큰 수
+default_output_tokens = 1000
+
+# 이 노드의 LLM 호출은 interactive로 보낸다.
+interactive_nodes = {"communicator"}
+
+
+class RateScheduler:
+    """
+    모든 에이전트와 도구가 함께 쓰는 OpenAI 요청 스케줄러.
+
+    모델마다 최근 60초 동안 보낸 요청 수와 토큰 수를 기록하고, 보내기 전에 예상 토큰 수만큼 자리를 예약한다.
+    한도가 찼으면 우선순위(interactive > normal > background) 순서로 기다린다.
+    """
+
+    window_seconds = 60
+
+    def __init__(self, limits=None, fixed=()):
+        self.limits = {model: dict(row) for model, row in (model_limits if limits is None else limits).items()}
+        self.fixed = set(fixed) # 응답 헤더로 바꾸지 않는 모델
+        self.condition = threading.Condition()
+        self.sent = defaultdict(deque)    # 모델 -> [보낸 시각, 토큰 수] (최근 60초)
+        self.waiting = defaultdict(list)  # 모델 -> (우선순위, 순번) heap
+        self.sequence = itertools.count()
+        self.wait_stats = defaultdict(lambda: {"requests": 0, "waited": 0, "total_wait": 0.0, "max_wait": 0.0})
+        self.max_queue_depth = defaultdict(int)
+        # 모델별 실제 입력 토큰 수 / 어림한 입력 토큰 수 (estimate_tokens를 실제 사용량에 맞춘다)
+        self.input_ratio = defaultdict(lambda: 1.0)
+
+    def prune(self, model, now):
+        sent = self.sent[model]
+        while sent and sent[0][0] <= now - self.window_seconds:
+            sent.popleft()
+
+    def delay(self, model, tokens, now):
+        # 지금 보내면 한도를 넘는 경우, 몇 초 뒤에 보낼 수 있는지 계산한다.
+        limits = self.limits[model]
+        self.prune(model, now)
+        sent = self.sent[model]
+
+        delay = 0.0
+        if len(sent) >= limits["rpm"]:
+            delay = sent[len(sent) - limits["rpm"]][0] + self.window_seconds - now
+
+        used = sum(entry[1] for entry in sent)
+        if used + tokens > limits["tpm"]:
+            # 오래된 요청부터 창 밖으로 빠지면서 자리가 생기는 시각
+            for sent_at, sent_tokens in sent:
+                used -= sent_tokens
+                if used + tokens <= limits["tpm"]:
+                    delay = max(delay, sent_at + self.window_seconds - now)
+                    break
+        return delay
+
+    def acquire(self, model, tokens, priority=normal):
+        """
+        model로 tokens만큼의 요청을 보낼 수 있을 때까지 기다리고 자리를 예약한다.
+
+        Args:
+            model (str): 모델 이름
+            tokens (int): 예상 토큰 수 (입력 + 출력)
+            priority (int): interactive, normal, background
+
+        Returns:
+            list: 예약 항목 [보낸 시각, 토큰 수]. settle()로 실제 토큰 수를 반영한다.
+        """
+        if model not in self.limits:
+            return None
+
+        # 한 번에 보낼 수 없는 크기는 한도로 맞춘다. (영원히 기다리지 않도록)
+        tokens = min(max(int(tokens), 1), self.limits[model]["tpm"])
+        ticket = (priority, next(self.sequence))
+        started = time.monotonic()
+
+        with self.condition:
+            queue = self.waiting[model]
+            heapq.heappush(queue, ticket)
+            self.max_queue_depth[model] = max(self.max_queue_depth[model], len(queue))
+
+            while True:
+                if queue[0] == ticket:
+                    delay = self.delay(model, tokens, time.monotonic())
+                    if delay <= 0:
+                        break
+                    self.condition.wait(timeout=delay)
+                else:
+                    # 앞선 요청이 나가면 notify_all로 깨어난다.
+                    self.condition.wait(timeout=1)
+
+            heapq.heappop(queue)
+            entry = [time.monotonic(), tokens]
+            self.sent[model].append(entry)
+
+            waited = entry[0] - started
+            stats = self.wait_stats[(model, priority)]
+            stats["requests"] += 1
+            stats["waited"] += waited > 0.01
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+
+            self.condition.notify_all()
+
+        waits = queue_waits.get()
+        if waits is not None:
+            waits.append(waited)
+        return entry
+
+    def queued(self):
+        # 자리를 기다리는 요청이 있는 모델이 있는지
+        with self.condition:
+            return any(self.waiting.values())
+
+    def estimate(self, model, prompt_tokens, max_tokens=None):
+        # 보정한 입력 토큰 수 + 출력 토큰 수 (max_tokens를 모르면 default_output_tokens)
+        with self.condition:
+            ratio = self.input_ratio[model]
+        return int(prompt_tokens * ratio) + (max_tokens or default_output_tokens)
+
+    def calibrate(self, model, prompt_tokens, input_tokens, weight=0.2):
+        # 어림한 입력 토큰 수와 실제 입력 토큰 수(usage)의 비율을 지수 이동 평균으로 갱신한다.
+        if model not in self.limits or not prompt_tokens or not input_tokens:
+            return
+        with self.condition:
+            self.input_ratio[model] += weight * (input_tokens / prompt_tokens - self.input_ratio[model])
+
+    def observe_limits(self, model, headers):
+        # 응답 헤더의 계정 한도(x-ratelimit-limit-requests/tokens)로 모델의 한도를 바꾼다.
+        if not model or model in self.fixed:
+            return
+        try:
+            rpm = int(headers["x-ratelimit-limit-requests"])
+            tpm = int(headers["x-ratelimit-limit-tokens"])
+        except (KeyError, ValueError):
+            return
+
+        with self.condition:
+            if self.limits.get(model) == {"rpm": rpm, "tpm": tpm}:
+                return
+            self.limits[model] = {"rpm": rpm, "tpm": tpm}
+            self.condition.notify_all()
+        print(f"요청 한도 갱신 ({model}): 분당 요청 {rpm} | 분당 토큰 {tpm}")
+
+    def observe_response(self, response):
+        # httpx 응답 hook (llm_cache의 http_client에 등록한다). 요청 본문에서 모델 이름을 찾는다.
+        try:
+            model = json.loads(response.request.content or b"{}").get("model")
+        except (ValueError, AttributeError):
+            return
+        self.observe_limits(model, response.headers)
+
+    async def aobserve_response(self, response):
+        self.observe_response(response)
+
+    def settle(self, entry, tokens):
+        # 응답을 받은 뒤 예상 토큰 수를 실제 사용량으로 바꾼다.
+        if entry is None or not tokens:
+            return
+        with self.condition:
+            entry[1] = tokens
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            models = {}
+            for model in self.limits:
+                self.prune(model, time.monotonic())
+                models[model] = {
+                    "queue_depth": len(self.waiting[model]),
+                    "max_queue_depth": self.max_queue_depth[model],
+                    "requests_last_minute": len(self.sent[model]),
+                    "tokens_last_minute": sum(entry[1] for entry in self.sent[model]),
+                    "input_ratio": round(self.input_ratio[model], 3),
+                    **self.limits[model],
+                }
+            waits = {
+                f"{model}:{priority_names[priority]}": {
+                    **stats,
+                    "avg_wait": stats["total_wait"] / stats["requests"] if stats["requests"] else 0.0,
+                }
+                for (model, priority), stats in self.wait_stats.items()
+            }
+        return {"models": models, "waits": waits}
+
+    def report(self):
+        stats = self.stats()
+        lines = ["요청 스케줄러 (최근 1분 / 한도)"]
+        for model, row in stats["models"].items():
+            if not row["max_queue_depth"]:
+                continue
+            lines.append(
+                f"- {model}: 요청 {row['requests_last_minute']}/{row['rpm']} | 토큰 {row['tokens_last_minute']}/{row['tpm']} "
+                f"| 대기열 {row['queue_depth']} (최대 {row['max_queue_depth']})"
+            )
+        for name, row in sorted(stats["waits"].items()):
+            lines.append(
+                f"  - {name}: {row['requests']}회, 대기 {row['waited']}회 | 평균 {row['avg_wait']:.2f}s, 최대 {row['max_wait']:.2f}s"
+            )
+        return "\n".join(lines)
+
+
+def request_priority(node, tags=None):
+    if tags and "background" in tags:
+        return background
+    if node in interactive_nodes:
+        return interactive
+    return normal
+
+
+class RateLimitCallbackHandler(BaseCallbackHandler):
+    """
+    LLM을 호출하기 직전에 스케줄러에서 자리를 예약한다.
+    (LangChain은 on_chat_model_start가 끝난 뒤에 요청을 보내므로, 여기서 기다리면 요청이 늦춰진다.)
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.run_entries = {} # run_id -> (모델, 어림한 입력 토큰 수, 예약 항목)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, tags=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name")
+
+        prompt_tokens = sum(estimate_tokens(m.content) for batch in messages for m in batch)
+        tokens = self.scheduler.estimate(model, prompt_tokens, params.get("max_tokens"))
+        priority = request_priority((metadata or {}).get("langgraph_node"), tags)
+
+        entry = self.scheduler.acquire(model, tokens, priority)
+        with self.lock:
+            self.run_entries[run_id] = (model, prompt_tokens, entry)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            model, prompt_tokens, entry = self.run_entries.pop(run_id, (None, 0, None))
+
+        # 예약한 토큰 수를 실제 사용량으로 바꾸고, 다음 어림에 반영한다.
+        usage = usage_from_result(response)
+        if usage is None:
+            return
+        self.scheduler.settle(entry, usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+        self.scheduler.calibrate(model, prompt_tokens, usage.get("input_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.run_entries.pop(run_id, None)
+
+
+# 모듈 전체에서 공유하는 스케줄러
+scheduler = RateScheduler(model_limits, fixed=override_limits)
@@ -0,0 +1,355 @@
+"""
+책을 쓰는 AI 팀의 서버 모드 (HTTP + WebSocket)
+
+세션마다 state, 목차, 체크포인트를 sessions/<session_id>/ 폴더에 따로 저장한다.
+동시에 실행되는 턴 수를 제한하고, 대기열이 가득 차면 busy로 거절한다.
+
+    python server.py --port 8000 --max-concurrent-turns 8
+
+- POST /sessions                       새 세션 (또는 {"session_id": ...}로 기존 세션 이어서)
+- POST /sessions/{session_id}/messages 한 턴 실행 후 마지막 응답과 예산 사용량을 반환
+- WS   /sessions/{session_id}/ws       {"message": "..."}를 보내면 노드 출력과 토큰을 스트리밍
+- GET  /sessions/{session_id}/outline  세션의 목차
+- GET  /stats                          세션/대기열/fast path/요청 스케줄러/hedging/노드별 모델/speculative routing 통계
+"""
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+from pydantic import BaseModel
+
+from contextlib import asynccontextmanager
+from datetime import datetime
+import argparse
+import asyncio
+import time
+import re
+import os
+
+import v0604_anti_infinit_loop as team
+from utils import get_outline
+from history import message_text
+from tools import maintain_chunk_store
+
+sessions_dir = f"{team.current_path}/sessions"
+session_id_pattern = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 서버 설정 (CLI 옵션으로 바꿀 수 있다)
+max_concurrent_turns = 8    # 동시에 그래프를 실행할 수 있는 턴 수
+max_waiting_turns = 32      # 실행을 기다릴 수 있는 턴 수. 넘으면 busy로 거절 (backpressure)
+max_outbox_events = 256     # WebSocket 클라이언트별 전송 대기 이벤트 수. 가득 차면 그래프 진행도 기다린다.
+session_idle_seconds = 1800 # 이 시간 동안 사용하지 않은 세션은 메모리에서 내린다. (journal로 다시 이어서 진행 가능)
+trace_format = "json"
+
+
+class ServerBusy(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, session_id, state, journal, workspace_dir):
+        self.session_id = session_id
+        self.state = state
+        self.journal = journal
+        self.workspace_dir = workspace_dir
+        self.lock = asyncio.Lock() # 한 세션에서는 한 번에 한 턴만 실행한다.
+        self.last_active = time.monotonic()
+
+    @property
+    def config(self):
+        return {"configurable": {"journal": self.journal, "workspace": self.workspace_dir}}
+
+
+class SessionManager:
+    """
+    세션을 만들고 이어서 진행하며, 동시에 실행되는 턴 수와 대기열 길이를 제한한다.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.opening = {} # session_id -> journal에서 불러오는 중인 작업 (동시에 열어도 한 번만 불러온다)
+        self.turn_slots = None
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    def start(self):
+        # 이벤트 루프가 시작된 뒤에 만든다.
+        self.turn_slots = asyncio.Semaphore(max_concurrent_turns)
+
+    async def open(self, session_id=None):
+        if session_id is None:
+            session_id = datetime.now().strftime('%Y_%m%d_%H%M%S_') + os.urandom(3).hex()
+        if not session_id_pattern.match(session_id):
+            raise ValueError(f"잘못된 session_id: {session_id}")
+
+        if session_id in self.sessions:
+            return self.sessions[session_id]
+
+        # 같은 세션을 동시에 열면 (WebSocket 연결과 POST 등) 먼저 시작한 불러오기를 함께 기다린다.
+        # journal을 두 번 이어서 쓰면 한 journal.jsonl에 기록하는 CheckpointJournal이 둘이 된다.
+        opening = self.opening.get(session_id)
+        if opening is None:
+            opening = asyncio.ensure_future(self.load(session_id))
+            self.opening[session_id] = opening
+            opening.add_done_callback(lambda _: self.opening.pop(session_id, None))
+        # 기다리던 요청이 취소되어도 불러오기는 끝까지 한다.
+        return await asyncio.shield(opening)
+
+    async def load(self, session_id):
+        workspace_dir = f"{sessions_dir}/{session_id}"
+        state, journal = await asyncio.to_thread(
+            team.start_session, True, workspace_dir, session_id
+        )
+        session = Session(session_id, state, journal, workspace_dir)
+        self.sessions[session_id] = session
+        return session
+
+    async def get(self, session_id):
+        # 메모리에 없으면 journal에서 이어서 진행한다. 폴더가 없으면 없는 세션이다.
+        if session_id in self.sessions:
+            return self.sessions[session_id]
+        if not session_id_pattern.match(session_id) or not os.path.isdir(f"{sessions_dir}/{session_id}"):
+            return None
+        return await self.open(session_id)
+
+    async def run_turn(self, session, user_input, emit=None):
+        """
+        세션에서 한 턴을 실행한다. emit이 있으면 노드 출력과 토큰을 이벤트로 보낸다.
+
+        Returns:
+            str: 이번 턴의 마지막 응답
+        """
+        if self.waiting >= max_waiting_turns:
+            self.rejected += 1
+            raise ServerBusy("대기 중인 요청이 너무 많습니다. 잠시 후 다시 시도하세요.")
+
+        self.waiting += 1
+        try:
+            await session.lock.acquire()
+            try:
+                await self.turn_slots.acquire()
+            except BaseException:
+                session.lock.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            session.last_active = time.monotonic()
+            team.start_turn(session.state, user_input) # 예산은 대기열에서 기다린 시간은 빼고, 실행을 시작할 때부터 잰다.
+
+            with team.tracer.span("turn", kind="turn", session_id=session.session_id) as turn:
+                session.state = await stream_turn(session, emit)
+
+            await asyncio.to_thread(team.finish_turn_trace, turn, session.journal, trace_format)
+            return message_text(session.state["messages"][-1])
+        finally:
+            self.running -= 1
+            session.last_active = time.monotonic()
+            self.turn_slots.release()
+            session.lock.release()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if not session.lock.locked() and now - session.last_active > session_idle_seconds:
+                del self.sessions[session_id]
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "running_turns": self.running,
+            "waiting_turns": self.waiting,
+            "rejected_turns": self.rejected,
+            "max_concurrent_turns": max_concurrent_turns,
+            "max_waiting_turns": max_waiting_turns,
+            "fast_path": team.fast_path_router.stats(),
+            "scheduler": team.scheduler.stats(),
+            "hedging": team.hedger.stats(),
+            "models": team.model_tier_stats.snapshot(),
+            "speculation": team.prefetcher.stats(),
+        }
+
+
+async def stream_turn(session, emit=None):
+    # updates: 노드가 끝날 때마다, messages: LLM 토큰, values: 마지막 상태
+    final_state = session.state
+
+    async for mode, chunk in team.async_graph.astream(
+        session.state, config=session.config, stream_mode=["updates", "messages", "values"]
+    ):
+        if mode == "values":
+            final_state = chunk
+        elif emit is None:
+            continue
+        elif mode == "messages":
+            message, metadata = chunk
+            if message.content:
+                await emit({"type": "token", "node": metadata.get("langgraph_node"), "content": message.content})
+        elif mode == "updates":
+            for node, update in chunk.items():
+                messages = (update or {}).get("messages") or []
+                await emit({
+                    "type": "node",
+                    "node": node,
+                    "message": message_text(messages[-1]) if messages else "",
+                })
+
+    return final_state
+
+
+manager = SessionManager()
+
+
+async def evict_idle_sessions():
+    while True:
+        await asyncio.sleep(60)
+        manager.evict_idle()
+        # 웹 chunk 저장소도 주기적으로 정리한다. (수집이 없어도 오래된 chunk가 지워지도록, 주기는 tools.maintenance_interval_seconds)
+        await asyncio.to_thread(maintain_chunk_store)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 동기 도구(Chroma, 파일 저장)는 asyncio.to_thread로 실행되므로 기본 스레드 풀을 넉넉히 잡는다.
+    # run_in_executor로 넘긴 작업에도 세션의 컨텍스트(workspace, tracing span)가 전달되도록 ContextThreadPoolExecutor를 쓴다.
+    asyncio.get_running_loop().set_default_executor(ContextThreadPoolExecutor(max_workers=max_concurrent_turns * 8))
+    manager.start()
+    evictor = asyncio.create_task(evict_idle_sessions())
+    yield
+    evictor.cancel()
+
+
+app = FastAPI(title="책을 쓰는 AI 팀", lifespan=lifespan)
+
+
+class SessionRequest(BaseModel):
+    session_id: str | None = None
+
+
+class MessageRequest(BaseModel):
+    message: str
+
+
+@app.post("/sessions")
+async def create_session(request: SessionRequest | None = None):
+    try:
+        session = await manager.open(request.session_id if request else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session.session_id, "messages": len(session.state["messages"])}
+
+
+@app.post("/sessions/{session_id}/messages")
+async def post_message(session_id: str, request: MessageRequest):
+    session = await manager.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="세션이 없습니다.")
+    try:
+        answer = await manager.run_turn(session, request.message)
+    except ServerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"session_id": session_id, "answer": answer, "budget": session.state["budget"].snapshot()}
+
+
+@app.get("/sessions/{session_id}/outline")
+async def read_outline(session_id: str):
+    session = await manager.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="세션이 없습니다.")
+    outline = await asyncio.to_thread(get_outline, session.workspace_dir)
+    return {"session_id": session_id, "outline": outline}
+
+
+@app.get("/stats")
+async def read_stats():
+    return manager.stats()
+
+
+@app.websocket("/sessions/{session_id}/ws")
+async def session_socket(websocket: WebSocket, session_id: str):
+    await websocket.accept()
+
+    session = await manager.get(session_id)
+    if session is None:
+        await websocket.send_json({"type": "error", "detail": "세션이 없습니다."})
+        await websocket.close()
+        return
+
+    # 전송 대기열이 가득 차면 emit이 기다리므로, 느린 클라이언트는 자기 세션의 그래프 진행만 늦춘다.
+    outbox = asyncio.Queue(maxsize=max_outbox_events)
+
+    async def sender():
+        while True:
+            event = await outbox.get()
+            await websocket.send_json(event)
+
+    sending = asyncio.create_task(sender())
+
+    try:
+        while True:
+            request = await websocket.receive_json()
+            user_input = str(request.get("message", "")).strip()
+            if not user_input:
+                continue
+
+            if not await run_socket_turn(session, user_input, outbox, sending):
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sending.cancel()
+
+
+async def run_socket_turn(session, user_input, outbox, sending):
+    """
+    WebSocket으로 받은 입력으로 한 턴을 실행한다.
+    클라이언트 연결이 끊겨 sender가 끝나면 아무도 outbox를 비우지 않으므로, 실행 중인 턴을 취소해서
+    세션 lock과 턴 슬롯을 돌려준다.
+
+    Returns:
+        bool: 연결이 살아 있으면 True
+    """
+    async def turn():
+        try:
+            answer = await manager.run_turn(session, user_input, emit=outbox.put)
+            await outbox.put({"type": "done", "answer": answer, "budget": session.state["budget"].snapshot()})
+        except ServerBusy as e:
+            await outbox.put({"type": "busy", "detail": str(e)})
+
+    running = asyncio.create_task(turn())
+    await asyncio.wait({running, sending}, return_when=asyncio.FIRST_COMPLETED)
+
+    if not running.done():
+        print(f"[{session.session_id}] 연결이 끊겨 실행 중인 턴을 취소합니다.")
+        running.cancel()
+        try:
+            await running
+        except asyncio.CancelledError:
+            pass
+        return False
+
+    running.result() # 턴에서 난 예외는 그대로 올린다.
+    return not sending.done()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="책을 쓰는 AI 팀 서버")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrent-turns", type=int, default=max_concurrent_turns, help="동시에 실행할 턴 수")
+    parser.add_argument("--max-waiting-turns", type=int, default=max_waiting_turns, help="대기할 수 있는 턴 수 (넘으면 busy)")
+    parser.add_argument("--trace-format", choices=["json", "otlp", "none"], default=trace_format)
+    parser.add_argument("--turn-deadline", type=float, default=team.turn_deadline_seconds, help="한 턴의 마감 시간(초)")
+    parser.add_argument("--turn-tokens", type=int, default=team.turn_max_tokens, help="한 턴의 토큰 예산")
+    args = parser.parse_args()
+
+    max_concurrent_turns = args.max_concurrent_turns
+    max_waiting_turns = args.max_waiting_turns
+    trace_format = args.trace_format
+    team.turn_deadline_seconds = args.turn_deadline
+    team.turn_max_tokens = args.turn_tokens
+
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,95 @@
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+import threading
+import asyncio
+import re
+
+
+def streamed_value(text, key):
+    """
+    스트리밍 중인 json 문자열에서 key의 문자열 값이 완성되었으면 반환한다. 아직이면 None
+
+    예: '{"agent": "communicator", "do' -> streamed_value(..., "agent") == "communicator"
+    """
+    match = re.search(rf'"{key}"\s*:\s*"([^"\\]*)"', text)
+    return match.group(1) if match else None
+
+
+class Prefetcher:
+    """
+    supervisor가 다음 agent를 고르자마자 그 노드가 쓸 입력(목차, 참고자료 등)을 미리 준비한다.
+
+    준비한 값은 (작업 폴더, agent, 이름)으로 저장하고, 다음 노드가 take()로 (async 노드는 atake()로) 가져간다.
+    supervisor가 다시 실행되면 가져가지 않은 값은 버린다. (clear)
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ContextThreadPoolExecutor(max_workers=max_workers) # 작업 폴더(workspace) 컨텍스트가 전달되도록
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.counts = {"routes": 0, "prefetched": 0, "used": 0, "wasted": 0, "saved_seconds": 0.0}
+
+    def start(self, key, fn, *args):
+        with self.lock:
+            if key in self.futures:
+                return
+            self.futures[key] = self.executor.submit(fn, *args)
+            self.counts["prefetched"] += 1
+
+    def take(self, key, fn, *args):
+        # 미리 준비한 값이 있으면 쓰고, 없거나 실패했으면 지금 계산한다.
+        with self.lock:
+            future = self.futures.pop(key, None)
+        if future is not None:
+            try:
+                value = future.result()
+            except Exception as e:
+                print(f"미리 준비하지 못했습니다. {key}: {e}")
+            else:
+                self.record_use()
+                return value
+        return fn(*args)
+
+    async def atake(self, key, fn, *args):
+        # take()와 같지만 준비가 끝나기를 기다리거나 지금 계산하는 동안 event loop를 막지 않는다.
+        with self.lock:
+            future = self.futures.pop(key, None)
+        if future is not None:
+            try:
+                value = await asyncio.wrap_future(future)
+            except Exception as e:
+                print(f"미리 준비하지 못했습니다. {key}: {e}")
+            else:
+                self.record_use()
+                return value
+        return await asyncio.to_thread(fn, *args)
+
+    def record_use(self):
+        with self.lock:
+            self.counts["used"] += 1
+
+    def clear(self, workspace):
+        # 이 작업 폴더에서 가져가지 않은 값은 버린다. (목차나 참고자료가 바뀌었을 수 있으므로)
+        with self.lock:
+            stale = [key for key in self.futures if key[0] == workspace]
+            for key in stale:
+                self.futures.pop(key).cancel()
+            self.counts["wasted"] += len(stale)
+
+    def record_route(self, routed_at, finished_at):
+        # agent를 고른 시각부터 Task 전체를 받은 시각까지는 다음 노드의 준비와 겹친다.
+        with self.lock:
+            self.counts["routes"] += 1
+            self.counts["saved_seconds"] += max(0.0, finished_at - routed_at)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def report(self):
+        stats = self.stats()
+        average = stats["saved_seconds"] / stats["routes"] if stats["routes"] else 0
+        return (
+            f"speculative routing: {stats['routes']}회 | 미리 준비 {stats['prefetched']}개 (사용 {stats['used']}, 버림 {stats['wasted']}) "
+            f"| supervisor 출력과 겹친 시간 평균 {average:.2f}s"
+        )
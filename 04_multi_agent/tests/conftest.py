@@ -0,0 +1,8 @@
+import sys
+import os
+
+# 04_multi_agent의 모듈을 바로 import할 수 있도록 한다. (from server import ... 등)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 테스트는 OpenAI API를 호출하지 않지만, 모듈을 import할 때 클라이언트가 만들어진다.
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
@@ -0,0 +1,64 @@
+from langchain_core.documents import Document
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from checkpoint import CheckpointJournal
+from references import ReferenceStore
+from history import HistoryManager
+from router import new_task
+
+
+def session_state():
+    return {
+        "messages": [SystemMessage("system"), HumanMessage("책을 쓰자")],
+        "task_history": [],
+        "references": ReferenceStore(),
+        "history": HistoryManager(),
+        "user_request": "",
+        "ai_recommandation": "",
+        "supervisor_call_count": 0,
+    }
+
+
+def doc(doc_id, text):
+    return Document(page_content=text, metadata={"source": f"https://{doc_id}"}, id=doc_id)
+
+
+def test_delta_contains_only_what_changed(tmp_path):
+    journal = CheckpointJournal(str(tmp_path), session_id="s")
+    state = session_state()
+    state["references"].add(["q1"], [(doc("a", "본문 A"), 0.5), (doc("b", "본문 B"), 0.4)])
+    journal.record("vector_search_agent", state)
+
+    # 이미 기록한 문서가 다시 검색되면 점수만 기록한다.
+    state["references"].add(["q2"], [(doc("a", "본문 A"), 0.9)])
+    delta = journal.record("vector_search_agent", state)
+    assert delta["references"] == {"queries": ["q2"], "docs": [{"id": "a", "metadata": {"source": "https://a"}, "relevance": 0.9, "hits": 2}]}
+
+    # 요약이 바뀌면 바뀐 값만 기록한다.
+    state["history"].digest = "요약"
+    state["messages"].append(AIMessage("[Business Analyst] 분석"))
+    delta = journal.record("business_analyst", state)
+    assert delta == {"messages": [["AIMessage", "[Business Analyst] 분석"]], "history": {"digest": "요약"}}
+
+    assert journal.record("business_analyst", state) == {}
+
+
+def test_resume_round_trip(tmp_path):
+    journal = CheckpointJournal(str(tmp_path), session_id="s", snapshot_every=3)
+    state = session_state()
+    for i in range(5):
+        state["references"].add([f"q{i}"], [(doc(f"d{i}", f"본문 {i}"), 0.1 * i), (doc("d0", "본문 0"), 0.05 * i)])
+        state["task_history"].append(new_task("vector_search_agent", f"검색 {i}"))
+        state["messages"].append(AIMessage(f"[VECTOR SEARCH AGENT] {i}"))
+        state["history"].summarized_until = i
+        state["supervisor_call_count"] = i
+        journal.record("vector_search_agent", state, outline=f"# 목차 {i}")
+
+    resumed, outline = CheckpointJournal(str(tmp_path), session_id="s").resume()
+
+    assert outline == "# 목차 4"
+    assert [m.content for m in resumed["messages"]] == [m.content for m in state["messages"]]
+    assert [t.description for t in resumed["task_history"]] == [t.description for t in state["task_history"]]
+    assert resumed["references"].to_dict() == state["references"].to_dict()
+    assert resumed["history"].summarized_until == 4
+    assert resumed["supervisor_call_count"] == 4
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from hedging import Hedger
+from scheduler import queue_waits
+
+
+class QueuedScheduler:
+    def queued(self):
+        return True
+
+
+def warmed_up(site, seconds=0.01, **kwargs):
+    hedger = Hedger(min_samples=5, timeout_factor=1.0, min_timeout=0.05, **kwargs)
+    for _ in range(5):
+        hedger.record_attempt(site, seconds, True)
+    return hedger
+
+
+def slow(value, seconds=0.3):
+    time.sleep(seconds)
+    return value
+
+
+def test_timeout_keeps_waiting_instead_of_raising():
+    hedger = warmed_up("site")
+    assert hedger.call("site", slow, "late") == "late"
+
+    stats = hedger.stats()["site"]
+    assert stats["timeouts"] == 1
+    assert stats["hedged"] == 1
+
+
+def test_async_timeout_keeps_waiting_instead_of_raising():
+    hedger = warmed_up("site")
+
+    async def aslow(value):
+        await asyncio.sleep(0.3)
+        return value
+
+    assert asyncio.run(hedger.acall("site", aslow, "late")) == "late"
+    assert hedger.stats()["site"]["timeouts"] == 1
+
+
+def test_no_hedge_while_scheduler_is_queuing():
+    hedger = warmed_up("site", scheduler=QueuedScheduler())
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return slow("ok", 0.1)
+
+    assert hedger.call("site", fn) == "ok"
+    assert len(calls) == 1
+    assert hedger.stats()["site"]["queued_skips"] == 1
+
+
+def test_scheduler_wait_is_not_counted_as_latency():
+    hedger = Hedger()
+
+    def queued_then_fast():
+        time.sleep(0.2) # 스케줄러에서 기다린 시간
+        queue_waits.get().append(0.2)
+        return "ok"
+
+    hedger.call("site", queued_then_fast)
+    assert list(hedger.latencies["site"])[0] < 0.1
@@ -0,0 +1,51 @@
+import asyncio
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+from history import HistoryManager
+
+
+def conversation(turns):
+    messages = [SystemMessage("시스템 안내")]
+    for i in range(turns):
+        messages += [HumanMessage(f"질문 {i}"), AIMessage(f"[Supervisor] 작업 {i}"), AIMessage(f"답변 {i}")]
+    return messages
+
+
+def test_compact_summarizes_only_messages_pushed_out_of_the_recent_turns():
+    history = HistoryManager(keep_turns=2, min_batch=3)
+    calls = []
+
+    def summarize(digest, text):
+        calls.append((digest, text))
+        return f"{digest}+{text.count('user:')}턴"
+
+    messages = conversation(2)
+    assert not history.compact(messages, summarize) # 최근 2턴은 그대로 둔다.
+
+    messages = conversation(4)
+    assert history.compact(messages, summarize)
+    assert history.summarized_until == 7 # 시스템 메시지 + 밀려난 2턴
+    assert calls == [("", "user: 질문 0\nai: [Supervisor] 작업 0\nai: 답변 0\nuser: 질문 1\nai: [Supervisor] 작업 1\nai: 답변 1")]
+
+    # 이미 요약한 메시지는 다시 요약하지 않고, 새로 밀려난 메시지가 min_batch보다 적으면 기다린다.
+    assert not history.compact(messages, summarize)
+    messages += [HumanMessage("질문 4"), AIMessage("답변 4")]
+    assert history.compact(messages, summarize)
+    assert calls[-1][0] == "+2턴" and history.summarized_until == 10
+
+
+def test_view_keeps_the_system_message_digest_and_recent_turns():
+    history = HistoryManager(keep_turns=1, min_batch=1)
+    messages = conversation(2)
+    asyncio.run(history.acompact(messages, lambda digest, text: asyncio.sleep(0, result="지난 대화 요약")))
+
+    view = history.view(messages)
+    assert view.splitlines()[:3] == ["system: 시스템 안내", "(이전 대화 요약)", "지난 대화 요약"]
+    assert "질문 0" not in view and "질문 1" in view
+
+    # 사용자에게 보여줄 때는 supervisor 메시지를 뺀다.
+    assert "[Supervisor]" not in history.view(messages, user_facing=True)
+
+    restored = HistoryManager.from_dict(history.to_dict())
+    assert restored.view(messages) == view
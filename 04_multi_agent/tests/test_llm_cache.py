@@ -0,0 +1,40 @@
+import httpx
+import pytest
+
+from llm_cache import ResponseCache, RecordReplayTransport, CacheMiss
+
+
+def chat_request(now, question="안녕?"):
+    return {
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": f"현재시각은 {now}이다."},
+            {"role": "user", "content": question},
+        ],
+    }
+
+
+def test_record_then_replay_ignores_timestamps(tmp_path):
+    calls = []
+
+    def api(request):
+        calls.append(request)
+        return httpx.Response(200, json={"answer": "안녕하세요"})
+
+    cache = ResponseCache(str(tmp_path), mode="record")
+    client = httpx.Client(transport=RecordReplayTransport(cache, httpx.MockTransport(api)))
+
+    recorded = client.post("https://api.openai.com/v1/chat/completions", json=chat_request("2025-01-01 09:00:00"))
+    assert recorded.json() == {"answer": "안녕하세요"}
+    assert cache.counts["recorded"] == 1
+
+    # 시각만 다른 요청은 기록한 응답으로 재생된다.
+    cache.mode = "replay"
+    replayed = client.post("https://api.openai.com/v1/chat/completions", json=chat_request("2025-01-02 18:30:15"))
+    assert replayed.json() == {"answer": "안녕하세요"}
+    assert len(calls) == 1
+    assert cache.counts["hits"] == 1
+
+    # 내용이 다른 요청은 재생하지 않는다.
+    with pytest.raises(CacheMiss):
+        client.post("https://api.openai.com/v1/chat/completions", json=chat_request("2025-01-02 18:30:15", "잘 가"))
@@ -0,0 +1,72 @@
+import tools
+from near_dup import NearDupIndex
+from url_index import UrlIndex
+
+text_a = "LangGraph는 상태 그래프로 여러 agent의 흐름을 정의하는 라이브러리이다. " * 5
+text_b = "LangGraph는 상태 그래프로 여러 agent의 흐름을 정의하는 라이브러리이다! " * 5
+text_c = "Chroma는 임베딩을 저장하고 가까운 벡터를 찾는 벡터 데이터베이스이다. " * 5
+
+
+def test_filter_skips_near_duplicates_of_stored_and_batch_chunks(tmp_path):
+    index = NearDupIndex(str(tmp_path / "near_dup.sqlite3"))
+    kept, skipped = index.filter([("a0", "https://a", text_a)])
+    index.add(kept)
+
+    kept, skipped = index.filter([("b0", "https://b", text_b), ("c0", "https://c", text_c), ("c1", "https://c", text_c)])
+    assert [chunk_id for chunk_id, _, _ in kept] == ["c0"]
+    assert skipped == {"b0": "a0", "c1": "c0"}
+
+    # 본문이 바뀌어 곧 지워질 URL과는 비교하지 않는다.
+    kept, skipped = index.filter([("b0", "https://b", text_b)], exclude_sources={"https://a"})
+    assert skipped == {}
+
+
+def test_removing_representative_reports_skipped_sources(tmp_path):
+    index = NearDupIndex(str(tmp_path / "near_dup.sqlite3"))
+    kept, _ = index.filter([("a0", "https://a", text_a)])
+    index.add(kept)
+    _, skipped = index.filter([("b0", "https://b", text_b)])
+    index.add_duplicates([(chunk_id, "https://b", duplicate_of) for chunk_id, duplicate_of in skipped.items()])
+
+    assert index.remove_sources(["https://a"]) == ["https://b"]
+    assert index.remove_sources(["https://a"]) == [] # 한 번만 알려준다.
+
+
+class FakeCollection:
+    def __init__(self, chunks):
+        self.chunks = dict(chunks) # chunk_id -> source
+
+    def get(self, where, include):
+        sources = where["source"]["$in"]
+        return {"ids": [id_ for id_, source in self.chunks.items() if source in sources]}
+
+    def delete(self, ids):
+        for id_ in ids:
+            self.chunks.pop(id_, None)
+
+
+class FakeVectorstore:
+    def __init__(self, collection):
+        self._collection = collection
+
+
+def test_evicting_representative_reingests_skipped_url(tmp_path, monkeypatch):
+    near_dup_index = NearDupIndex(str(tmp_path / "near_dup.sqlite3"))
+    url_index = UrlIndex(str(tmp_path / "url_index.sqlite3"))
+    collection = FakeCollection({"a0": "https://a"})
+
+    kept, _ = near_dup_index.filter([("a0", "https://a", text_a)])
+    near_dup_index.add(kept)
+    _, skipped = near_dup_index.filter([("b0", "https://b", text_b)])
+    near_dup_index.add_duplicates([(chunk_id, "https://b", duplicate_of) for chunk_id, duplicate_of in skipped.items()])
+    url_index.record([("https://a", "hash-a", 1), ("https://b", "hash-b", 0)])
+
+    monkeypatch.setattr(tools, "get_vectorstore", lambda: FakeVectorstore(collection))
+    monkeypatch.setattr(tools, "get_quantized_index", lambda: None)
+    monkeypatch.setattr(tools, "get_near_dup_index", lambda: near_dup_index)
+    monkeypatch.setattr(tools, "get_url_index", lambda: url_index)
+
+    assert tools.remove_sources_from_chroma(["https://a"]) == 1
+
+    # A는 인덱스에서 빠지고, B는 해시가 지워져 다음 수집 때 본문이 바뀐 것으로 보고 다시 저장된다.
+    assert url_index.lookup(["https://a", "https://b"]) == {"https://b": ""}
@@ -0,0 +1,55 @@
+from outline_store import (
+    OutlineStore, ChapterStreamSplitter, parse_outline,
+    outline_starts_marker, chapter_divider, done_marker,
+)
+
+
+preamble = "# 기획의도\n책의 메시지\n\n# chapter 제목 및 내용 간략 소개\n## Chapter 1: 시작\n## Chapter 2: 끝"
+chapter_1 = "## Chapter 1: 시작\n### Section 1.1: 배경"
+chapter_2 = "## Chapter 2: 끝\n### Section 2.1: 정리"
+
+
+def stream(text, size):
+    splitter = ChapterStreamSplitter()
+    chapters = []
+    for i in range(0, len(text), size):
+        chapters += splitter.feed(text[i:i + size])
+    return chapters + splitter.finish()
+
+
+def test_splitter_matches_parse_outline_across_chunk_sizes():
+    text = f"{preamble}\n{outline_starts_marker}\n{chapter_1}\n{chapter_divider}\n{chapter_2}\n{done_marker}\n후기"
+
+    for size in (1, 7, len(text)):
+        assert stream(text, size) == [chapter_1, chapter_2]
+    assert parse_outline(text) == {"preamble": preamble, "chapters": [chapter_1, chapter_2], "review": "후기"}
+
+
+def test_preamble_before_divider_without_start_marker_stays_out_of_chapter_1():
+    text = f"{preamble}\n\n{chapter_1}\n{chapter_divider}\n{chapter_2}"
+
+    for size in (1, 5, len(text)):
+        assert stream(text, size) == [chapter_1, chapter_2]
+    assert parse_outline(text)["preamble"] == preamble
+    assert parse_outline(text)["chapters"] == [chapter_1, chapter_2]
+
+    # chapter 제목이 없으면 구분자 앞은 모두 머리말이다.
+    text = f"머리말뿐\n{chapter_divider}\n{chapter_2}"
+    assert stream(text, 3) == [chapter_2]
+    assert parse_outline(text) == {"preamble": "머리말뿐", "chapters": [chapter_2], "review": ""}
+
+
+def test_store_keeps_versions_of_unchanged_chapters(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    assert store.load() is None
+
+    first, _ = store.save(preamble, [chapter_1, chapter_2], "")
+    changed = chapter_2 + "\n### Section 2.2: 추가"
+    second, rendered = store.save(preamble, [chapter_1, changed], "후기", previous=store.load())
+
+    assert [c["version"] for c in first["chapters"]] == [1, 1]
+    assert [c["version"] for c in second["chapters"]] == [1, 2]
+    assert store.load() == second
+    assert (tmp_path / "data" / "outline" / "versions" / "v0001.json").exists()
+    assert (tmp_path / "data" / "outline.md").read_text(encoding="utf-8") == rendered
+    assert parse_outline(rendered) == {"preamble": preamble, "chapters": [chapter_1, changed], "review": "후기"}
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from quantization import QuantizedIndex, truncate
+
+
+def make_vectors(n, dimensions=64, seed=0):
+    return truncate(np.random.default_rng(seed).normal(size=(n, dimensions)), None)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_add_remove_compact_search(tmp_path, mode):
+    vectors = make_vectors(40)
+    stored = {f"c{i}": vector for i, vector in enumerate(vectors)}
+    fetch = lambda ids: {id_: stored[id_] for id_ in ids if id_ in stored}
+    index = QuantizedIndex(str(tmp_path), 64, fetch, mode=mode, rescore_factor=40)
+
+    index.add(list(stored), vectors)
+    result = index.search(vectors[:3], top_k=1)
+    assert [r[0][0] for r in result] == ["c0", "c1", "c2"]
+    assert result[0][0][1] == pytest.approx(0.0, abs=1e-5)
+
+    # 지운 chunk는 검색되지 않는다.
+    index.remove(["c0"])
+    assert index.search(vectors[:1], top_k=1)[0][0][0] != "c0"
+
+    # 같은 ID를 다시 추가하면 예전 행을 지우고 새 벡터로 바꾼다. (upsert)
+    stored["c1"] = vectors[5]
+    index.add(["c1"], vectors[5:6])
+    assert index.count() == 39
+    assert index.stats()["deleted_rows"] == 2
+    assert {id_ for id_, _ in index.search(vectors[5:6], top_k=2)[0]} == {"c1", "c5"}
+
+    index.compact()
+    assert index.stats()["deleted_rows"] == 0
+    assert index.count() == 39
+    assert not (tmp_path / "deleted.txt").exists()
+
+    # 다시 열어도 같은 결과를 낸다.
+    reopened = QuantizedIndex(str(tmp_path), 64, fetch, mode=mode, rescore_factor=40)
+    assert reopened.count() == 39
+    assert "c0" not in reopened.rows
+    assert reopened.search(vectors[2:3], top_k=1)[0][0][0] == "c2"
+
+
+def test_candidates_missing_from_the_store_are_dropped(tmp_path):
+    vectors = make_vectors(4)
+    index = QuantizedIndex(str(tmp_path), 64, lambda ids: {}, mode="int8")
+    index.add(["a", "b", "c", "d"], vectors)
+    assert index.search(vectors[:2], top_k=2) == [[], []]
@@ -0,0 +1,65 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from router import FastPathRouter, new_task
+import v0604_anti_infinit_loop as team
+
+
+class FakeBudget:
+
+    def __init__(self, must_report):
+        self.reported = must_report
+
+    def must_report(self):
+        return self.reported
+
+
+def test_rules_apply_in_order_and_fall_back_to_llm():
+    router = FastPathRouter()
+
+    task = router.route({"budget": FakeBudget(True), "supervisor_call_count": 10})
+    assert task.agent == "communicator" and "예산" in task.description
+
+    task = router.route({"budget": FakeBudget(False), "supervisor_call_count": 4})
+    assert task.agent == "communicator" and "supervisor" in task.description
+
+    assert router.route({"budget": FakeBudget(False), "messages": [HumanMessage("목차를 써줘")]}) is None
+
+    stats = router.stats()
+    assert stats["total"] == 3 and stats["fast_path"] == 2 and stats["llm"] == 1
+    assert stats["rules"]["budget_exhausted_rule"] == 1
+    assert stats["rules"]["supervisor_limit_rule"] == 1
+
+
+def test_reviewer_suggestion_needs_the_analyst_to_agree():
+    review = AIMessage("[OUTLINE REVIEW AGENT] 근거가 부족하다.\n제안사항: web_search_agent로 자료를 더 찾는다.")
+    router = FastPathRouter()
+
+    agreed = AIMessage("[Business Analyst] web_search_agent로 최신 사례를 찾아야 한다.")
+    task = router.route({"messages": [HumanMessage("목차를 써줘"), review, agreed]})
+    assert task.agent == "web_search_agent" and agreed.content in task.description
+
+    disagreed = AIMessage("[Business Analyst] content_strategist가 목차를 고쳐야 한다.")
+    assert router.route({"messages": [HumanMessage("목차를 써줘"), review, disagreed]}) is None
+
+
+def test_pending_task_continues_without_duplicating_history():
+    finished = new_task("web_search_agent", "지난 턴의 검색")
+    finished.done = True
+    pending = new_task("content_strategist", "목차를 작성한다.")
+    state = {
+        "messages": [],
+        "task_history": [finished, pending],
+        "turn_task_start": 1,
+        "supervisor_call_count": 0,
+    }
+
+    task = FastPathRouter().route(state)
+    assert task is pending
+
+    result = team.finish_supervisor(state, task)
+    assert result["task_history"] == [finished, pending]
+    assert result["supervisor_call_count"] == 1
+
+    # 지난 턴에 끝내지 못한 작업은 이어서 하지 않는다.
+    state["turn_task_start"] = 2
+    assert FastPathRouter().route(state) is None
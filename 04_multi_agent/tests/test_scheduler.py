@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import RateScheduler, queue_waits, interactive, background
+
+
+def test_delay_waits_for_the_oldest_request_to_leave_the_window():
+    scheduler = RateScheduler({"m": {"rpm": 3, "tpm": 1000}})
+    now = time.monotonic()
+    scheduler.sent["m"].extend([[now - 50, 600], [now - 10, 300]])
+
+    # 토큰 한도: 600 토큰이 창 밖으로 빠지는 10초 뒤
+    assert scheduler.delay("m", 200, now) == pytest.approx(10)
+    assert scheduler.delay("m", 100, now) == 0.0
+    # 요청 수 한도: 요청 2개가 이미 있으므로 첫 요청이 빠질 때까지
+    scheduler.limits["m"] = {"rpm": 2, "tpm": 100000}
+    assert scheduler.delay("m", 200, now) == pytest.approx(10)
+
+
+def test_unknown_models_are_not_limited_and_tokens_are_capped():
+    scheduler = RateScheduler({"m": {"rpm": 10, "tpm": 100}})
+    assert scheduler.acquire("other", 10**9) is None
+
+    entry = scheduler.acquire("m", 10**9)
+    assert entry[1] == 100 # 한 번에 보낼 수 없는 크기는 한도로 맞춘다.
+
+    scheduler.settle(entry, 40)
+    assert scheduler.stats()["models"]["m"]["tokens_last_minute"] == 40
+
+
+def test_waiting_requests_go_out_by_priority_and_report_their_wait():
+    scheduler = RateScheduler({"m": {"rpm": 1, "tpm": 100000}})
+    scheduler.window_seconds = 0.3
+    scheduler.acquire("m", 10)
+
+    order, waits = [], {}
+
+    def send(name, priority):
+        waits[name] = []
+        queue_waits.set(waits[name])
+        scheduler.acquire("m", 10, priority)
+        order.append(name)
+
+    threads = [threading.Thread(target=send, args=("background", background))]
+    threads[0].start()
+    time.sleep(0.05)
+    assert scheduler.queued()
+    threads.append(threading.Thread(target=send, args=("interactive", interactive)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == ["interactive", "background"]
+    assert not scheduler.queued()
+    assert 0.1 < waits["interactive"][0] < waits["background"][0]
+    assert scheduler.stats()["models"]["m"]["max_queue_depth"] == 2
+
+
+def test_calibration_and_header_limits():
+    scheduler = RateScheduler({"m": {"rpm": 10, "tpm": 1000}, "fixed": {"rpm": 1, "tpm": 10}}, fixed=["fixed"])
+
+    scheduler.calibrate("m", 100, 200, weight=0.5)
+    assert scheduler.estimate("m", 100, max_tokens=50) == 150 + 50
+
+    headers = {"x-ratelimit-limit-requests": "500", "x-ratelimit-limit-tokens": "30000"}
+    scheduler.observe_limits("m", headers)
+    scheduler.observe_limits("fixed", headers)
+    assert scheduler.limits["m"] == {"rpm": 500, "tpm": 30000}
+    assert scheduler.limits["fixed"] == {"rpm": 1, "tpm": 10}
@@ -0,0 +1,79 @@
+from fastapi import WebSocketDisconnect
+
+import asyncio
+import time
+
+import server
+
+
+class DroppedSocket:
+    # 첫 메시지를 보낸 뒤 연결이 끊기는 클라이언트
+    def __init__(self, message, sent_before_drop=3):
+        self.messages = [{"message": message}]
+        self.sent_before_drop = sent_before_drop
+        self.sent = 0
+
+    async def accept(self):
+        pass
+
+    async def receive_json(self):
+        if self.messages:
+            return self.messages.pop(0)
+        await asyncio.sleep(3600) # 턴이 끝나기 전에는 다음 메시지가 오지 않는다.
+        raise WebSocketDisconnect()
+
+    async def send_json(self, event):
+        self.sent += 1
+        if self.sent > self.sent_before_drop:
+            raise RuntimeError("연결이 끊겼습니다.")
+
+
+def test_disconnect_mid_turn_releases_session_and_slot(monkeypatch, tmp_path):
+    async def endless_turn(session, emit=None):
+        while True:
+            await emit({"type": "token", "content": "x"})
+
+    manager = server.SessionManager()
+    session = server.Session("dropped", server.team.initial_state(), None, str(tmp_path))
+
+    async def get(session_id):
+        return session
+
+    monkeypatch.setattr(server, "manager", manager)
+    monkeypatch.setattr(server, "stream_turn", endless_turn)
+    monkeypatch.setattr(server, "max_outbox_events", 4)
+    monkeypatch.setattr(manager, "get", get)
+
+    async def scenario():
+        manager.start()
+        await asyncio.wait_for(server.session_socket(DroppedSocket("hello"), "dropped"), timeout=5)
+
+        assert not session.lock.locked()
+        assert manager.running == 0
+        # 슬롯을 모두 다시 잡을 수 있어야 한다.
+        for _ in range(server.max_concurrent_turns):
+            await asyncio.wait_for(manager.turn_slots.acquire(), timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_opens_resume_the_journal_once(monkeypatch, tmp_path):
+    calls = []
+
+    def start_session(resume, workspace_dir, session_id):
+        calls.append(session_id)
+        time.sleep(0.1) # journal을 읽는 동안 다른 요청이 들어온다.
+        return server.team.initial_state(), None
+
+    manager = server.SessionManager()
+    monkeypatch.setattr(server, "sessions_dir", str(tmp_path))
+    monkeypatch.setattr(server.team, "start_session", start_session)
+    (tmp_path / "shared").mkdir()
+
+    async def scenario():
+        return await asyncio.gather(manager.get("shared"), manager.get("shared"), manager.open("shared"))
+
+    sessions = asyncio.run(scenario())
+    assert calls == ["shared"]
+    assert sessions[0] is sessions[1] is sessions[2] is manager.sessions["shared"]
+    assert manager.opening == {}
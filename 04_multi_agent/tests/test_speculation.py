@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from speculation import Prefetcher, streamed_value
+
+
+def test_streamed_value_waits_for_the_closing_quote():
+    assert streamed_value('{"agent": "commun', "agent") is None
+    assert streamed_value('{"agent": "communicator", "de', "agent") == "communicator"
+
+
+def test_atake_awaits_the_prefetch_without_blocking_the_loop():
+    prefetcher = Prefetcher()
+    release = threading.Event()
+    prefetcher.start(("ws", "communicator", "outline"), lambda: release.wait(5) and "미리 읽은 목차")
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            # atake가 기다리는 동안에도 event loop의 다른 작업이 진행된다.
+            nonlocal ticks
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+                ticks += 1
+            release.set()
+
+        value, _ = await asyncio.gather(
+            prefetcher.atake(("ws", "communicator", "outline"), lambda: "지금 읽은 목차"),
+            ticker(),
+        )
+        return value, ticks
+
+    assert asyncio.run(scenario()) == ("미리 읽은 목차", 5)
+    assert prefetcher.stats()["used"] == 1
+
+
+def test_atake_computes_when_nothing_was_prefetched_or_it_failed():
+    prefetcher = Prefetcher()
+
+    def fail():
+        raise RuntimeError("읽기 실패")
+
+    prefetcher.start(("ws", "web_search_agent", "outline"), fail)
+
+    async def scenario():
+        missing = await prefetcher.atake(("ws", "communicator", "outline"), lambda: "지금 읽은 목차")
+        failed = await prefetcher.atake(("ws", "web_search_agent", "outline"), lambda: "다시 읽은 목차")
+        return missing, failed
+
+    assert asyncio.run(scenario()) == ("지금 읽은 목차", "다시 읽은 목차")
+    assert prefetcher.stats()["used"] == 0
@@ -0,0 +1,127 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from collections import defaultdict
+import threading
+import math
+import time
+
+# 노드별 모델. 여기에 없는 노드는 기본 모델(default_model)을 사용한다.
+# 라우팅이나 분석처럼 가벼운 노드는 작은 모델로 빠르게 처리하고, 결과가 미덥지 않으면 기본 모델로 다시 한다.
+default_model = "gpt-4o"
+node_models = {
+    "supervisor": "gpt-4o-mini",
+    "business_analyst": "gpt-4o-mini",
+    "web_search_agent": "gpt-4o-mini",
+    "vector_search_agent": "gpt-4o-mini",
+}
+
+# supervisor가 고른 agent 이름의 확률(logprob)이 이 값보다 낮으면 기본 모델로 다시 결정한다.
+escalation_confidence = 0.6
+
+
+def node_model(node):
+    return node_models.get(node, default_model)
+
+
+def value_confidence(message, key, value):
+    """
+    구조화된 출력(json) 중 key의 값(value)을 만든 토큰들의 확률 중 가장 낮은 값을 반환한다.
+    logprobs가 없으면 None
+
+    Args:
+        message (AIMessage): logprobs=True로 받은 응답
+        key (str): json 키 (예: "agent")
+        value (str): 파싱된 값 (예: "communicator")
+    """
+    tokens = ((message.response_metadata or {}).get("logprobs") or {}).get("content") or []
+    if not tokens:
+        return None
+
+    text = "".join(token["token"] for token in tokens)
+    key_at = text.find(f'"{key}"')
+    start = text.find(value, key_at) if key_at >= 0 else -1
+    if start < 0:
+        return None
+    end = start + len(value)
+
+    # 값과 겹치는 토큰들의 확률
+    probabilities = []
+    position = 0
+    for token in tokens:
+        token_end = position + len(token["token"])
+        if token_end > start and position < end:
+            probabilities.append(math.exp(token["logprob"]))
+        position = token_end
+
+    return min(probabilities) if probabilities else None
+
+
+def escalation_reason(result, key="agent"):
+    """
+    with_structured_output(include_raw=True)의 결과를 보고 큰 모델로 다시 해야 하는 이유를 반환한다.
+    다시 할 필요가 없으면 None
+    """
+    if result["parsing_error"] is not None or result["parsed"] is None:
+        return "parse_error"
+
+    confidence = value_confidence(result["raw"], key, getattr(result["parsed"], key))
+    if confidence is not None and confidence < escalation_confidence:
+        return "low_confidence"
+    return None
+
+
+class ModelTierStats(BaseCallbackHandler):
+    """
+    노드별로 어떤 모델을 몇 번 호출했고 얼마나 걸렸는지, 큰 모델로 몇 번 다시 했는지 기록한다.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {} # run_id -> (노드, 모델, 시작 시각)
+        self.stats = defaultdict(lambda: {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        self.escalations = defaultdict(lambda: defaultdict(int)) # 노드 -> 이유 -> 횟수
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name", "llm")
+        node = (metadata or {}).get("langgraph_node", "unknown")
+        with self.lock:
+            self.runs[run_id] = (node, model, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            run = self.runs.pop(run_id, None)
+            if run is None:
+                return
+            node, model, started = run
+            seconds = time.perf_counter() - started
+            stats = self.stats[(node, model)]
+            stats["calls"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.runs.pop(run_id, None)
+
+    def escalate(self, node, reason):
+        print(f"[{node}] {reason}: {default_model}로 다시 실행합니다.")
+        with self.lock:
+            self.escalations[node][reason] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "models": {f"{node}:{model}": dict(stats) for (node, model), stats in self.stats.items()},
+                "escalations": {node: dict(reasons) for node, reasons in self.escalations.items()},
+            }
+
+    def report(self):
+        snapshot = self.snapshot()
+        lines = ["노드별 모델 호출 (평균/최대 지연)"]
+        for name, stats in sorted(snapshot["models"].items()):
+            average = stats["total_seconds"] / stats["calls"] if stats["calls"] else 0
+            lines.append(f"- {name}: {stats['calls']}회 | 평균 {average:.2f}s, 최대 {stats['max_seconds']:.2f}s")
+        for node, reasons in sorted(snapshot["escalations"].items()):
+            lines.append(f"- {node} 큰 모델로 다시 실행: " + ", ".join(f"{reason} {count}회" for reason, count in reasons.items()))
+        return "\n".join(lines)
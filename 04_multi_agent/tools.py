@@ -1,30 +1,142 @@
-from tavily import TavilyClient
+from tavily import TavilyClient, AsyncTavilyClient
 from langchain_core.tools import tool
-from langchain_community.document_loaders import WebBaseLoader
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 
-from datetime import datetime
+import contextvars
+import threading
+import asyncio
 import json
+import time
 import os
+
+import fetcher
+from url_index import UrlIndex, content_hash, chunk_id
+from near_dup import NearDupIndex, collapse_near_duplicates
+from resource_store import ResourceStore
+from quantization import QuantizedIndex, collection_fetcher
+from tracing import tracer
+from scheduler import scheduler, normal, background
+from hedging import hedger
+from llm_cache import http_client, async_http_client
+from utils import estimate_tokens
+
 absolute_path = os.path.abspath(__file__) # 현재 파일의 절대 경로 반환
 current_path = os.path.dirname(absolute_path) # 현재 .py 파일이 있는 폴더 경로
 
 # RAG를 위한 설정
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-
-# OpenAI Embedding 설정
-embedding = OpenAIEmbeddings(model='text-embedding-3-large')
-
-# Chroma DB 저장 경로 설정
-persist_directory = f"{current_path}/data/chroma_store"
-
-# Chroma 객체 생성
-vectorstore = Chroma(
-    persist_directory=persist_directory,
-    embedding_function=embedding
-)
+# 임베딩 모델과 Chroma는 import 시점이 아니라 처음 사용할 때 만든다. (오프라인에서도 import 가능)
+# EMBEDDING_DIMENSIONS: text-embedding-3-large의 차원을 줄인다. (예: 1024, 기본값은 3072 그대로)
+# VECTOR_QUANTIZATION: int8 또는 binary이면 검색은 양자화 인덱스로 후보를 고르고 원래 벡터로 다시 점수를 매긴다.
+# 기존 chroma_store는 python quantization.py --dimensions 1024 --mode int8 로 옮긴다.
+embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None
+vector_quantization = os.getenv("VECTOR_QUANTIZATION") or None
+# chroma_store와 함께 저장된 chunk를 기록하는 인덱스(url_index, near_dup)도 차원마다 따로 둔다.
+store_suffix = f"_{embedding_dimensions}" if embedding_dimensions else ""
+persist_directory = f"{current_path}/data/chroma_store{store_suffix}"
+
+embedding = None
+vectorstore = None
+url_index = None
+near_dup_index = None
+resource_store = None
+quantized_index = None
+near_dup_threshold = 0.85 # MinHash로 추정한 Jaccard 유사도가 이 값 이상이면 거의 같은 chunk로 본다.
+lazy_init_lock = threading.Lock()
+chroma_write_lock = threading.Lock()
+
+# 웹 chunk 수명 관리: 수집되거나 검색된 뒤 chunk_ttl_days가 지난 URL의 chunk를 지우고,
+# 저장된 chunk가 max_stored_chunks를 넘으면 가장 오래 검색되지 않은 URL부터 지운다. (PDF 등 로컬 문서는 지우지 않는다)
+# 정리(지우기 + 저장소 compaction)는 maintenance_interval_seconds마다 한 번 한다. (마지막 정리 시각은 url_index에 기록)
+chunk_ttl_days = float(os.getenv("CHUNK_TTL_DAYS", 30))
+max_stored_chunks = int(os.getenv("MAX_STORED_CHUNKS", 50000))
+maintenance_interval_seconds = 3600
+
+
+def get_embedding():
+    # OpenAI Embedding 설정
+    global embedding
+    with lazy_init_lock:
+        if embedding is None:
+            from langchain_openai import OpenAIEmbeddings
+            embedding = OpenAIEmbeddings(
+                model='text-embedding-3-large', dimensions=embedding_dimensions,
+                http_client=http_client, http_async_client=async_http_client
+            )
+    return embedding
+
+
+def get_vectorstore():
+    # Chroma 객체 생성
+    global vectorstore
+    embedding_function = get_embedding()
+    with lazy_init_lock:
+        if vectorstore is None:
+            from langchain_chroma import Chroma
+            vectorstore = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=embedding_function
+            )
+    return vectorstore
+
+
+def warm_up_retriever():
+    # 검색 노드가 실행되기 전에 벡터 DB를 열어 둔다. (supervisor가 검색 agent를 고르는 즉시 호출)
+    get_vectorstore()._collection.count()
+
+
+def get_quantized_index():
+    # VECTOR_QUANTIZATION을 설정했을 때만 사용하는 양자화 인덱스 (chroma_store 옆에 저장). 없으면 None
+    global quantized_index
+    if vector_quantization is None:
+        return None
+    vectorstore = get_vectorstore()
+    with lazy_init_lock:
+        if quantized_index is None:
+            # 후보를 다시 점수 매길 때는 Chroma에 저장된 원래 벡터를 읽는다.
+            quantized_index = QuantizedIndex(
+                f"{persist_directory}_{vector_quantization}", embedding_dimensions or 3072,
+                collection_fetcher(vectorstore._collection), mode=vector_quantization
+            )
+            # 인덱스가 비어 있는데 Chroma에 데이터가 있으면, 저장된 임베딩으로 한 번만 만든다.
+            if quantized_index.count() == 0 and vectorstore._collection.count() > 0:
+                stored = vectorstore._collection.get(include=["embeddings"])
+                print(f"기존 chunk {len(stored['ids'])}개의 양자화 인덱스를 만듭니다.")
+                quantized_index.add(stored['ids'], stored['embeddings'])
+    return quantized_index
+
+
+def get_url_index():
+    # Chroma에 저장된 URL과 본문 해시를 기록하는 인덱스 (chroma_store 옆에 저장)
+    global url_index
+    with lazy_init_lock:
+        if url_index is None:
+            url_index = UrlIndex(f"{current_path}/data/url_index{store_suffix}.sqlite3")
+    return url_index
+
+
+def get_near_dup_index():
+    # 저장된 chunk의 MinHash 서명과 LSH 버킷 (임베딩 전에 거의 같은 chunk를 걸러낸다)
+    global near_dup_index
+    with lazy_init_lock:
+        if near_dup_index is None:
+            near_dup_index = NearDupIndex(f"{current_path}/data/near_dup{store_suffix}.sqlite3", threshold=near_dup_threshold)
+    return near_dup_index
+
+
+def get_resource_store():
+    # 웹검색 결과 원문을 압축해서 덧붙이는 로그 (본문 해시로 중복 제거, URL로 조회)
+    global resource_store
+    with lazy_init_lock:
+        if resource_store is None:
+            resource_store = ResourceStore(f"{current_path}/data/resources")
+    return resource_store
+
+
+def reserve_embedding(texts, priority=normal):
+    # 임베딩 요청도 LLM과 같은 스케줄러에서 분당 요청/토큰 한도를 나눠 쓴다.
+    scheduler.acquire(get_embedding().model, sum(estimate_tokens(text) for text in texts), priority)
 
 # Tavily API Key
 
@@ -32,6 +144,9 @@ from dotenv import load_dotenv
 load_dotenv()
 tavily_api_key = os.getenv('TAVILY_API_KEY')
 
+# 웹페이지를 동시에 불러올 때 사용할 최대 스레드 수
+max_page_workers = 8
+
 @tool
 def web_search(query: str):
     """
@@ -41,7 +156,7 @@ def web_search(query: str):
         query (str): 검색어
 
     Returns:
-        dict: 검색 결과
+        list[dict]: 검색 결과 (리소스 로그에 저장한 레코드)
     """
     client = TavilyClient(
         api_key=tavily_api_key
@@ -54,22 +169,134 @@ def web_search(query: str):
     )
 
     results = content["results"]
+    fill_missing_raw_content(results)
+   
+    return get_resource_store().append(results, query=query)
+
+
+@tool
+async def aweb_search(query: str):
+    """
+    web_search의 비동기 버전. AsyncTavilyClient로 웹검색을 하고, 결과를 반환한다.
+
+    Args:
+        query (str): 검색어
+
+    Returns:
+        list[dict]: 검색 결과 (리소스 로그에 저장한 레코드)
+    """
+    client = AsyncTavilyClient(
+        api_key=tavily_api_key
+    )
+
+    content = await client.search(
+        query, 
+        search_depth="advanced",
+        include_raw_content=True,
+    )
+
+    results = content["results"]
+    await asyncio.to_thread(fill_missing_raw_content, results)
+
+    return await asyncio.to_thread(get_resource_store().append, results, query)
+
+
+def fill_missing_raw_content(results, max_workers=max_page_workers):
+    # raw_content가 없는 검색 결과는 웹페이지를 직접 불러와서 채운다.
+    missing = [result for result in results if result["raw_content"] is None]
+    if not missing:
+        return results
+
+    def fill(result):
+        try:
+            result["raw_content"] = load_web_page(result["url"])
+        except Exception as e:
+            print(f"Error loading page: {result['url']}")
+            print(e)
+            result["raw_content"] = result["content"]
+
+    # 크기가 제한된 스레드 풀에서 동시에 불러온다. (tracing span이 이어지도록 컨텍스트를 전달)
+    with ContextThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+        list(executor.map(fill, missing))
+
+    return results
+
+
+def unique_results_by_url(results):
+    # 여러 검색어에서 같은 URL이 나오면 처음 것만 남긴다.
+    unique_results = []
+    seen_urls = set()
 
     for result in results:
-        if result["raw_content"] is None:
-            try:
-                result["raw_content"] = load_web_page(result["url"])
-            except Exception as e:
-                print(f"Error loading page: {result['url']}")
-                print(e)
-                result["raw_content"] = result["content"]
-
-    # 결과를 json 파일로 저장
-    resources_json_path = f'{current_path}/data/resources_{datetime.now().strftime('%Y_%m%d_%H%M%S')}.json'
-    with open(resources_json_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=4)
-   
-    return results, resources_json_path
+        if result["url"] not in seen_urls:
+            unique_results.append(result)
+            seen_urls.add(result["url"])
+
+    return unique_results
+
+
+def web_search_many(queries, max_workers=max_page_workers):
+    """
+    여러 검색어를 동시에 웹검색하고, URL 기준으로 중복을 제거한 결과를 리소스 로그에 저장한다.
+
+    Args:
+        queries (list[str]): 검색어 목록
+        max_workers (int): 웹페이지를 동시에 불러올 최대 스레드 수
+
+    Returns:
+        list[dict]: 검색 결과 (리소스 로그에 저장한 레코드)
+    """
+    if not queries:
+        return []
+
+    client = TavilyClient(
+        api_key=tavily_api_key
+    )
+
+    def search(query):
+        with tracer.span("tavily.search", kind="tool", query=query) as span:
+            results = client.search(
+                query, 
+                search_depth="advanced",
+                include_raw_content=True,
+            )["results"]
+            span.set(result_size=len(results))
+            return results
+
+    # 검색어는 모두 동시에 검색한다.
+    with ContextThreadPoolExecutor(max_workers=len(queries)) as executor:
+        search_results = list(executor.map(search, queries))
+
+    results = unique_results_by_url([r for results in search_results for r in results])
+    fill_missing_raw_content(results, max_workers=max_workers)
+
+    return get_resource_store().append(results, query=" | ".join(queries))
+
+
+async def aweb_search_many(queries, max_workers=max_page_workers):
+    """
+    web_search_many의 비동기 버전. AsyncTavilyClient로 여러 검색어를 동시에 검색한다.
+    """
+    if not queries:
+        return []
+
+    client = AsyncTavilyClient(
+        api_key=tavily_api_key
+    )
+
+    async def search(query):
+        with tracer.span("tavily.search", kind="tool", query=query) as span:
+            content = await client.search(query, search_depth="advanced", include_raw_content=True)
+            span.set(result_size=len(content["results"]))
+            return content["results"]
+
+    search_results = await asyncio.gather(*[search(query) for query in queries])
+
+    results = unique_results_by_url([r for results in search_results for r in results])
+    await asyncio.to_thread(fill_missing_raw_content, results, max_workers)
+
+    return await asyncio.to_thread(get_resource_store().append, results, " | ".join(queries))
+
 
 def web_page_to_document(web_page):
     if len(web_page['raw_content']) > len(web_page['content']):
@@ -99,6 +326,11 @@ def web_page_json_to_documents(json_file):
 
     return documents
 
+def web_pages_to_documents(web_pages):
+    # 검색 결과(리소스 레코드)를 파일을 거치지 않고 바로 Document로 바꾼다.
+    for web_page in web_pages:
+        yield web_page_to_document(web_page)
+
 def split_documents(documents, chunk_size=1000, chunk_overlap=100):
     print('Splitting documents...')
     print(f"{len(documents)}개의 문서를 {chunk_size}자 크기로 중첩 {chunk_overlap}자로 분할합니다.\n")
@@ -113,65 +345,386 @@ def split_documents(documents, chunk_size=1000, chunk_overlap=100):
     return splits
 
 def documents_to_chroma(documents, chunk_size=1000, chunk_overlap=100):
+    # 여러 세션이 동시에 저장해도 URL 조회 -> 중복 확인 -> upsert 사이에 다른 저장이 끼어들지 않도록 한 번에 하나씩 저장한다.
+    with chroma_write_lock:
+        write_documents_to_chroma(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    # 정리할 때가 되었으면 저장한 노드를 기다리게 하지 않도록 스레드에서 정리한다.
+    if time.time() - get_url_index().last_maintained_at() >= maintenance_interval_seconds:
+        threading.Thread(target=contextvars.copy_context().run, args=(maintain_chunk_store,), daemon=True).start()
+
+
+def invalidate_orphaned_sources(orphaned):
+    # 지운 chunk와 같아서 건너뛰었던 chunk의 URL은, 다음에 수집할 때 다시 저장되도록 한다.
+    if orphaned:
+        print(f"지운 chunk와 거의 같아서 저장하지 않았던 URL {len(orphaned)}개를 다음 수집 때 다시 저장합니다.")
+        get_url_index().invalidate(orphaned)
+
+
+def remove_sources_from_chroma(urls, batch_size=100):
+    # URL의 chunk를 Chroma, 양자화 인덱스, MinHash 인덱스, URL 인덱스에서 모두 지운다. (chroma_write_lock 안에서 호출)
+    collection = get_vectorstore()._collection
+    quantized_index = get_quantized_index()
+    removed = 0
+    orphaned = set()
+    for i in range(0, len(urls), batch_size):
+        batch = urls[i:i + batch_size]
+        ids = collection.get(where={"source": {"$in": batch}}, include=[])['ids']
+        if ids:
+            if quantized_index is not None:
+                quantized_index.remove(ids)
+            collection.delete(ids=ids)
+            removed += len(ids)
+        orphaned.update(get_near_dup_index().remove_sources(batch))
+        get_url_index().remove(batch)
+    invalidate_orphaned_sources(sorted(orphaned - set(urls)))
+    return removed
+
+
+def evict_stale_chunks(ttl_days=None, max_chunks=None):
+    """
+    오래 쓰이지 않은 웹 URL의 chunk를 지운다.
+    1. 수집되거나 검색된 뒤 ttl_days가 지난 URL
+    2. 그래도 chunk가 max_chunks보다 많으면 가장 오래 검색되지 않은 URL부터
+
+    Returns:
+        dict: {"expired_urls", "lru_urls", "removed_chunks", "stored_chunks"}
+    """
+    ttl_days = chunk_ttl_days if ttl_days is None else ttl_days
+    max_chunks = max_stored_chunks if max_chunks is None else max_chunks
+    url_index = get_url_index()
+
+    with chroma_write_lock:
+        expired = url_index.expired(ttl_days)
+        removed = remove_sources_from_chroma(expired)
+
+        # chunk_count는 거의 같은 chunk를 빼기 전의 수이므로, 실제 chunk 수가 예산 안으로 들어올 때까지 반복한다.
+        lru = []
+        stored = get_vectorstore()._collection.count()
+        while stored > max_chunks:
+            urls = url_index.least_recently_used(stored - max_chunks)
+            if not urls:
+                break
+            removed += remove_sources_from_chroma(urls)
+            lru += urls
+            stored = get_vectorstore()._collection.count()
+
+    if expired or lru:
+        print(f"오래 쓰이지 않은 URL {len(expired) + len(lru)}개의 chunk {removed}개를 지웠습니다. (남은 chunk {stored}개)")
+    return {"expired_urls": len(expired), "lru_urls": len(lru), "removed_chunks": removed, "stored_chunks": stored}
+
+
+def compact_chunk_store():
+    # 지운 chunk가 차지하던 공간을 정리한다. (Chroma의 로그와 SQLite 파일, 양자화 인덱스의 지운 행)
+    with chroma_write_lock:
+        vectorstore = get_vectorstore()
+        try:
+            from chromadb.db.impl.sqlite import SqliteDB
+
+            sqlite = vectorstore._client._system.instance(SqliteDB)
+            sqlite.purge_log(collection_id=vectorstore._collection.id)
+            sqlite.vacuum()
+        except Exception as e:
+            print(f"Chroma 저장소를 정리하지 못했습니다: {e}")
+
+        quantized_index = get_quantized_index()
+        if quantized_index is not None and quantized_index.stats()["deleted_rows"]:
+            quantized_index.compact()
+
+        get_url_index().vacuum()
+        get_near_dup_index().vacuum()
+
+
+def maintain_chunk_store(force=False):
+    # maintenance_interval_seconds마다 한 번 오래된 chunk를 지우고 저장소를 정리한다. (force이면 바로 정리)
+    if not get_url_index().claim_maintenance(0 if force else maintenance_interval_seconds):
+        return None
+
+    with tracer.span("chroma.maintenance", kind="tool") as span:
+        result = evict_stale_chunks()
+        if result["removed_chunks"] or force:
+            compact_chunk_store()
+        span.set(result_size=result["removed_chunks"])
+    return result
+
+
+def write_documents_to_chroma(documents, chunk_size=1000, chunk_overlap=100):
     print("Documents를 Chroma DB에 저장합니다.")
+    vectorstore = get_vectorstore()
+    url_index = get_url_index()
+    near_dup_index = get_near_dup_index()
+
+    # 인덱스가 비어 있는데 Chroma에 데이터가 있으면, 기존 URL을 한 번만 인덱스에 옮긴다.
+    if url_index.is_empty() and vectorstore._collection.count() > 0:
+        stored_metadatas = vectorstore._collection.get(include=["metadatas"])['metadatas']
+        url_index.backfill([metadata['source'] for metadata in stored_metadatas])
+
+    # 기존 chunk의 MinHash 서명도 한 번만 만든다.
+    if near_dup_index.is_empty() and vectorstore._collection.count() > 0:
+        stored = vectorstore._collection.get(include=["documents", "metadatas"])
+        print(f"기존 chunk {len(stored['ids'])}개의 MinHash 서명을 만듭니다.")
+        near_dup_index.backfill(stored['ids'], [metadata.get('source') for metadata in stored['metadatas']], stored['documents'])
+
+    # documents를 url별로 묶는다. 웹페이지는 같은 배치 안의 중복 URL은 처음 것만 사용하고,
+    # PDF처럼 페이지(page)로 나뉜 문서는 모든 페이지를 사용한다.
+    documents_by_url = {}
+    for document in documents:
+        url_documents = documents_by_url.setdefault(document.metadata['source'], [])
+        if url_documents and document.metadata.get('page') is None:
+            continue
+        url_documents.append(document)
 
-    # documents의 url 가져오기
-    urls = [document.metadata['source'] for document in documents]
+    # 후보 url만 인덱스에서 조회
+    stored_hashes = url_index.lookup(documents_by_url.keys())
 
-    # 이미 vectorstore에 저장된 urls 가져오기
-    stored_metadatas = vectorstore._collection.get()['metadatas'] # vectorstore에 저장된 metadata 가져오기
-    stored_web_urls = [metadata['source'] for metadata in stored_metadatas] # vectorstore에 저장된 url 가져오기
+    # 새로운 url이거나 본문이 바뀐 url의 documents만 남기기
+    new_documents = []
+    recorded_hashes = {}
+    changed_urls = []
 
-    # 새로운 urls만 남기기
-    new_urls = set(urls) - set(stored_web_urls)
+    for url, url_documents in documents_by_url.items():
+        new_hash = content_hash("\n".join(document.page_content for document in url_documents))
 
-    # 새로운 urls에 대한 documents만 남기기
-    new_documents = []
+        if url in stored_hashes:
+            stored_hash = stored_hashes[url]
+            if stored_hash is None or stored_hash == new_hash:
+                continue
+            changed_urls.append(url)
 
-    for document in documents:
-        if document.metadata['source'] in new_urls:
-            new_documents.append(document)
-            print(document.metadata)
+        for document in url_documents:
+            document.metadata['content_hash'] = new_hash
+        new_documents += url_documents
+        recorded_hashes[url] = new_hash
+        print(url_documents[0].metadata)
 
     # 새로운 documents를 Chroma DB에 저장
     splits = split_documents(new_documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
-    # Chroma DB에 저장
-    if splits:
-        vectorstore.add_documents(splits)
-    else:
+    if not splits:
         print("No new urls to process")
+        return
+
+    # url과 chunk 순서, 내용으로 결정되는 ID
+    ids = []
+    split_counts = {}
+    for split in splits:
+        url = split.metadata['source']
+        index = split_counts.get(url, 0)
+        split_counts[url] = index + 1
+        ids.append(chunk_id(url, index, split.page_content))
+
+    # 이미 저장된 chunk나 같은 배치의 chunk와 거의 같은 chunk는 임베딩하지 않는다.
+    # (본문이 바뀐 url의 예전 chunk는 곧 지워지므로 비교 대상에서 뺀다.)
+    kept, skipped = near_dup_index.filter(
+        [(id_, split.metadata['source'], split.page_content) for id_, split in zip(ids, splits)],
+        exclude_sources=set(changed_urls),
+    )
+    if skipped:
+        print(f"거의 같은 chunk {len(skipped)}개는 저장하지 않습니다.")
+
+    kept_ids = {id_ for id_, _, _ in kept}
+    sources = {id_: split.metadata['source'] for id_, split in zip(ids, splits)}
+    kept_splits = [split for id_, split in zip(ids, splits) if id_ in kept_ids]
+    ids = [id_ for id_ in ids if id_ in kept_ids]
+
+    # URL 인덱스에는 실제로 저장한 chunk 수를 기록한다. (LRU로 지울 때 저장소 크기 계산에 사용)
+    chunk_counts = {}
+    for split in kept_splits:
+        chunk_counts[split.metadata['source']] = chunk_counts.get(split.metadata['source'], 0) + 1
+
+    # 본문이 바뀐 url의 예전 chunk는 지운다.
+    quantized_index = get_quantized_index()
+    for url in changed_urls:
+        if quantized_index is not None:
+            quantized_index.remove(vectorstore._collection.get(where={"source": url}, include=[])['ids'])
+        vectorstore._collection.delete(where={"source": url})
+    invalidate_orphaned_sources([url for url in near_dup_index.remove_sources(changed_urls) if url not in recorded_hashes])
+
+    # 결정적인 ID로 upsert (양자화 인덱스에도 같은 임베딩을 넣도록 직접 임베딩한다)
+    if kept_splits:
+        texts = [split.page_content for split in kept_splits]
+        reserve_embedding(texts, priority=background)
+        with tracer.span("chroma.upsert", kind="tool", urls=len(recorded_hashes)) as span:
+            vectors = get_embedding().embed_documents(texts)
+            vectorstore._collection.upsert(
+                ids=ids, embeddings=vectors, documents=texts, metadatas=[split.metadata for split in kept_splits]
+            )
+            if quantized_index is not None:
+                quantized_index.add(ids, vectors)
+            span.set(result_size=len(kept_splits), skipped_near_duplicates=len(skipped))
+        near_dup_index.add(kept)
+    near_dup_index.add_duplicates([(id_, sources[id_], duplicate_of) for id_, duplicate_of in skipped.items()])
+
+    url_index.record([
+        (url, hash_, chunk_counts.get(url, 0))
+        for url, hash_ in recorded_hashes.items()
+    ])
+
+def add_web_pages_to_chroma(web_pages, chunk_size=1000, chunk_overlap=100):
+    documents_to_chroma(web_pages_to_documents(web_pages), chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
 
 def add_web_pages_json_to_chroma(json_file, chunk_size=1000, chunk_overlap=100):
+    # 예전 resources_*.json 파일용
     documents = web_page_json_to_documents(json_file)
     documents_to_chroma(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
 
+def pdf_to_documents(pdf_path):
+    # PDF를 페이지별 Document로 읽는다. (metadata: source, page)
+    from langchain_community.document_loaders import PyPDFLoader
+
+    documents = PyPDFLoader(pdf_path).load()
+    for document in documents:
+        document.metadata.setdefault('title', os.path.basename(pdf_path))
+    return documents
+
+
+def add_pdfs_to_chroma(pdf_paths, chunk_size=1000, chunk_overlap=100):
+    # PDF도 웹페이지와 같은 경로(해시 비교, 거의 같은 chunk 제거)로 저장한다.
+    documents = []
+    for pdf_path in pdf_paths:
+        documents += pdf_to_documents(pdf_path)
+    documents_to_chroma(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
 @tool
 def retrieve(query: str, top_k: int=5):
     """
     주어진 query에 대해 벡터 검색을 수행하고, 결과를 반환한다.
     """
-    retriever = vectorstore.as_retriever(search_kwargs={"k": top_k})
+    reserve_embedding([query])
+    retriever = get_vectorstore().as_retriever(search_kwargs={"k": top_k})
     retrieved_dcs = retriever.invoke(query)
 
     return retrieved_dcs
 
-def load_web_page(url: str):
-    loader = WebBaseLoader(url)
 
-    content = loader.load()
-    raw_content = content[0].page_content.strip()
+@tool
+async def aretrieve(query: str, top_k: int=5):
+    """
+    retrieve의 비동기 버전. 주어진 query에 대해 벡터 검색을 수행하고, 결과를 반환한다.
+    """
+    await asyncio.to_thread(reserve_embedding, [query])
+    retriever = get_vectorstore().as_retriever(search_kwargs={"k": top_k})
+    retrieved_dcs = await retriever.ainvoke(query)
+
+    return retrieved_dcs
+
+def query_quantized_index(quantized_index, query_vectors, top_k=5):
+    # 양자화 인덱스로 찾은 chunk ID의 본문과 metadata는 Chroma에서 가져온다. (Chroma query와 같은 형식으로 반환)
+    found = quantized_index.search(query_vectors, top_k=top_k)
+    ids = list({id_ for result in found for id_, _ in result})
+    stored = get_vectorstore()._collection.get(ids=ids, include=["documents", "metadatas"]) if ids else {"ids": []}
+    rows = {id_: (document, metadata) for id_, document, metadata in zip(stored["ids"], stored.get("documents") or [], stored.get("metadatas") or [])}
+
+    results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    for result in found:
+        result = [(id_, distance) for id_, distance in result if id_ in rows]
+        results["ids"].append([id_ for id_, _ in result])
+        results["documents"].append([rows[id_][0] for id_, _ in result])
+        results["metadatas"].append([rows[id_][1] for id_, _ in result])
+        results["distances"].append([distance for _, distance in result])
+    return results
+
+
+def query_chroma_by_vectors(query_vectors, top_k=5):
+    # Chroma는 여러 벡터를 한 번의 query로 검색할 수 있다.
+    quantized_index = get_quantized_index()
+    if quantized_index is not None:
+        results = query_quantized_index(quantized_index, query_vectors, top_k=top_k)
+    else:
+        results = get_vectorstore()._collection.query(
+            query_embeddings=query_vectors,
+            n_results=top_k,
+            include=["documents", "metadatas", "distances"],
+        )
+
+    # chunk ID 기준으로 중복을 제거하고, 여러 검색어에 걸린 chunk는 가장 높은 관련도를 남긴다.
+    scored_docs = {}
+    for ids, contents, metadatas, distances in zip(
+        results["ids"], results["documents"], results["metadatas"], results["distances"]
+    ):
+        for doc_id, page_content, metadata, distance in zip(ids, contents, metadatas, distances):
+            relevance = 1 / (1 + distance)
+            if doc_id not in scored_docs or relevance > scored_docs[doc_id][1]:
+                document = Document(page_content=page_content, metadata=metadata or {}, id=doc_id)
+                scored_docs[doc_id] = (document, relevance)
+
+    # 검색된 URL은 최근에 쓰인 것으로 기록한다. (오래 검색되지 않은 URL부터 지운다)
+    get_url_index().record_hits(document.metadata.get('source') for document, _ in scored_docs.values())
+
+    return list(scored_docs.values())
+
+
+def retrieve_many(queries, top_k=5, with_scores=False):
+    """
+    여러 query를 한 번의 임베딩 요청으로 임베딩하고, 한 번에 벡터 검색을 수행한다.
+
+    Args:
+        queries (list[str]): 검색어 목록
+        top_k (int): 검색어마다 가져올 문서 수
+        with_scores (bool): True이면 (Document, 관련도) 튜플을 반환
+
+    Returns:
+        list[Document]: chunk ID 기준으로 중복이 제거된 검색 결과
+    """
+    if not queries:
+        return []
+
+    reserve_embedding(queries)
+    with tracer.span("embedding.queries", kind="tool") as span:
+        query_vectors = hedger.call("embedding.queries", get_embedding().embed_documents, queries)
+        span.set(prompt_chars=sum(len(q) for q in queries), result_size=len(query_vectors))
+
+    with tracer.span("chroma.query", kind="tool", top_k=top_k) as span:
+        scored_docs = query_chroma_by_vectors(query_vectors, top_k=top_k)
+        span.set(result_size=len(scored_docs))
 
-    while '\n\n\n' in raw_content or '\t\t\t' in raw_content:
-        raw_content = raw_content.replace('\n\n\n', '\n\n')
-        raw_content = raw_content.replace('\t\t\t', '\t\t')
-        
-    return raw_content
+    # 여러 사이트에 실린 같은 기사처럼 거의 같은 결과는 하나로 합친다.
+    scored_docs = collapse_near_duplicates(scored_docs, threshold=near_dup_threshold)
+
+    return scored_docs if with_scores else [doc for doc, _ in scored_docs]
+
+
+async def aretrieve_many(queries, top_k=5, with_scores=False):
+    """
+    retrieve_many의 비동기 버전.
+    """
+    if not queries:
+        return []
+
+    await asyncio.to_thread(reserve_embedding, queries)
+    with tracer.span("embedding.queries", kind="tool") as span:
+        query_vectors = await hedger.acall("embedding.queries", get_embedding().aembed_documents, queries)
+        span.set(prompt_chars=sum(len(q) for q in queries), result_size=len(query_vectors))
+
+    with tracer.span("chroma.query", kind="tool", top_k=top_k) as span:
+        scored_docs = await asyncio.to_thread(query_chroma_by_vectors, query_vectors, top_k)
+        span.set(result_size=len(scored_docs))
+
+    scored_docs = await asyncio.to_thread(collapse_near_duplicates, scored_docs, near_dup_threshold)
+
+    return scored_docs if with_scores else [doc for doc, _ in scored_docs]
+
+
+def load_web_page(url: str):
+    # 커넥션 풀을 공유하는 fetcher로 크기와 시간을 제한해서 불러온다.
+    with tracer.span("fetch_page", kind="tool", url=url) as span:
+        text = fetcher.fetch_text(url)
+        span.set(result_size=len(text))
+        return text
 
 
 if __name__ == "__main__":
-    results, resources_json_path = web_search.invoke("HYBE 최근 논란")
+    import sys
+
+    # python tools.py --maintain : 오래된 웹 chunk를 지우고 저장소를 정리한다.
+    if "--maintain" in sys.argv:
+        print(maintain_chunk_store(force=True))
+        sys.exit()
+
+    results = web_search.invoke("HYBE 최근 논란")
     print(results)
 
     # # result = load_web_page("https://news.mt.co.kr/mtview.php?no=2024120402011362298")
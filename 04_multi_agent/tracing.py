@@ -0,0 +1,278 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+import threading
+import json
+import time
+import os
+
+# 현재 실행 중인 span (노드 -> 도구 호출처럼 부모-자식 관계를 만든다)
+current_span = ContextVar("current_span", default=None)
+
+# OpenTelemetry span kind (INTERNAL=1, CLIENT=3)
+otel_kinds = {"turn": 1, "node": 1, "llm": 3, "tool": 3}
+
+
+def new_id(n_bytes):
+    return os.urandom(n_bytes).hex()
+
+
+class Span:
+    def __init__(self, name, kind, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.set(**(attributes or {}))
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = "ok"
+        self._perf_start = time.perf_counter_ns()
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def add(self, key, value):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self, error=None):
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._perf_start)
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns else 0.0
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    턴(turn) -> 노드(node) -> LLM/도구(llm, tool) 호출의 span을 모은다.
+    span마다 걸린 시간과 토큰 수, 프롬프트 글자 수, 재시도 횟수, 결과 크기를 기록하고
+    JSON 또는 OpenTelemetry(OTLP/JSON) 형식으로 내보낸다.
+    """
+
+    def __init__(self, service_name="book-writer-agents"):
+        self.service_name = service_name
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.spans = []
+        self.active_traces = set() # 아직 pop_trace로 꺼내지 않은 턴의 trace ID
+
+    def start_span(self, name, kind, parent=None, **attributes):
+        # 부모 span은 컨텍스트(current_span)로만 전달한다. 다른 스레드에서는 ContextThreadPoolExecutor 등으로 컨텍스트를 복사한다.
+        parent = parent or current_span.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = new_id(16), None
+
+        span = Span(name, kind, trace_id, parent_id, attributes)
+        if kind == "turn":
+            with self.lock:
+                self.active_traces.add(trace_id)
+        return span
+
+    def finish_span(self, span, error=None):
+        span.end(error)
+        if not self.enabled:
+            return
+        with self.lock:
+            # 턴 밖에서 시작했거나 턴을 꺼낸 뒤에 끝난 span은 아무도 꺼내지 않으므로 모으지 않는다.
+            if span.trace_id in self.active_traces:
+                self.spans.append(span)
+
+    def observe_request(self, request):
+        # httpx 요청 hook (llm_cache의 http_client에 등록한다).
+        # openai SDK가 다시 보낸 요청(x-stainless-retry-count > 0)을 지금 실행 중인 span(노드, 도구)의 재시도로 센다.
+        if request.headers.get("x-stainless-retry-count", "0") == "0":
+            return
+        span = current_span.get()
+        if span is not None:
+            span.add("retries", 1)
+
+    async def aobserve_request(self, request):
+        self.observe_request(request)
+
+    @contextmanager
+    def span(self, name, kind="node", **attributes):
+        span = self.start_span(name, kind, **attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.finish_span(span, error=e)
+            raise
+        else:
+            self.finish_span(span)
+        finally:
+            current_span.reset(token)
+
+    def pop_trace(self, trace_id):
+        # 한 턴의 span을 꺼내고 메모리에서 지운다.
+        with self.lock:
+            spans = [s for s in self.spans if s.trace_id == trace_id]
+            self.spans = [s for s in self.spans if s.trace_id != trace_id]
+            self.active_traces.discard(trace_id)
+        return spans
+
+    def summary_table(self, spans):
+        """
+        span을 (종류, 이름)별로 묶은 요약 표 문자열을 만든다.
+        """
+        rows = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "prompt_tokens": 0,
+                                    "completion_tokens": 0, "prompt_chars": 0, "retries": 0, "result_size": 0, "errors": 0})
+        for span in spans:
+            if span.kind == "turn":
+                continue
+            row = rows[(span.kind, span.name)]
+            row["count"] += 1
+            row["total_ms"] += span.duration_ms
+            row["max_ms"] = max(row["max_ms"], span.duration_ms)
+            for key in ("prompt_tokens", "completion_tokens", "prompt_chars", "retries", "result_size"):
+                row[key] += span.attributes.get(key) or 0
+            row["errors"] += span.status == "error"
+
+        turn_ms = sum(span.duration_ms for span in spans if span.kind == "turn")
+
+        header = f"{'kind':<5} {'name':<32} {'count':>5} {'total(s)':>9} {'max(s)':>8} {'p_tok':>7} {'c_tok':>6} {'p_chars':>8} {'retry':>5} {'size':>7} {'err':>3}"
+        lines = [header, "-" * len(header)]
+        for (kind, name), row in sorted(rows.items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(
+                f"{kind:<5} {name[:32]:<32} {row['count']:>5} {row['total_ms'] / 1000:>9.2f} {row['max_ms'] / 1000:>8.2f} "
+                f"{row['prompt_tokens']:>7} {row['completion_tokens']:>6} {row['prompt_chars']:>8} "
+                f"{row['retries']:>5} {row['result_size']:>7} {row['errors']:>3}"
+            )
+        lines.append(f"turn 전체: {turn_ms / 1000:.2f}s")
+        return "\n".join(lines)
+
+    def export_json(self, spans, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([span.to_dict() for span in spans], f, ensure_ascii=False, indent=2)
+
+    def export_otlp(self, spans, path):
+        # OTLP/JSON 형식: OpenTelemetry Collector의 otlpjsonfile receiver 등으로 읽을 수 있다.
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        otel_spans = []
+        for span in spans:
+            item = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": otel_kinds.get(span.kind, 1),
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [attribute("span.kind", span.kind)] + [attribute(k, v) for k, v in span.attributes.items()],
+                "status": {"code": 2 if span.status == "error" else 1},
+            }
+            if span.parent_id:
+                item["parentSpanId"] = span.parent_id
+            otel_spans.append(item)
+
+        data = {
+            "resourceSpans": [{
+                "resource": {"attributes": [attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otel_spans}],
+            }]
+        }
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    def export(self, spans, path, format="json"):
+        if format == "otlp":
+            self.export_otlp(spans, path)
+        else:
+            self.export_json(spans, path)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LLM 호출마다 span을 만든다. 프롬프트 글자 수, 토큰 수, 재시도 횟수를 기록한다.
+    """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.lock = threading.Lock()
+        self.run_spans = {} # run_id -> span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name", "llm")
+        prompt_chars = sum(len(str(m.content)) for batch in messages for m in batch)
+
+        node = (metadata or {}).get("langgraph_node")
+        span = self.tracer.start_span(
+            f"{node}:{model}" if node else model, "llm",
+            model=model,
+            node=node,
+            prompt_chars=prompt_chars,
+            retries=0,
+        )
+        with self.lock:
+            self.run_spans[run_id] = span
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        # LangChain의 with_retry 재시도 (openai SDK 내부 재시도는 Tracer.observe_request가 센다)
+        with self.lock:
+            span = self.run_spans.get(run_id)
+        if span is not None:
+            span.add("retries", 1)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            span = self.run_spans.pop(run_id, None)
+        if span is None:
+            return
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    span.set(
+                        prompt_tokens=usage.get("input_tokens", 0),
+                        completion_tokens=usage.get("output_tokens", 0),
+                        cached_tokens=(usage.get("input_token_details") or {}).get("cache_read"),
+                    )
+                span.set(result_size=len(generation.text or ""))
+
+        self.tracer.finish_span(span)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            span = self.run_spans.pop(run_id, None)
+        if span is not None:
+            self.tracer.finish_span(span, error=error)
+
+
+# 모듈 전체에서 공유하는 tracer
+tracer = Tracer()
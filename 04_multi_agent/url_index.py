@@ -0,0 +1,185 @@
+from datetime import datetime, timedelta
+import hashlib
+import time
+import os
+
+from utils import sqlite_connection
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def now_text():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def chunk_id(url, index, text):
+    # 같은 URL, 같은 순서, 같은 내용이면 항상 같은 ID가 나온다. (재수집 시 upsert로 덮어쓰기)
+    return hashlib.sha256(f"{url}\n{index}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class UrlIndex:
+    """
+    Chroma에 저장된 URL과 본문 해시를 기록하는 SQLite 인덱스.
+    저장된 메타데이터 전체를 불러오지 않고, 후보 URL만 조회한다.
+
+    URL마다 수집한 시각(ingested_at)과 마지막으로 검색된 시각(last_hit_at)을 기록해서,
+    오래 쓰이지 않은 웹 chunk를 지울 때 사용한다. 마지막으로 저장소를 정리한 시각도 함께 기록한다. (meta 테이블)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT,
+                    chunk_count INTEGER,
+                    ingested_at TEXT,
+                    last_hit_at TEXT
+                )
+                """
+            )
+            # 예전 인덱스에는 last_hit_at이 없으므로 추가한다.
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(urls)")]
+            if "last_hit_at" not in columns:
+                conn.execute("ALTER TABLE urls ADD COLUMN last_hit_at TEXT")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def connect(self):
+        # 사용할 때마다 따로 연결하고, 블록이 끝나면 닫는다.
+        return sqlite_connection(self.db_path)
+
+    def is_empty(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT 1 FROM urls LIMIT 1").fetchone() is None
+
+    def lookup(self, urls):
+        """
+        주어진 URL 중 인덱스에 있는 URL의 {url: content_hash}를 반환한다.
+        """
+        urls = list(set(urls))
+        found = {}
+
+        with self.connect() as conn:
+            # SQLite 변수 개수 제한을 넘지 않도록 나눠서 조회한다.
+            for i in range(0, len(urls), 500):
+                batch = urls[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT url, content_hash FROM urls WHERE url IN ({placeholders})", batch
+                )
+                found.update(dict(rows))
+
+        return found
+
+    def record(self, entries):
+        """
+        entries: (url, content_hash, chunk_count)의 리스트
+        """
+        ingested_at = now_text()
+
+        with self.connect() as conn:
+            conn.executemany(
+                """
+                INSERT INTO urls (url, content_hash, chunk_count, ingested_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    content_hash=excluded.content_hash,
+                    chunk_count=excluded.chunk_count,
+                    ingested_at=excluded.ingested_at
+                """,
+                [(url, hash_, count, ingested_at) for url, hash_, count in entries],
+            )
+
+    def backfill(self, urls):
+        # 인덱스가 생기기 전에 저장된 URL을 기록한다. (본문 해시는 알 수 없으므로 NULL)
+        self.record([(url, None, None) for url in set(urls)])
+
+    def record_hits(self, urls):
+        # 검색 결과에 나온 URL의 마지막 검색 시각을 갱신한다.
+        urls = list(set(urls))
+        if not urls:
+            return
+        hit_at = now_text()
+        with self.connect() as conn:
+            conn.executemany("UPDATE urls SET last_hit_at = ? WHERE url = ?", [(hit_at, url) for url in urls])
+
+    def expired(self, ttl_days):
+        """
+        수집되거나 검색된 뒤 ttl_days가 지난 웹 URL (PDF 등 로컬 문서는 제외)
+        """
+        cutoff = (datetime.now() - timedelta(days=ttl_days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self.connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT url FROM urls
+                WHERE url LIKE 'http%' AND COALESCE(last_hit_at, ingested_at) < ?
+                """,
+                (cutoff,),
+            )
+            return [url for url, in rows]
+
+    def least_recently_used(self, chunks, exclude=()):
+        """
+        가장 오래 검색되지 않은 웹 URL부터, chunk 수의 합이 chunks 이상이 될 때까지 고른다.
+        """
+        exclude = set(exclude)
+        selected = []
+        freed = 0
+        with self.connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT url, COALESCE(chunk_count, 1) FROM urls
+                WHERE url LIKE 'http%'
+                ORDER BY COALESCE(last_hit_at, ingested_at), ingested_at
+                """
+            )
+            for url, chunk_count in rows:
+                if freed >= chunks:
+                    break
+                if url in exclude:
+                    continue
+                selected.append(url)
+                freed += chunk_count
+        return selected
+
+    def invalidate(self, urls):
+        # 다음에 수집할 때 본문이 바뀐 것으로 보고 다시 저장하도록 해시를 지운다. (NULL은 backfill 표시이므로 ''로 둔다)
+        with self.connect() as conn:
+            conn.executemany("UPDATE urls SET content_hash = '' WHERE url = ?", [(url,) for url in set(urls)])
+
+    def remove(self, urls):
+        with self.connect() as conn:
+            conn.executemany("DELETE FROM urls WHERE url = ?", [(url,) for url in set(urls)])
+
+    def last_maintained_at(self):
+        # 마지막으로 저장소를 정리한 시각 (time.time(), 정리한 적이 없으면 0)
+        with self.connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'last_maintenance'").fetchone()
+        return float(row[0]) if row else 0.0
+
+    def claim_maintenance(self, interval_seconds):
+        """
+        마지막 정리 후 interval_seconds가 지났으면 지금 시각을 기록하고 True를 반환한다.
+        CLI를 짧게 여러 번 실행해도 주기가 이어지고, 같은 저장소를 쓰는 프로세스 중 하나만 정리한다.
+        """
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM meta WHERE key = 'last_maintenance'").fetchone()
+            if row is not None and now - float(row[0]) < interval_seconds:
+                return False
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('last_maintenance', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (str(now),),
+            )
+        return True
+
+    def vacuum(self):
+        with self.connect() as conn:
+            conn.execute("VACUUM")
@@ -0,0 +1,67 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from collections import defaultdict
+import threading
+
+
+def usage_from_result(response):
+    # LLMResult에서 usage_metadata를 꺼낸다. (스트리밍은 stream_usage=True일 때만 들어온다)
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                return usage
+    return None
+
+
+class UsageTracker(BaseCallbackHandler):
+    """
+    노드별 LLM 토큰 사용량과 provider 프롬프트 캐시 적중(cached_tokens)을 모은다.
+    LLM 객체의 callbacks에 등록하면, LangGraph가 넘겨주는 metadata의 langgraph_node로 노드를 구분한다.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.run_nodes = {}  # run_id -> 노드 이름
+        self.stats = defaultdict(lambda: {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node", "unknown")
+        with self.lock:
+            self.run_nodes[run_id] = node
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            node = self.run_nodes.pop(run_id, "unknown")
+
+        usage = usage_from_result(response)
+        if usage is None:
+            return
+
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+
+        with self.lock:
+            stats = self.stats[node]
+            stats["calls"] += 1
+            stats["input_tokens"] += usage.get("input_tokens", 0)
+            stats["cached_tokens"] += cached
+            stats["output_tokens"] += usage.get("output_tokens", 0)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.run_nodes.pop(run_id, None)
+
+    def snapshot(self):
+        with self.lock:
+            return {node: dict(stats) for node, stats in self.stats.items()}
+
+    def report(self):
+        lines = ["노드별 토큰 사용량 (cached: 프롬프트 캐시 적중)"]
+        for node, stats in sorted(self.snapshot().items()):
+            hit_rate = stats["cached_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0
+            lines.append(
+                f"- {node}: 호출 {stats['calls']}회 | 입력 {stats['input_tokens']} "
+                f"(cached {stats['cached_tokens']}, {hit_rate:.0%}) | 출력 {stats['output_tokens']}"
+            )
+        return "\n".join(lines)
@@ -1,6 +1,16 @@
+from contextlib import contextmanager, closing
+import sqlite3
 import os
 import json
 
+
+def estimate_tokens(text):
+    # 토크나이저 없이 토큰 수를 어림한다. (영문은 약 4글자, 한글 등은 약 1.5글자당 1토큰)
+    text = str(text)
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return int(ascii_chars / 4 + (len(text) - ascii_chars) / 1.5) + 1
+
+
 def save_state(current_path, state):
     if not os.path.exists(f"{current_path}/data"):
         os.makedirs(f"{current_path}/data")
@@ -12,12 +22,15 @@ def save_state(current_path, state):
     state_dict["messages"] = messages
     state_dict["task_history"] = [task.to_dict() for task in state.get("task_history", [])]
 
-    # references
-    references = state.get("references", {"queries": [], "docs": []})
-    state_dict["references"] = {
-        "queries": references["queries"], 
-        "docs": [doc.metadata for doc in references["docs"]]
-    }
+    # 지난 대화 요약
+    history = state.get("history")
+    if history is not None:
+        state_dict["history"] = history.to_dict()
+
+    # references (본문은 빼고 ID와 metadata만 저장)
+    references = state.get("references")
+    if references is not None:
+        state_dict["references"] = references.to_dict(include_content=False)
         
     with open(f"{current_path}/data/state.json", "w", encoding='utf-8') as f:
         json.dump(state_dict, f, indent=4, ensure_ascii=False)
@@ -38,4 +51,18 @@ def save_outline(current_path, outline):
     
     with open(f"{current_path}/data/outline.md", "w", encoding='utf-8') as f:
         f.write(outline)
-    return outline
\ No newline at end of file
+    return outline
+
+
+@contextmanager
+def sqlite_connection(db_path):
+    """
+    블록이 끝나면 commit(예외가 나면 rollback)하고 연결을 닫는다.
+    sqlite3.Connection의 with 문은 commit만 하고 연결을 닫지 않으므로 파일 핸들이 쌓인다.
+
+    Args:
+        db_path: sqlite 파일 경로
+    """
+    with closing(sqlite3.connect(db_path, timeout=30)) as conn:
+        with conn:
+            yield conn
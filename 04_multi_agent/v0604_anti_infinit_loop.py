@@ -3,12 +3,33 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, AIMessage
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers.string import StrOutputParser
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 from typing_extensions import TypedDict
 from typing import List
 
-from utils import save_state, get_outline, save_outline
-from models import Task
-from tools import retrieve, web_search, add_web_pages_json_to_chroma
+
+from contextvars import ContextVar
+import argparse
+import asyncio
+import time
+
+from utils import save_state, get_outline
+from models import Task, OutlineRevisionPlan, ChapterReview
+from outline_store import OutlineStore, ChapterStreamSplitter, parse_outline, render_outline, chapter_title, strip_outline_markers
+from references import ReferenceStore
+from history import HistoryManager
+from checkpoint import CheckpointJournal
+from router import FastPathRouter, new_task
+from usage import UsageTracker
+from tracing import tracer, TracingCallbackHandler
+from scheduler import scheduler, RateLimitCallbackHandler
+from hedging import hedger
+from tiering import ModelTierStats, default_model, node_model, escalation_reason
+from speculation import Prefetcher, streamed_value
+from budget import TurnBudget, BudgetCallbackHandler, current_budget, default_deadline_seconds, default_max_tokens
+from llm_cache import response_cache, http_client, async_http_client, modes as llm_cache_modes, timings as llm_cache_timings
+from tools import retrieve, retrieve_many, aretrieve_many, web_search, web_search_many, aweb_search_many, add_web_pages_to_chroma, warm_up_retriever
 
 from datetime import datetime
 
@@ -17,7 +38,8 @@ import os
 
 # 환경 변수 설정
 load_dotenv()
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+if os.getenv("OPENAI_API_KEY"):
+    os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
 # 현재 폴더 경로 찾기
 # 랭그래프 이미지로 저장 및 추후 작업 결과 파일 저장 경로로 활용
@@ -25,52 +47,230 @@ filename = os.path.basename(__file__) # 현재 파일명 반환
 absolute_path = os.path.abspath(__file__) # 현재 파일의 절대 경로 반환
 current_path = os.path.dirname(absolute_path) # 현재 .py 파일이 있는 폴더 경로
 
-# 모델 초기화
-llm = ChatOpenAI(model="gpt-4o")
+# 노드별 토큰 사용량과 프롬프트 캐시 적중(cached_tokens)을 기록
+usage_tracker = UsageTracker()
+# LLM 호출마다 시간, 토큰, 프롬프트 크기를 span으로 기록
+# 모든 LLM 호출은 보내기 전에 공유 스케줄러에서 모델별 분당 요청/토큰 한도 안의 자리를 예약한다.
+# 노드별로 어떤 모델을 얼마나 오래 호출했는지 기록
+# 사용한 토큰은 이번 턴의 예산(TurnBudget)에도 기록
+model_tier_stats = ModelTierStats()
+llm_callbacks = [RateLimitCallbackHandler(scheduler), usage_tracker, TracingCallbackHandler(tracer), model_tier_stats, BudgetCallbackHandler()]
+
+# 모델 초기화 (스트리밍 호출도 usage를 받도록 stream_usage=True)
+# http_client는 응답 기록/재생 캐시를 거친다. (기본값 passthrough: 캐시를 사용하지 않음)
+llm = ChatOpenAI(model=default_model, stream_usage=True, callbacks=llm_callbacks,
+                 http_client=http_client, http_async_client=async_http_client)
+summary_llm = ChatOpenAI(model="gpt-4o-mini", callbacks=llm_callbacks, tags=["background"], # 지난 대화 요약용 (스케줄러에서 낮은 우선순위)
+                         http_client=http_client, http_async_client=async_http_client)
+
+# 노드별 모델 (tiering.node_models). 기본 모델이 아닌 모델은 처음 사용할 때 만든다.
+tier_llms = {}
+
+
+def node_llm(node, logprobs=False):
+    model = node_model(node)
+    if model == default_model:
+        return llm
+
+    key = (model, logprobs)
+    if key not in tier_llms:
+        tier_llms[key] = ChatOpenAI(model=model, stream_usage=True, callbacks=llm_callbacks, logprobs=logprobs or None,
+                                    http_client=http_client, http_async_client=async_http_client)
+    return tier_llms[key]
+
+# 세션별 작업 폴더 (data/outline.md, data/outline/ 등을 저장)
+# 기본값은 이 파일이 있는 폴더이고, 서버 모드에서는 config["configurable"]["workspace"]로 세션마다 다른 폴더를 쓴다.
+workspace = ContextVar("workspace", default=current_path)
+
+
+def workspace_path():
+    return workspace.get()
+
+
+def get_outline_store():
+    # 목차를 chapter 단위로 저장하고 버전을 남기는 저장소 (<workspace>/data/outline/)
+    return OutlineStore(workspace_path())
+
+# 수정할 chapter가 전체의 이 비율을 넘으면 목차 전체를 새로 작성한다.
+full_rewrite_ratio = 0.6
+
+# 목차가 스트리밍되는 동안 chapter가 완성될 때마다 바로 리뷰를 시작한다.
+# False이면 목차 작성이 끝난 뒤 outline_reviewer가 전체 목차를 한 번에 리뷰한다.
+pipelined_review = True
+review_executor = ContextThreadPoolExecutor(max_workers=8) # 노드 정보(metadata)가 스레드에도 전달되도록
+
+# 노드별 참고자료(references) 토큰 예산과 본문 전체를 보여줄 상위 문서 수
+# 나머지 문서는 제목, 출처, 짧은 발췌만 보여준다.
+reference_budgets = {
+    "business_analyst": {"max_tokens": 1000, "full_text_top_n": 0},
+    "content_strategist": {"max_tokens": 8000, "full_text_top_n": 6},
+    "outline_reviewer": {"max_tokens": 3000, "full_text_top_n": 2},
+    "web_search_agent": {"max_tokens": 600, "full_text_top_n": 0},
+    "vector_search_agent": {"max_tokens": 600, "full_text_top_n": 0},
+}
+
 
 # 상태 정의
 class State(TypedDict):
     messages: List[AnyMessage | str]
     task_history: List[Task]
-    references: dict # RAG Agent에서 검색한 정보를 저장하는 변수
+    references: ReferenceStore # RAG Agent에서 검색한 정보를 저장하는 변수
     user_request: str # 사용자의 요구사항을 저장하는 변수
     ai_recommandation: str # AI의 추천을 저장하는 변수
     supervisor_call_count: int # supervisor 호출 횟수를 저장하는 변수
+    history: HistoryManager # 지난 대화 요약을 관리하는 변수
+    chapter_reviews: list # 목차 작성 중에 미리 끝낸 chapter별 리뷰
+    budget: TurnBudget # 이번 턴의 마감 시간과 토큰 예산
+    turn_task_start: int # 이번 턴에 만든 첫 작업의 task_history 위치
 
 
-def business_analyst(state: State):
-    print("\n\n============ BUSINESS ANALYST ============")
+def reference_view(state: State, node_name: str):
+    # 노드의 토큰 예산에 맞춘 참고자료 요약
+    references = state.get("references")
+    if references is None:
+        return ReferenceStore().view()
+    return references.view(**reference_budgets[node_name])
 
-    # 시스템 프롬프트 정의
-    business_analyst_system_prompt = PromptTemplate.from_template(
-        """
-        너는 책을 쓰는 AI팀의 비즈니스 애널리스트로서, 
-        AI팀의 진행상황과 "사용자 요구사항"을 토대로,
-        현 시점에서 'ai_recommendation'과 최근 사용자의 발언을 바탕으로 요구사항이 무엇인지 판단한다.
-        지난 요청사항이 달성되었는지 판단하고, 현 시점에서 어떤 작업을 해야 하는지 결정한다.
 
-        다음과 같은 템플릿 형태로 반환한다. 
-        ```
-        - 목표: OOOO \n 방법: OOOO
-        ```
+# supervisor의 출력을 스트리밍으로 받으면서 agent 필드가 나오는 즉시 다음 노드의 입력(목차, 참고자료)을 미리 준비한다.
+speculative_routing = True
+prefetcher = Prefetcher()
+
+
+def prefetch_inputs(agent: str, state: State):
+    path = workspace_path()
+    prefetcher.start((path, agent, "outline"), get_outline, path)
+    if agent in reference_budgets:
+        prefetcher.start((path, agent, "references"), reference_view, state, agent)
+    if agent in ("vector_search_agent", "web_search_agent"):
+        prefetcher.executor.submit(warm_up_retriever)
+
+
+def prefetched_outline(agent: str):
+    # supervisor가 미리 읽어 둔 목차가 있으면 쓰고, 없으면 지금 읽는다.
+    path = workspace_path()
+    return prefetcher.take((path, agent, "outline"), get_outline, path)
+
+
+def prefetched_references(state: State, agent: str):
+    return prefetcher.take((workspace_path(), agent, "references"), reference_view, state, agent)
+
+
+def prefetched_inputs(state: State, agent: str):
+    # agent가 쓰는 목차와 참고자료 (참고자료 예산이 없는 agent는 목차만)
+    inputs = {"outline": prefetched_outline(agent)}
+    if agent in reference_budgets:
+        inputs["references"] = prefetched_references(state, agent)
+    return inputs
+
+
+async def aprefetched_inputs(state: State, agent: str):
+    # async 노드에서는 미리 준비한 값을 기다리는 동안 event loop를 막지 않고, 목차와 참고자료를 함께 기다린다.
+    path = workspace_path()
+    outline = prefetcher.atake((path, agent, "outline"), get_outline, path)
+    if agent not in reference_budgets:
+        return {"outline": await outline}
+    references = prefetcher.atake((path, agent, "references"), reference_view, state, agent)
+    outline, references = await asyncio.gather(outline, references)
+    return {"outline": outline, "references": references}
+
+
+history_summary_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 대화 기록을 정리하는 비서다.
+    기존 요약에 새 대화 내용을 반영하여 갱신된 요약을 작성하라.
+    사용자의 요구사항, 결정된 사항, 목차 변경 이력, 검색한 주제를 빠짐없이 남기고, 중복은 줄인다.
+    15줄 이내의 리스트로 작성한다.
+
+    --------------------------------
+    기존 요약: {digest}
+    --------------------------------
+    새 대화 내용:
+    {messages}
+    """
+)
+
+
+def summarize_history(digest, messages):
+    chain = history_summary_prompt | summary_llm | StrOutputParser()
+    return chain.invoke({"digest": digest or "없음", "messages": messages})
+
+
+async def asummarize_history(digest, messages):
+    chain = history_summary_prompt | summary_llm | StrOutputParser()
+    return await chain.ainvoke({"digest": digest or "없음", "messages": messages})
+
+
+def get_history(state: State):
+    history = state.get("history")
+    if history is None:
+        history = HistoryManager()
+        state["history"] = history
+    return history
+
+
+# 턴마다 새 예산을 만든다. (--turn-deadline, --turn-tokens 옵션으로 바꿀 수 있다)
+turn_deadline_seconds = default_deadline_seconds
+turn_max_tokens = default_max_tokens
+
+
+def new_turn_budget():
+    return TurnBudget(turn_deadline_seconds, turn_max_tokens)
+
+
+def start_turn(state: State, user_input: str):
+    # 사용자 입력으로 새 턴을 시작한다. (이번 턴의 예산과 작업 이력의 시작 위치를 정한다)
+    state["messages"].append(HumanMessage(user_input))
+    state["budget"] = new_turn_budget()
+    state["turn_task_start"] = len(state.get("task_history", []))
+
+
+def get_budget(state: State):
+    budget = state.get("budget")
+    if budget is None:
+        budget = new_turn_budget()
+        state["budget"] = budget
+    return budget
+
+
+def message_view(state: State, user_facing=False):
+    # 최근 턴은 그대로, 오래된 턴은 요약으로 보여주는 대화 내용
+    return get_history(state).view(state["messages"], user_facing=user_facing)
+
+
+# 시스템 프롬프트 정의
+# 동기/비동기 노드가 같은 프롬프트를 공유하도록 모듈 수준에서 정의한다.
+# provider의 프롬프트 prefix 캐시가 적중하도록 고정된 지시문과 양식을 앞에 두고,
+# 자주 바뀌는 내용일수록 뒤에 둔다. (목차 -> 참고자료 -> 요구사항/작업 -> 대화 내용 -> 현재 시각)
+business_analyst_system_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 비즈니스 애널리스트로서, 
+    AI팀의 진행상황과 "사용자 요구사항"을 토대로,
+    현 시점에서 'ai_recommendation'과 최근 사용자의 발언을 바탕으로 요구사항이 무엇인지 판단한다.
+    지난 요청사항이 달성되었는지 판단하고, 현 시점에서 어떤 작업을 해야 하는지 결정한다.
+
+    다음과 같은 템플릿 형태로 반환한다. 
+    ```
+    - 목표: OOOO \n 방법: OOOO
+    ```
+    방법에는 다음에 실행할 agent(content_strategist, communicator, web_search_agent, vector_search_agent)가 분명하면 그 이름을 적는다.
 
-        
-        ------------------------------------
-        *AI 추천(ai_recommendation)* : {ai_recommandation}
-        ------------------------------------
-        사용자 최근 발언: {user_last_comment}
-        ------------------------------------
-        참고자료: {references}
-        ------------------------------------
-        목차 (outline): {outline}
-        ------------------------------------
-        "messages": {messages}
-        """
-    )
     
-    # 시스템 프롬프트와 모델을 연결
-    system_chain = business_analyst_system_prompt | llm | StrOutputParser()
+    ------------------------------------
+    목차 (outline): {outline}
+    ------------------------------------
+    참고자료: {references}
+    ------------------------------------
+    *AI 추천(ai_recommendation)* : {ai_recommandation}
+    ------------------------------------
+    사용자 최근 발언: {user_last_comment}
+    ------------------------------------
+    "messages": {messages}
+    """
+)
 
+
+def make_business_analyst_inputs(state: State):
     # 상태에서 메시지를 가져옴
     messages = state["messages"]
 
@@ -81,24 +281,23 @@ def business_analyst(state: State):
             user_last_comment = m.content
             break
     
-    inputs = {
+    return {
         "ai_recommandation": state.get("ai_recommandation", None),
-        "references": state.get("references", {"queries": [], "docs": []}),
-        "outline": get_outline(current_path),
-        "messages": messages,
+        "references": reference_view(state, "business_analyst"),
+        "outline": get_outline(workspace_path()),
+        "messages": message_view(state),
         "user_last_comment": user_last_comment
     }
 
-    # 시스템 프롬프트를 통해 사용자 요구사항을 분석
-    user_request = system_chain.invoke(inputs)
+
+def finish_business_analyst(state: State, user_request: str):
+    messages = state["messages"]
 
     # businessage analyst의 결과를 메시지에 추가
     business_analyst_message = f"[Business Analyst] {user_request}"
     print(business_analyst_message)
     messages.append(AIMessage(business_analyst_message))
 
-    save_state(current_path, state) # 현재 state 내용 저장
-
     return {
         "messages": messages,
         "user_request": user_request, 
@@ -106,56 +305,97 @@ def business_analyst(state: State):
     }
 
 
-def supervisor(state: State):
-    print("\n\n============ SUPERVISOR ============")
+def business_analyst(state: State):
+    print("\n\n============ BUSINESS ANALYST ============")
 
-    # 시스템 프롬프트 정의
-    supervisor_system_prompt = PromptTemplate.from_template(
-        """
-        너는 AI 팀의 supervisor로서 AI 팀의 작업을 관리하고 지도한다.
-        사용자가 원하는 책을 써야 한다는 최종 목표를 염두에 두고, 
-        사용자의 요구를 달성하기 위해 현재 해야할 일이 무엇인지 결정한다.
-
-        supervisor가 활용할 수 있는 agent는 다음과 같다.     
-        - content_strategist: 사용자의 요구사항이 명확해졌을 때 사용한다. AI 팀의 콘텐츠 전략을 결정하고, 전체 책의 목차(outline)를 작성한다. 
-        - communicator: AI 팀에서 해야 할 일을 스스로 판단할 수 없을 때 사용한다. 사용자에게 진행상황을 사용자에게 보고하고, 다음 지시를 물어본다. 
-        - web_search_agent: vector_search_agent를 시도하고, 검색 결과(references)에 필요한 정보가 부족한 경우 사용한다. 웹 검색을 통해 해당 정보를 Vector DB에 보강한다. 
-        - vector_search_agent: 목차 작성을 위해 필요한 자료를 확보하기 위해 벡터 DB 검색을 한다. 
-
-        아래 내용을 고려하여, 현재 해야할 일이 무엇인지, 사용할 수 있는 agent가 무엇인지 단답으로 말하라. 
-
-        ------------------------------------------
-        previous_outline: {outline}
-        ------------------------------------------
-        messages:
-        {messages}
-        """
-    )
+    # 예산을 다 썼으면 분석을 건너뛴다. (supervisor가 communicator에게 보고를 맡긴다)
+    if get_budget(state).must_report():
+        return {}
 
-    supervisor_chain = supervisor_system_prompt | llm.with_structured_output(Task)
+    # 최근 구간에서 밀려난 대화가 쌓였으면 요약에 반영 (새로 밀려난 부분만 요약)
+    get_history(state).compact(state["messages"], summarize_history)
 
-    messages = state.get("messages", [])
+    # 시스템 프롬프트와 모델을 연결
+    system_chain = business_analyst_system_prompt | node_llm("business_analyst") | StrOutputParser()
 
-    inputs = {
-        "messages": messages,
-        "outline": get_outline(current_path)
+    # 시스템 프롬프트를 통해 사용자 요구사항을 분석 (느린 응답은 hedging)
+    user_request = hedger.invoke("business_analyst", system_chain, make_business_analyst_inputs(state))
+
+    return finish_business_analyst(state, user_request)
+
+
+async def abusiness_analyst(state: State):
+    print("\n\n============ BUSINESS ANALYST ============")
+
+    if get_budget(state).must_report():
+        return {}
+
+    await get_history(state).acompact(state["messages"], asummarize_history)
+
+    system_chain = business_analyst_system_prompt | node_llm("business_analyst") | StrOutputParser()
+    user_request = await hedger.ainvoke("business_analyst", system_chain, make_business_analyst_inputs(state))
+
+    return finish_business_analyst(state, user_request)
+
+
+supervisor_system_prompt = PromptTemplate.from_template(
+    """
+    너는 AI 팀의 supervisor로서 AI 팀의 작업을 관리하고 지도한다.
+    사용자가 원하는 책을 써야 한다는 최종 목표를 염두에 두고, 
+    사용자의 요구를 달성하기 위해 현재 해야할 일이 무엇인지 결정한다.
+
+    supervisor가 활용할 수 있는 agent는 다음과 같다.     
+    - content_strategist: 사용자의 요구사항이 명확해졌을 때 사용한다. AI 팀의 콘텐츠 전략을 결정하고, 전체 책의 목차(outline)를 작성한다. 
+    - communicator: AI 팀에서 해야 할 일을 스스로 판단할 수 없을 때 사용한다. 사용자에게 진행상황을 사용자에게 보고하고, 다음 지시를 물어본다. 
+    - web_search_agent: vector_search_agent를 시도하고, 검색 결과(references)에 필요한 정보가 부족한 경우 사용한다. 웹 검색을 통해 해당 정보를 Vector DB에 보강한다. 
+    - vector_search_agent: 목차 작성을 위해 필요한 자료를 확보하기 위해 벡터 DB 검색을 한다. 
+
+    이번 턴의 남은 예산(budget)이 적을수록 비용이 적은 agent를 고른다.
+    (비용: content_strategist > web_search_agent > vector_search_agent > communicator)
+
+    아래 내용을 고려하여, 현재 해야할 일이 무엇인지, 사용할 수 있는 agent가 무엇인지 단답으로 말하라. 
+
+    ------------------------------------------
+    previous_outline: {outline}
+    ------------------------------------------
+    messages:
+    {messages}
+    ------------------------------------------
+    budget: {budget}
+    """
+)
+
+
+def make_supervisor_inputs(state: State):
+    return {
+        "messages": message_view(state),
+        "outline": get_outline(workspace_path()),
+        "budget": get_budget(state).status()
     }
 
-    supervisor_call_count = state.get("supervisor_call_count", 0)
 
-    if supervisor_call_count > 3:
-        print("Supervisor 호출 횟수 초과: Communicator 호출")
-        task = Task(
-            agent="communicator", 
-            description="supervisor 호출 횟수 초과했으므로 현재까지의 진행상황을 사용자에게 보고한다.",
-            done=False,
-            done_at=""
-        )
-    else:
-        task = supervisor_chain.invoke(inputs)
+def apply_budget(state: State, task: Task):
+    # 남은 예산으로 감당할 수 없는 작업은 더 싼 작업으로 바꾼다. (예산을 다 쓰면 communicator가 지금까지의 결과를 보고)
+    budget = get_budget(state)
+    agent = budget.choose(task.agent)
+    if agent == task.agent:
+        return task
+
+    print(f"예산 부족 ({budget.status()}): {task.agent} 대신 {agent}")
+    return new_task(agent, f"이번 턴의 예산이 부족해 {task.agent} 대신 {agent}을(를) 실행한다. ({task.description})")
+
+
+# supervisor 앞단의 규칙 기반 라우터 (router.add_rule로 규칙을 추가할 수 있다)
+fast_path_router = FastPathRouter()
+
+
+def finish_supervisor(state: State, task: Task):
+    messages = state.get("messages", [])
+    supervisor_call_count = state.get("supervisor_call_count", 0)
 
     task_history = state.get("task_history", []) # 작업 이력 가져오기
-    task_history.append(task)                    # 작업 이력에 추가
+    if not task_history or task_history[-1] is not task:
+        task_history.append(task)                # 작업 이력에 추가 (이어서 하는 작업은 이미 있다)
     
     supervisor_message = AIMessage(f"[Supervisor] {task}")
     messages.append(supervisor_message)
@@ -167,6 +407,133 @@ def supervisor(state: State):
         "supervisor_call_count": supervisor_call_count + 1
     }
 
+
+def streamed_task_result(message):
+    # 스트리밍으로 모은 응답을 with_structured_output(include_raw=True)와 같은 형식으로 바꾼다.
+    parsed = message.additional_kwargs.get("parsed")
+    parsing_error = None
+    if parsed is None:
+        try:
+            parsed = Task.model_validate_json(message.content)
+        except ValueError as e:
+            parsing_error = e
+    return {"raw": message, "parsed": parsed, "parsing_error": parsing_error}
+
+
+def stream_task(state: State, inputs):
+    """
+    supervisor의 Task를 스트리밍으로 받고, agent 필드가 완성되는 즉시 그 agent의 입력을 미리 준비한다.
+
+    Returns:
+        dict: {"raw": AIMessageChunk, "parsed": Task, "parsing_error": Exception}
+    """
+    chain = supervisor_system_prompt | node_llm("supervisor", logprobs=True).bind(response_format=Task)
+    message, routed_at = None, None
+    for chunk in chain.stream(inputs):
+        message = chunk if message is None else message + chunk
+        if routed_at is None and (agent := streamed_value(message.content, "agent")):
+            routed_at = time.perf_counter()
+            prefetch_inputs(agent, state)
+
+    if routed_at is not None:
+        prefetcher.record_route(routed_at, time.perf_counter())
+    return streamed_task_result(message)
+
+
+async def astream_task(state: State, inputs):
+    chain = supervisor_system_prompt | node_llm("supervisor", logprobs=True).bind(response_format=Task)
+    message, routed_at = None, None
+    async for chunk in chain.astream(inputs):
+        message = chunk if message is None else message + chunk
+        if routed_at is None and (agent := streamed_value(message.content, "agent")):
+            routed_at = time.perf_counter()
+            prefetch_inputs(agent, state)
+
+    if routed_at is not None:
+        prefetcher.record_route(routed_at, time.perf_counter())
+    return streamed_task_result(message)
+
+
+def decide_task(state: State, inputs):
+    # 작은 모델로 먼저 결정하고, 파싱에 실패하거나 고른 agent의 확률이 낮으면 기본 모델로 다시 결정한다.
+    # speculative_routing이면 스트리밍으로 받는다. (스트리밍 호출은 hedging하지 않는다)
+    if node_model("supervisor") != default_model:
+        if speculative_routing:
+            result = stream_task(state, inputs)
+        else:
+            tier_chain = supervisor_system_prompt | node_llm("supervisor", logprobs=True).with_structured_output(Task, include_raw=True)
+            result = hedger.invoke("supervisor", tier_chain, inputs)
+        reason = escalation_reason(result)
+        if reason is None:
+            return result["parsed"]
+        model_tier_stats.escalate("supervisor", reason)
+
+    supervisor_chain = supervisor_system_prompt | llm.with_structured_output(Task)
+    return hedger.invoke("supervisor:escalated", supervisor_chain, inputs)
+
+
+async def adecide_task(state: State, inputs):
+    if node_model("supervisor") != default_model:
+        if speculative_routing:
+            result = await astream_task(state, inputs)
+        else:
+            tier_chain = supervisor_system_prompt | node_llm("supervisor", logprobs=True).with_structured_output(Task, include_raw=True)
+            result = await hedger.ainvoke("supervisor", tier_chain, inputs)
+        reason = escalation_reason(result)
+        if reason is None:
+            return result["parsed"]
+        model_tier_stats.escalate("supervisor", reason)
+
+    supervisor_chain = supervisor_system_prompt | llm.with_structured_output(Task)
+    return await hedger.ainvoke("supervisor:escalated", supervisor_chain, inputs)
+
+
+def plan_searches(node, prompt, tool, inputs):
+    # 검색 계획(tool call)을 노드의 모델로 세우고, 검색어를 하나도 만들지 못하면 기본 모델로 다시 세운다.
+    plans = hedger.invoke(f"{node}:plan", prompt | node_llm(node).bind_tools([tool]), inputs)
+    if plans.tool_calls or node_model(node) == default_model:
+        return plans
+
+    model_tier_stats.escalate(node, "no_tool_calls")
+    return hedger.invoke(f"{node}:plan:escalated", prompt | llm.bind_tools([tool]), inputs)
+
+
+async def aplan_searches(node, prompt, tool, inputs):
+    plans = await hedger.ainvoke(f"{node}:plan", prompt | node_llm(node).bind_tools([tool]), inputs)
+    if plans.tool_calls or node_model(node) == default_model:
+        return plans
+
+    model_tier_stats.escalate(node, "no_tool_calls")
+    return await hedger.ainvoke(f"{node}:plan:escalated", prompt | llm.bind_tools([tool]), inputs)
+
+
+def supervisor(state: State):
+    print("\n\n============ SUPERVISOR ============")
+
+    # 지난번에 미리 준비했지만 쓰이지 않은 입력은 버린다.
+    prefetcher.clear(workspace_path())
+
+    # 규칙으로 다음 작업이 분명하면 LLM을 호출하지 않는다.
+    task = fast_path_router.route(state)
+    if task is None:
+        task = decide_task(state, make_supervisor_inputs(state))
+
+    return finish_supervisor(state, apply_budget(state, task))
+
+
+async def asupervisor(state: State):
+    print("\n\n============ SUPERVISOR ============")
+
+    # 지난번에 미리 준비했지만 쓰이지 않은 입력은 버린다.
+    prefetcher.clear(workspace_path())
+
+    # 규칙으로 다음 작업이 분명하면 LLM을 호출하지 않는다.
+    task = fast_path_router.route(state)
+    if task is None:
+        task = await adecide_task(state, make_supervisor_inputs(state))
+
+    return finish_supervisor(state, apply_budget(state, task))
+
 # supervisor's route
 def supervisor_router(state: State):
     task = state['task_history'][-1]
@@ -174,102 +541,255 @@ def supervisor_router(state: State):
 
 
 # 목차를 작성하는 노드(agent)
-def content_strategist(state: State):
-    print("\n\n============ CONTENT STRATEGIST ============")
+content_strategist_system_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 콘텐츠 전략가(Content Strategist)로서,
+    이전 대화 내용을 바탕으로 사용자의 요구사항을 분석하고, AI팀이 쓸 책의 세부 목차를 결정한다.
+
+    기존 목차가 있다면 그 버전을 사용자의 요구에 맞게 수정하고, 없다면 새로운 목차를 제안한다.
+    목차를 작성하는데 필요한 정보는 "참고 자료"에 있으므로 활용한다. 
+
+    다음 정보를 활용하여 목차를 작성하라. 
+    - 사용자 요구사항(user_request)
+    - 작업(task)
+    - 검색 자료 (references)
+    - 기존 목차 (previous_outline)
+    - 이전 대화 내용(messages)
+
+    너의 작업 목표는 다음과 같다:
+    1. 만약 "기존 목차 구조 (previous_outline)"이 존재한다면, 사용자의 요구사항을 토대로 "기존 목차 구조"에서 어떤 부분을 수정하거나 추가할지 결정한다.
+    - "이번 목차 작성의 주안점"에 사용자 요구사항(user_request)을 충족시키는 것을 명시해야 한다.
+    2. 책의 전반적인 구조(chapter, section)를 설계하고, 각 chpater와 section의 제목을 정한다.
+    3. 책의 전반적인 세부구조(chapter, section, sub-section)를 설계하고, sub-section 하부의 주요 내용을 리스트 형태로 정리한다.
+    4. 목차의 논리적인 흐름이 사용자 요구를 충족시키는지 확인한다.
+    5. 참고자료 (references)를 적극 활용하여 근거에 기반한 목차를 작성한다.
+    6. 참고문헌은 반드시 참고자료(references) 자료를 근거로 작성해야 하며, 최대한 풍부하게 준비한다. URL은 전체 주소를 적어야 한다.
+    7. 추가 자료나 리서치가 필요한 부분을 파악하여 supervisor에게 요청한다.
+
+    사용자 요구사항(user_request)을 최우선으로 반영하는 목차로 만들어야 한다. 
+    사용자가 추가 피드백을 제공할 수 있도록 논리적인 흐름과 주요 목차 아이디어를 제안하라.
+
+    작성 형식 아래 양식을 지키되 하부 항목으로 더 세분화해도 좋다. 목차(outline) 양식의 챕터, 섹션 등 항목의 갯수는 필요한만큼 추가하라. 
+    섹션 갯수는 최소 2개 이상이어야 하며, 더 많으면 좋다. 
+
+    outline_template은 예시로 앞부분만 제시한 것이다. 각 장은 ':---CHAPTER DIVIDER---:'로 구분한다.
+    outline_template:
+    {outline_template}
+
+    --------------------------------
+    - 기존 목차 (previous_outline)
+    {outline}
+    --------------------------------
+    - 참고 자료 (references)
+    {references}
+    --------------------------------
+    - 사용자 요구사항(user_request): 
+    {user_request}
+    --------------------------------
+    - 작업(task): 
+    {task}
+    --------------------------------
+    - 이전 대화 내용(messages)
+    {messages}
+    """
+)
 
-    task_history = state.get("task_history", []) # 작업 이력 가져오기
-    task = task_history[-1]
+
+def check_content_strategist_task(state: State):
+    task = state.get("task_history", [])[-1]
     if task.agent != "content_strategist":
         raise ValueError(f"Content Strategist가 아닌 agent가 목차 작성을 시도하고 있습니다.\n {task}")
+    return task
 
-    # 시스템 프롬프트 정의
-    content_strategist_system_prompt = PromptTemplate.from_template(
-        """
-        너는 책을 쓰는 AI팀의 콘텐츠 전략가(Content Strategist)로서,
-        이전 대화 내용을 바탕으로 사용자의 요구사항을 분석하고, AI팀이 쓸 책의 세부 목차를 결정한다.
-
-        기존 목차가 있다면 그 버전을 사용자의 요구에 맞게 수정하고, 없다면 새로운 목차를 제안한다.
-        목차를 작성하는데 필요한 정보는 "참고 자료"에 있으므로 활용한다. 
-
-        다음 정보를 활용하여 목차를 작성하라. 
-        - 사용자 요구사항(user_request)
-        - 작업(task)
-        - 검색 자료 (references)
-        - 기존 목차 (previous_outline)
-        - 이전 대화 내용(messages)
-
-        너의 작업 목표는 다음과 같다:
-        1. 만약 "기존 목차 구조 (previous_outline)"이 존재한다면, 사용자의 요구사항을 토대로 "기존 목차 구조"에서 어떤 부분을 수정하거나 추가할지 결정한다.
-        - "이번 목차 작성의 주안점"에 사용자 요구사항(user_request)을 충족시키는 것을 명시해야 한다.
-        2. 책의 전반적인 구조(chapter, section)를 설계하고, 각 chpater와 section의 제목을 정한다.
-        3. 책의 전반적인 세부구조(chapter, section, sub-section)를 설계하고, sub-section 하부의 주요 내용을 리스트 형태로 정리한다.
-        4. 목차의 논리적인 흐름이 사용자 요구를 충족시키는지 확인한다.
-        5. 참고자료 (references)를 적극 활용하여 근거에 기반한 목차를 작성한다.
-        6. 참고문헌은 반드시 참고자료(references) 자료를 근거로 작성해야 하며, 최대한 풍부하게 준비한다. URL은 전체 주소를 적어야 한다.
-        7. 추가 자료나 리서치가 필요한 부분을 파악하여 supervisor에게 요청한다.
-
-        사용자 요구사항(user_request)을 최우선으로 반영하는 목차로 만들어야 한다. 
-
-        --------------------------------
-        - 사용자 요구사항(user_request): 
-        {user_request}
-        --------------------------------
-        - 작업(task): 
-        {task}
-        --------------------------------
-        - 참고 자료 (references)
-        {references}
-        --------------------------------
-        - 기존 목차 (previous_outline)
-        {outline}
-        --------------------------------
-        - 이전 대화 내용(messages)
-        {messages}
-        --------------------------------
-
-
-        작성 형식 아래 양식을 지키되 하부 항목으로 더 세분화해도 좋다. 목차(outline) 양식의 챕터, 섹션 등 항목의 갯수는 필요한만큼 추가하라. 
-        섹션 갯수는 최소 2개 이상이어야 하며, 더 많으면 좋다. 
-
-        outline_template은 예시로 앞부분만 제시한 것이다. 각 장은 ':---CHAPTER DIVIDER---:'로 구분한다.
-        outline_template:
-        {outline_template}
-
-        사용자가 추가 피드백을 제공할 수 있도록 논리적인 흐름과 주요 목차 아이디어를 제안하라.
-        
-        """
-    )
-    
-
-    # 시스템 프롬프트와 모델을 연결
-    contnet_strategist_chain = content_strategist_system_prompt | llm | StrOutputParser()
-
-    user_request = state.get("user_request", "") # 사용자 요구사항 가져오기
-    messages = state["messages"]        # 상태에서 메시지를 가져옴
-    outline = get_outline(current_path) # 저장된 목차를 가져옴
 
+def read_outline_template():
     with open(f"{current_path}/templates/outline_template.md", "r", encoding='utf-8') as f:
-        outline_template = f.read()  
+        return f.read()
 
+
+def make_content_strategist_inputs(state: State, task: Task, prefetched: dict):
     # 입력값 정의
-    inputs = {
-        "user_request": user_request,
+    return {
+        "user_request": state.get("user_request", ""), # 사용자 요구사항 가져오기
         "task": task,
-        "messages": messages,
-        "outline": outline,
-        "references": state.get("references", {"queries": [], "docs": []}),
-        "outline_template": outline_template
+        "messages": message_view(state),               # 최근 대화와 지난 대화 요약
+        "outline": prefetched["outline"],              # 저장된 목차를 가져옴
+        "references": prefetched["references"],
+        "outline_template": read_outline_template()
     }
 
-    # 목차 작성
-    gathered = ''
-    for chunk in contnet_strategist_chain.stream(inputs):
-        gathered += chunk
-        print(chunk, end='')
 
-    print()
+outline_revision_plan_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 콘텐츠 전략가(Content Strategist)로서,
+    기존 목차를 사용자 요구사항과 리뷰 의견에 맞게 고치기 위해 어느 chapter를 수정해야 하는지 결정한다.
+
+    - 목차 구조 전체를 바꿔야 하는 경우에만 full_rewrite를 True로 한다.
+    - 사용자 요구사항이나 리뷰가 특정 chapter만 언급한다면 그 chapter만 수정한다.
+    - 새로운 주제가 필요하면 chapters_to_add에 chapter 제목을 적는다.
+    - chapter가 추가되거나 책의 방향이 바뀌면 revise_preamble을 True로 한다.
+
+    --------------------------------
+    - 기존 목차의 chapter 목록
+    {chapter_list}
+    --------------------------------
+    - 사용자 요구사항(user_request): 
+    {user_request}
+    --------------------------------
+    - 작업(task): 
+    {task}
+    --------------------------------
+    - 이전 대화 내용(messages)
+    {messages}
+    """
+)
+
+chapter_writer_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 콘텐츠 전략가(Content Strategist)로서, 책 목차 중 한 chapter의 세부 목차를 작성한다.
+    다른 chapter는 다른 작가가 동시에 작성하므로, 이 chapter의 내용만 작성한다.
+
+    - 사용자 요구사항(user_request)을 최우선으로 반영한다.
+    - chapter, section, sub-section을 설계하고, 주요 내용을 리스트로 정리한다. 섹션은 최소 2개 이상이어야 한다.
+    - 참고문헌은 반드시 참고자료(references)를 근거로 작성하고, URL은 전체 주소를 적는다.
+    - 결과에는 ':---CHAPTER DIVIDER---:' 같은 구분자나 다른 설명을 붙이지 말고, chapter 내용만 출력한다.
+
+    chapter 작성 양식:
+    {chapter_template}
+
+    --------------------------------
+    - 책의 기획 (preamble)
+    {preamble}
+    --------------------------------
+    - 참고 자료 (references)
+    {references}
+    --------------------------------
+    - 사용자 요구사항(user_request): 
+    {user_request}
+    --------------------------------
+    - 수정 주안점: 
+    {reason}
+    --------------------------------
+    - 전체 chapter 목록
+    {chapter_list}
+    --------------------------------
+    - 작성할 chapter: Chapter {chapter_number}
+    - 이 chapter의 기존 내용 (없으면 새로 작성)
+    {chapter_text}
+    """
+)
+
+preamble_writer_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 콘텐츠 전략가(Content Strategist)로서, 목차의 앞부분(기획 의도, 이번 목차의 목표, 책 제목, chapter 소개)을 고쳐 쓴다.
+    아래 양식의 앞부분 형식을 따르고, chapter 소개는 주어진 chapter 목록과 일치해야 한다.
+    결과에는 앞부분만 출력한다.
+
+    양식:
+    {preamble_template}
+
+    --------------------------------
+    - 기존 앞부분
+    {preamble}
+    --------------------------------
+    - 사용자 요구사항(user_request): 
+    {user_request}
+    --------------------------------
+    - 수정 주안점: 
+    {reason}
+    --------------------------------
+    - 새 chapter 목록
+    {chapter_list}
+    """
+)
+
+
+def format_chapter_list(chapter_texts):
+    return "\n".join(f"{i + 1}. {chapter_title(text)}" for i, text in enumerate(chapter_texts))
+
 
-    save_outline(current_path, gathered) # 목차 저장
+def make_outline_revision_plan_inputs(state: State, task: Task, previous: dict):
+    return {
+        "user_request": state.get("user_request", ""),
+        "task": task,
+        "chapter_list": format_chapter_list([c["text"] for c in previous["chapters"]]),
+        "messages": message_view(state),
+    }
+
+
+def needs_full_rewrite(plan: OutlineRevisionPlan, previous: dict):
+    chapter_count = len(previous["chapters"])
+    revise_count = len({i for i in plan.chapters_to_revise if 1 <= i <= chapter_count})
+    return plan.full_rewrite or revise_count > chapter_count * full_rewrite_ratio
+
+
+def make_chapter_writer_inputs(state: State, previous: dict, plan: OutlineRevisionPlan):
+    """
+    수정하거나 새로 추가할 chapter마다 작성 입력값을 만든다.
+
+    Returns:
+        tuple: (새 chapter 목록, 작성할 chapter index 목록, 입력값 목록)
+    """
+    template = parse_outline(read_outline_template())
+    chapter_template = template["chapters"][0] if template["chapters"] else ""
+
+    chapter_texts = [c["text"] for c in previous["chapters"]]
+    targets = sorted({i - 1 for i in plan.chapters_to_revise if 1 <= i <= len(chapter_texts)})
+
+    for title in plan.chapters_to_add:
+        chapter_texts.append(f"## Chapter {len(chapter_texts) + 1}: {title}")
+        targets.append(len(chapter_texts) - 1)
+
+    chapter_list = format_chapter_list(chapter_texts)
+    references = reference_view(state, "content_strategist")
+
+    inputs = [
+        {
+            "user_request": state.get("user_request", ""),
+            "reason": plan.reason,
+            "preamble": previous["preamble"],
+            "chapter_list": chapter_list,
+            "references": references,
+            "chapter_number": i + 1,
+            "chapter_text": chapter_texts[i],
+            "chapter_template": chapter_template,
+        }
+        for i in targets
+    ]
+
+    return chapter_texts, targets, inputs
+
+
+def make_preamble_writer_inputs(state: State, previous: dict, plan: OutlineRevisionPlan, chapter_texts: list):
+    return {
+        "user_request": state.get("user_request", ""),
+        "reason": plan.reason,
+        "preamble": previous["preamble"],
+        "chapter_list": format_chapter_list(chapter_texts),
+        "preamble_template": parse_outline(read_outline_template())["preamble"],
+    }
+
+
+def replace_chapters(chapter_texts: list, targets: list, drafts: list):
+    # 다시 작성한 chapter만 바꿔 끼우고, 나머지 chapter는 그대로 둔다.
+    for i, draft in zip(targets, drafts):
+        chapter_texts[i] = strip_outline_markers(draft)
+        print(f"\n---- Chapter {i + 1} 작성 완료: {chapter_title(chapter_texts[i])}")
+
+
+def render_revised_outline(previous: dict, plan: OutlineRevisionPlan, chapter_texts: list, targets: list, preamble=None):
+    return render_outline({
+        "preamble": preamble if preamble is not None else previous["preamble"],
+        "chapters": chapter_texts,
+        "review": f"+ 목차 작성 후기\n- 수정한 chapter: {[i + 1 for i in targets]}\n- {plan.reason}",
+    })
+
+
+def finish_content_strategist(state: State, gathered: str):
+    task_history = state.get("task_history", [])
+    messages = state["messages"]
+
+    get_outline_store().save_text(gathered) # 목차를 chapter 단위로 버전을 남겨 저장
        
     # 작업 완료 처리
     task_history[-1].done = True
@@ -291,56 +811,316 @@ def content_strategist(state: State):
         "task_history": task_history
     }
 
-def outline_reviewer(state: State):
-    print("\n\n============ OUTLINE REVIEWER ============")
 
-    # 시스템 프롬프트 정의
-    outline_reviewer_system_prompt = PromptTemplate.from_template(
-        """
-        너는 AI팀의 목차 리뷰어로서, AI팀이 작성한 목차(outline)를 검토하고 문제점을 지적한다. 
-
-        - outline이 사용자의 요구사항을 충족시키는지 여부
-        - outline의 논리적인 흐름이 적절한지 여부
-        - 근거에 기반하지 않은 내용이 있는지 여부
-        - 주어진 참고자료(references)를 충분히 활용했는지 여부
-        - 참고자료가 충분한지, 혹은 잘못된 참고자료가 있는지 여부
-        - example.com 같은 더미 URL이 있는지 여부: 
-        - 실제 페이지 URL이 아닌 대표 URL로 되어 있는 경우 삭제 해야함: 어떤 URL이 삭제되어야 하는지 명시하라.
-        - 기타 리뷰 사항
-
-        그 분석 결과를 설명하고, 다음 어떤 작업을 하면 좋을지 제안하라.
-        
-        - 분석결과: outline이 사용자의 요구사항을 충족시키는지 여부
-        - 제안사항: (vector_search_agent, communicator 중 어떤 agent를 호출할지)
-
-        ------------------------------------------
-        user_request: {user_request}
-        ------------------------------------------
-        references: {references}
-        ------------------------------------------
-        outline: {outline}
-        ------------------------------------------
-        messages: {messages}
-        """
-    )
-        
-    user_request = state.get("user_request", None)
-    outline = get_outline(current_path)
-    references = state.get("references", {"queries": [], "docs": []})
+def revise_outline(state: State, task: Task, previous: dict):
+    """
+    영향을 받는 chapter만 다시 작성한다.
+
+    Returns:
+        tuple: (새 목차 문자열, chapter별 리뷰). 목차 전체를 다시 써야 하면 (None, [])
+    """
+    plan_chain = outline_revision_plan_prompt | llm.with_structured_output(OutlineRevisionPlan)
+    plan = plan_chain.invoke(make_outline_revision_plan_inputs(state, task, previous))
+    print(f"목차 수정 계획: {plan}")
+
+    if needs_full_rewrite(plan, previous):
+        return None, []
+
+    chapter_texts, targets, inputs = make_chapter_writer_inputs(state, previous, plan)
+
+    chapter_chain = chapter_writer_prompt | llm | StrOutputParser()
+    review_references = reference_view(state, "outline_reviewer")
+
+    # 서로 독립적인 chapter는 동시에 작성하고, 작성이 끝난 chapter는 바로 리뷰한다.
+    def draft_and_review(chapter_inputs):
+        draft = strip_outline_markers(chapter_chain.invoke(chapter_inputs))
+        review = None
+        if pipelined_review:
+            review = review_chapter(make_chapter_review_inputs(state, review_references, chapter_inputs["chapter_number"], draft))
+        return draft, review
+
+    results = list(review_executor.map(draft_and_review, inputs))
+    replace_chapters(chapter_texts, targets, [draft for draft, _ in results])
+    chapter_reviews = [review for _, review in results if review is not None]
+
+    # 앞부분은 새 chapter 목록이 정해진 뒤에 고친다.
+    preamble = None
+    if plan.revise_preamble or plan.chapters_to_add:
+        preamble_chain = preamble_writer_prompt | llm | StrOutputParser()
+        preamble = strip_outline_markers(preamble_chain.invoke(make_preamble_writer_inputs(state, previous, plan, chapter_texts)))
+
+    return render_revised_outline(previous, plan, chapter_texts, targets, preamble), chapter_reviews
+
+
+async def arevise_outline(state: State, task: Task, previous: dict):
+    plan_chain = outline_revision_plan_prompt | llm.with_structured_output(OutlineRevisionPlan)
+    plan = await plan_chain.ainvoke(make_outline_revision_plan_inputs(state, task, previous))
+    print(f"목차 수정 계획: {plan}")
+
+    if needs_full_rewrite(plan, previous):
+        return None, []
+
+    chapter_texts, targets, inputs = make_chapter_writer_inputs(state, previous, plan)
+
+    chapter_chain = chapter_writer_prompt | llm | StrOutputParser()
+    review_references = reference_view(state, "outline_reviewer")
+
+    async def draft_and_review(chapter_inputs):
+        draft = strip_outline_markers(await chapter_chain.ainvoke(chapter_inputs))
+        review = None
+        if pipelined_review:
+            review = await areview_chapter(make_chapter_review_inputs(state, review_references, chapter_inputs["chapter_number"], draft))
+        return draft, review
+
+    results = await asyncio.gather(*[draft_and_review(chapter_inputs) for chapter_inputs in inputs])
+    replace_chapters(chapter_texts, targets, [draft for draft, _ in results])
+    chapter_reviews = [review for _, review in results if review is not None]
+
+    preamble = None
+    if plan.revise_preamble or plan.chapters_to_add:
+        preamble_chain = preamble_writer_prompt | llm | StrOutputParser()
+        preamble = strip_outline_markers(await preamble_chain.ainvoke(make_preamble_writer_inputs(state, previous, plan, chapter_texts)))
+
+    return render_revised_outline(previous, plan, chapter_texts, targets, preamble), chapter_reviews
+
+
+def content_strategist(state: State):
+    print("\n\n============ CONTENT STRATEGIST ============")
+
+    task = check_content_strategist_task(state)
+
+    # 기존 목차가 있으면 필요한 chapter만 다시 작성
+    previous = get_outline_store().load()
+    if previous and previous["chapters"]:
+        revised, chapter_reviews = revise_outline(state, task, previous)
+        if revised is not None:
+            return {**finish_content_strategist(state, revised), "chapter_reviews": chapter_reviews}
+
+    # 시스템 프롬프트와 모델을 연결
+    contnet_strategist_chain = content_strategist_system_prompt | llm | StrOutputParser()
+
+    inputs = make_content_strategist_inputs(state, task, prefetched_inputs(state, "content_strategist"))
+
+    # chapter 구분자가 나올 때마다 완성된 chapter의 리뷰를 백그라운드에서 시작
+    splitter = ChapterStreamSplitter()
+    review_references = reference_view(state, "outline_reviewer")
+    review_futures = []
+
+    def submit_reviews(chapter_texts):
+        for chapter_text in chapter_texts:
+            review_inputs = make_chapter_review_inputs(state, review_references, len(review_futures) + 1, chapter_text)
+            review_futures.append(review_executor.submit(review_chapter, review_inputs))
+
+    # 목차 작성
+    gathered = ''
+    for chunk in contnet_strategist_chain.stream(inputs):
+        gathered += chunk
+        print(chunk, end='')
+
+        if pipelined_review:
+            submit_reviews(splitter.feed(chunk))
+
+    print()
+
+    if pipelined_review:
+        submit_reviews(splitter.finish())
+
+    chapter_reviews = [future.result() for future in review_futures]
+
+    return {**finish_content_strategist(state, gathered), "chapter_reviews": chapter_reviews}
+
+
+async def acontent_strategist(state: State):
+    print("\n\n============ CONTENT STRATEGIST ============")
+
+    task = check_content_strategist_task(state)
+
+    previous = await asyncio.to_thread(get_outline_store().load)
+    if previous and previous["chapters"]:
+        revised, chapter_reviews = await arevise_outline(state, task, previous)
+        if revised is not None:
+            result = await asyncio.to_thread(finish_content_strategist, state, revised)
+            return {**result, "chapter_reviews": chapter_reviews}
+
+    contnet_strategist_chain = content_strategist_system_prompt | llm | StrOutputParser()
+
+    inputs = make_content_strategist_inputs(state, task, await aprefetched_inputs(state, "content_strategist"))
+
+    splitter = ChapterStreamSplitter()
+    review_references = reference_view(state, "outline_reviewer")
+    review_tasks = []
+
+    def start_reviews(chapter_texts):
+        for chapter_text in chapter_texts:
+            review_inputs = make_chapter_review_inputs(state, review_references, len(review_tasks) + 1, chapter_text)
+            review_tasks.append(asyncio.create_task(areview_chapter(review_inputs)))
+
+    gathered = ''
+    async for chunk in contnet_strategist_chain.astream(inputs):
+        gathered += chunk
+        print(chunk, end='')
+
+        if pipelined_review:
+            start_reviews(splitter.feed(chunk))
+
+    print()
+
+    if pipelined_review:
+        start_reviews(splitter.finish())
+
+    chapter_reviews = list(await asyncio.gather(*review_tasks))
+
+    result = await asyncio.to_thread(finish_content_strategist, state, gathered)
+    return {**result, "chapter_reviews": chapter_reviews}
+
+
+outline_reviewer_system_prompt = PromptTemplate.from_template(
+    """
+    너는 AI팀의 목차 리뷰어로서, AI팀이 작성한 목차(outline)를 검토하고 문제점을 지적한다. 
+
+    - outline이 사용자의 요구사항을 충족시키는지 여부
+    - outline의 논리적인 흐름이 적절한지 여부
+    - 근거에 기반하지 않은 내용이 있는지 여부
+    - 주어진 참고자료(references)를 충분히 활용했는지 여부
+    - 참고자료가 충분한지, 혹은 잘못된 참고자료가 있는지 여부
+    - example.com 같은 더미 URL이 있는지 여부: 
+    - 실제 페이지 URL이 아닌 대표 URL로 되어 있는 경우 삭제 해야함: 어떤 URL이 삭제되어야 하는지 명시하라.
+    - 기타 리뷰 사항
+
+    그 분석 결과를 설명하고, 다음 어떤 작업을 하면 좋을지 제안하라.
+    
+    - 분석결과: outline이 사용자의 요구사항을 충족시키는지 여부
+    - 제안사항: (vector_search_agent, communicator 중 어떤 agent를 호출할지)
+
+    ------------------------------------------
+    outline: {outline}
+    ------------------------------------------
+    references: {references}
+    ------------------------------------------
+    user_request: {user_request}
+    ------------------------------------------
+    messages: {messages}
+    """
+)
+
+
+def make_outline_reviewer_inputs(state: State):
+    return {
+        "user_request": state.get("user_request", None),
+        "outline": get_outline(workspace_path()),
+        "references": reference_view(state, "outline_reviewer"),
+        "messages": message_view(state)
+    }
+
+
+def finish_outline_reviewer(state: State, gathered):
     messages = state.get("messages", [])
 
-    inputs = {
-        "user_request": user_request,
-        "outline": outline,
+    if '[OUTLINE REVIEW AGENT]' not in gathered.content:
+        gathered.content = f"[OUTLINE REVIEW AGENT] {gathered.content}"
+
+    print(gathered)
+    messages.append(gathered)
+
+    ai_recommandation = gathered.content
+
+    return {"messages": messages, "ai_recommandation": ai_recommandation}
+
+
+chapter_review_prompt = PromptTemplate.from_template(
+    """
+    너는 AI팀의 목차 리뷰어로서, AI팀이 작성 중인 목차(outline) 중 한 chapter를 검토하고 문제점을 지적한다.
+    다른 chapter는 다른 리뷰어가 동시에 검토한다.
+
+    - chapter가 사용자의 요구사항을 충족시키는지 여부
+    - chapter의 논리적인 흐름이 적절한지 여부
+    - 근거에 기반하지 않은 내용이 있는지 여부
+    - 주어진 참고자료(references)를 충분히 활용했는지, 자료 검색이 더 필요한지 여부
+    - example.com 같은 더미 URL이나 실제 페이지 URL이 아닌 대표 URL이 있는지 여부
+
+    ------------------------------------------
+    references: {references}
+    ------------------------------------------
+    user_request: {user_request}
+    ------------------------------------------
+    Chapter {chapter_number}:
+    {chapter_text}
+    """
+)
+
+
+def make_chapter_review_inputs(state: State, references: str, chapter_number: int, chapter_text: str):
+    return {
+        "user_request": state.get("user_request", None),
         "references": references,
-        "messages": messages
+        "chapter_number": chapter_number,
+        "chapter_text": chapter_text,
     }
 
+
+def review_chapter(inputs):
+    chain = chapter_review_prompt | llm.with_structured_output(ChapterReview)
+    review = chain.invoke(inputs)
+    return {"chapter": inputs["chapter_number"], **review.model_dump()}
+
+
+async def areview_chapter(inputs):
+    chain = chapter_review_prompt | llm.with_structured_output(ChapterReview)
+    review = await chain.ainvoke(inputs)
+    return {"chapter": inputs["chapter_number"], **review.model_dump()}
+
+
+def merge_chapter_reviews(chapter_reviews: list):
+    # chapter별 리뷰를 outline_reviewer의 ai_recommandation 형식으로 합친다.
+    lines = ["[OUTLINE REVIEW AGENT] chapter별 리뷰 결과"]
+
+    for review in sorted(chapter_reviews, key=lambda r: r["chapter"]):
+        status = "충족" if review["meets_request"] else "미흡"
+        lines.append(f"- Chapter {review['chapter']}: 사용자 요구사항 {status}")
+        for issue in review["issues"]:
+            lines.append(f"  - {issue}")
+        if review["urls_to_remove"]:
+            lines.append(f"  - 삭제해야 할 URL: {', '.join(review['urls_to_remove'])}")
+
+    unmet = [r["chapter"] for r in chapter_reviews if not r["meets_request"]]
+    needs_references = [r["chapter"] for r in chapter_reviews if r["needs_more_references"]]
+
+    if unmet:
+        lines.append(f"- 분석결과: Chapter {sorted(unmet)}이(가) 사용자의 요구사항을 충분히 충족시키지 못한다.")
+    else:
+        lines.append("- 분석결과: 검토한 chapter는 사용자의 요구사항을 충족시킨다.")
+
+    if needs_references:
+        lines.append(f"- 제안사항: vector_search_agent (Chapter {sorted(needs_references)}의 자료 보강 필요)")
+    else:
+        lines.append("- 제안사항: communicator")
+
+    return "\n".join(lines)
+
+
+def finish_pipelined_review(state: State, chapter_reviews: list):
+    messages = state.get("messages", [])
+
+    review = merge_chapter_reviews(chapter_reviews)
+    print(review)
+    messages.append(AIMessage(review))
+
+    return {"messages": messages, "ai_recommandation": review, "chapter_reviews": []}
+
+
+def outline_reviewer(state: State):
+    print("\n\n============ OUTLINE REVIEWER ============")
+
+    # 목차 작성 중에 chapter별 리뷰가 끝났으면 합치기만 한다.
+    chapter_reviews = state.get("chapter_reviews")
+    if chapter_reviews:
+        return finish_pipelined_review(state, chapter_reviews)
+
     # 시스템 프롬프트와 모델을 연결
     outline_reviewer_chain = outline_reviewer_system_prompt | llm
 
     # 목차 리뷰
-    review = outline_reviewer_chain.stream(inputs)
+    review = outline_reviewer_chain.stream(make_outline_reviewer_inputs(state))
 
     gathered = None
 
@@ -352,77 +1132,74 @@ def outline_reviewer(state: State):
         else:
             gathered += chunk
 
-    if '[OUTLINE REVIEW AGENT]' not in gathered.content:
-        gathered.content = f"[OUTLINE REVIEW AGENT] {gathered.content}"
+    return finish_outline_reviewer(state, gathered)
 
-    print(gathered)
-    messages.append(gathered)
 
-    ai_recommandation = gathered.content
+async def aoutline_reviewer(state: State):
+    print("\n\n============ OUTLINE REVIEWER ============")
 
-    return {"messages": messages, "ai_recommandation": ai_recommandation}
+    chapter_reviews = state.get("chapter_reviews")
+    if chapter_reviews:
+        return finish_pipelined_review(state, chapter_reviews)
 
+    outline_reviewer_chain = outline_reviewer_system_prompt | llm
 
-def web_search_agent(state: State):
-    print("\n\n============ WEB SEARCH AGENT ============")
+    review = outline_reviewer_chain.astream(make_outline_reviewer_inputs(state))
 
-    tasks = state.get("task_history", [])
-    task = tasks[-1]
+    gathered = None
 
-    if task.agent != "web_search_agent":
-        raise ValueError(f"Web Search Agent가 아닌 agent가 Web Search Agent를 시도하고 있습니다.\n {task}")
-    
-    # 시스템 프롬프트 정의
-    web_search_system_prompt = PromptTemplate.from_template(
-        """
-        너는 다른 AI Agent 들이 수행한 작업을 바탕으로, 
-        목차(outline) 작성에 필요한 정보를 웹 검색을 통해 찾아내는 Web Search Agent이다.
-
-        현재 부족한 정보를 검색하고, 복합적인 질문은 나눠서 검색하라.
-
-        - 검색 목적: {mission}
-        --------------------------------
-        - 과거 검색 내용: {references}
-        --------------------------------
-        - 이전 대화 내용: {messages}
-        --------------------------------
-        - 목차(outline): {outline}
-        --------------------------------
-        - 현재 시각 : {current_time}
-        """
-    )
+    async for chunk in review:
+        print(chunk.content, end='')
 
-    messages = state.get("messages", [])
+        if gathered is None:
+            gathered = chunk
+        else:
+            gathered += chunk
 
-    inputs = {
-        "mission": task.description,
-        "references": state.get("references", {"queries": [], "docs": []}),
-        "messages": messages,
-        "outline": get_outline(current_path),
-        "current_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    }
+    return finish_outline_reviewer(state, gathered)
 
-    # LLM과 웹 검색 모델 연결
-    llm_with_web_search = llm.bind_tools([web_search])
 
-    # 시스템 프롬프트와 모델을 연결
-    web_search_chain = web_search_system_prompt | llm_with_web_search
+web_search_system_prompt = PromptTemplate.from_template(
+    """
+    너는 다른 AI Agent 들이 수행한 작업을 바탕으로, 
+    목차(outline) 작성에 필요한 정보를 웹 검색을 통해 찾아내는 Web Search Agent이다.
 
-    search_plans = web_search_chain.invoke(inputs)
+    현재 부족한 정보를 검색하고, 복합적인 질문은 나눠서 검색하라.
 
-    queries = []
+    --------------------------------
+    - 목차(outline): {outline}
+    --------------------------------
+    - 과거 검색 내용: {references}
+    --------------------------------
+    - 검색 목적: {mission}
+    --------------------------------
+    - 이전 대화 내용: {messages}
+    --------------------------------
+    - 현재 시각 : {current_time}
+    """
+)
 
-    for tool_call in search_plans.tool_calls:
-        print('-------- web search --------', tool_call)
-        args = tool_call["args"]
-        
-        queries.append(args["query"])
 
-        _, json_path = web_search.invoke(args)
-        print('json_path:', json_path)
+def check_web_search_task(state: State):
+    task = state.get("task_history", [])[-1]
+    if task.agent != "web_search_agent":
+        raise ValueError(f"Web Search Agent가 아닌 agent가 Web Search Agent를 시도하고 있습니다.\n {task}")
+    return task
 
-        # json 파일을 chroma에 추가
-        add_web_pages_json_to_chroma(json_path)
+
+def make_web_search_inputs(state: State, task: Task, prefetched: dict):
+    return {
+        "mission": task.description,
+        "references": prefetched["references"],
+        "messages": message_view(state),
+        "outline": prefetched["outline"],
+        "current_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def finish_web_search_agent(state: State, queries: list):
+    tasks = state.get("task_history", [])
+    messages = state.get("messages", [])
 
     # task 완료
     tasks[-1].done = True
@@ -451,82 +1228,105 @@ def web_search_agent(state: State):
     }
 
 
-def vector_search_agent(state: State):
-    print("\n\n============ VECTOR SEARCH AGENT ============")
+def web_search_agent(state: State):
+    print("\n\n============ WEB SEARCH AGENT ============")
 
-    tasks = state.get("task_history", [])
-    task = tasks[-1]
-    if task.agent != "vector_search_agent":
-        raise ValueError(f"Vector Search Agent가 아닌 agent가 RAG Agent를 시도하고 있습니다.\n {task}")
+    task = check_web_search_task(state)
 
-    # 시스템 프롬프트 정의
-    vector_search_system_prompt = PromptTemplate.from_template(
-        """
-        너는 다른 AI Agent 들이 수행한 작업을 바탕으로, 
-        목차(outline) 작성에 필요한 정보를 벡터 검색을 통해 찾아내는 RAG Agent이다.
-
-        현재 목차(outline)을 작성하는데 필요한 정보를 확보하기 위해, 
-        다음 내용을 활용해 적절한 벡터 검색을 수행하라. 
-
-        - 검색 목적: {mission}
-        --------------------------------
-        - 과거 검색 내용: {references}
-        --------------------------------
-        - 이전 대화 내용: {messages}
-        --------------------------------
-        - 목차(outline): {outline}
-        """
-    )
+    # LLM과 웹 검색 모델을 연결해서 검색 계획을 세운다.
+    search_plans = plan_searches("web_search_agent", web_search_system_prompt, web_search, make_web_search_inputs(state, task, prefetched_inputs(state, "web_search_agent")))
 
-    mission = task.description
-    references = state.get("references", {"queries": [], "docs": []})
-    messages = state["messages"]
-    outline = get_outline(current_path)
+    queries = []
 
-    inputs = {
-        "mission": mission,
-        "references": references,
-        "messages": messages,
-        "outline": outline
-    }
+    for tool_call in search_plans.tool_calls:
+        print('-------- web search --------', tool_call)
+        queries.append(tool_call["args"]["query"])
+
+    # 계획된 검색어를 동시에 검색하고, 결과를 한 번에 chroma에 추가
+    web_pages = web_search_many(queries)
 
-    # LLM과 벡터 검색 모델 연결
-    llm_with_retriever = llm.bind_tools([retrieve]) 
-    vector_search_chain = vector_search_system_prompt | llm_with_retriever
+    if web_pages:
+        add_web_pages_to_chroma(web_pages)
 
-    search_plans = vector_search_chain.invoke(inputs)
+    return finish_web_search_agent(state, queries)
+
+
+async def aweb_search_agent(state: State):
+    print("\n\n============ WEB SEARCH AGENT ============")
+
+    task = check_web_search_task(state)
+
+    # 검색 계획은 web_search 스키마로 세우고, 실행은 aweb_search_many로 한다.
+    search_plans = await aplan_searches("web_search_agent", web_search_system_prompt, web_search, make_web_search_inputs(state, task, await aprefetched_inputs(state, "web_search_agent")))
 
     queries = []
 
     for tool_call in search_plans.tool_calls:
-        print('-----------------------------------', tool_call)
-        args = tool_call["args"]
-        
-        query = args["query"]
-        queries.append(query)
+        print('-------- web search --------', tool_call)
+        queries.append(tool_call["args"]["query"])
+
+    web_pages = await aweb_search_many(queries)
+
+    # 검색 결과를 chroma에 추가 (Chroma 저장은 동기 API이므로 스레드에서 실행)
+    if web_pages:
+        await asyncio.to_thread(add_web_pages_to_chroma, web_pages)
+
+    return finish_web_search_agent(state, queries)
+
+
+vector_search_system_prompt = PromptTemplate.from_template(
+    """
+    너는 다른 AI Agent 들이 수행한 작업을 바탕으로, 
+    목차(outline) 작성에 필요한 정보를 벡터 검색을 통해 찾아내는 RAG Agent이다.
+
+    현재 목차(outline)을 작성하는데 필요한 정보를 확보하기 위해, 
+    다음 내용을 활용해 적절한 벡터 검색을 수행하라. 
 
-        retrieved_docs = retrieve.invoke(args)
+    --------------------------------
+    - 목차(outline): {outline}
+    --------------------------------
+    - 과거 검색 내용: {references}
+    --------------------------------
+    - 검색 목적: {mission}
+    --------------------------------
+    - 이전 대화 내용: {messages}
+    """
+)
+
+
+def check_vector_search_task(state: State):
+    task = state.get("task_history", [])[-1]
+    if task.agent != "vector_search_agent":
+        raise ValueError(f"Vector Search Agent가 아닌 agent가 RAG Agent를 시도하고 있습니다.\n {task}")
+    return task
+
+
+def make_vector_search_inputs(state: State, task: Task, prefetched: dict):
+    return {
+        "mission": task.description,
+        "references": prefetched["references"],
+        "messages": message_view(state),
+        "outline": prefetched["outline"]
+    }
 
-        references["queries"].append(query)
-        references["docs"] += retrieved_docs
 
-    # 중복된 doc 제거
-    unique_docs = []
-    unique_page_contents = set()
+def finish_vector_search_agent(state: State, queries: list, scored_docs: list):
+    tasks = state.get("task_history", [])
+    messages = state["messages"]
+    references = state.get("references")
+    if references is None:
+        references = ReferenceStore()
 
-    for doc in references["docs"]:
-        if doc.page_content not in unique_page_contents:
-            unique_docs.append(doc)
-            unique_page_contents.add(doc.page_content)
-    references["docs"] = unique_docs
+    # 문서는 chunk ID 기준으로 한 번만 저장된다.
+    added = references.add(queries, scored_docs)
 
     # 검색 결과 출력
     print('Queries:--------------------------')
     for query in queries:
         print(query)
 
-    print('References:--------------------------')
-    for doc in references["docs"]:
+    print(f'References: {len(references)}건 (새로 추가 {added}건)--------------------------')
+    for doc, _ in scored_docs:
         print(doc.page_content[:100])
         print('--------------------------')
 
@@ -534,14 +1334,6 @@ def vector_search_agent(state: State):
     tasks[-1].done = True
     tasks[-1].done_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    # # 새로운 task 추가
-    # new_task = Task(
-    #     agent="communicator",
-    #     description="AI팀의 진행상황을 사용자에게 보고하고, 사용자의 의견을 파악하기 위한 대화를 나눈다"
-    # )
-
-    # tasks.append(new_task)
-
     msg_str = f"[VECTOR SEARCH AGENT] 다음 질문에 대한 검색 완료: {queries}"
     message = AIMessage(msg_str)
     print(msg_str)
@@ -558,48 +1350,86 @@ def vector_search_agent(state: State):
     }
 
 
-def communicator(state: State): 
-    # 사용자와 대화할 노드(agent): communicator
-    print("\n\n============ COMMUNICATOR ============")
+def vector_search_agent(state: State):
+    print("\n\n============ VECTOR SEARCH AGENT ============")
 
-    # 시스템 프롬프트 정의
-    communicator_system_prompt = PromptTemplate.from_template(
-        """
-        너는 책을 쓰는 AI팀의 커뮤니케이터로서, 
-        AI팀의 진행상황을 사용자에게 보고하고, 사용자의 의견을 파악하기 위한 대화를 나눈다. 
+    task = check_vector_search_task(state)
 
-        사용자도 outline(목차)을 이미 보고 있으므로, 다시 출력할 필요는 없다.
+    # LLM과 벡터 검색 모델을 연결해서 검색 계획을 세운다.
+    search_plans = plan_searches("vector_search_agent", vector_search_system_prompt, retrieve, make_vector_search_inputs(state, task, prefetched_inputs(state, "vector_search_agent")))
 
-        outline: {outline}
-        --------------------------------
-        messages: {messages}
-        """
-    )
+    queries = []
+    top_k = 5
 
-    # 시스템 프롬프트와 모델을 연결
-    system_chain = communicator_system_prompt | llm
+    for tool_call in search_plans.tool_calls:
+        print('-----------------------------------', tool_call)
+        args = tool_call["args"]
+        
+        queries.append(args["query"])
+        top_k = max(top_k, args.get("top_k", 5))
 
-    # 상태에서 메시지를 가져옴
-    messages = state["messages"]
+    # 모든 검색어를 한 번에 임베딩하고 검색
+    scored_docs = retrieve_many(queries, top_k=top_k, with_scores=True)
 
-    # 입력값 정의
-    inputs = {
-        "messages": messages,
-        "outline": get_outline(current_path)
-    }
+    return finish_vector_search_agent(state, queries, scored_docs)
 
-    # 스트림되는 메시지를 출력하면서, gathered에 모으기
-    gathered = None
 
-    print('\nAI\t: ', end='')
-    for chunk in system_chain.stream(inputs):
-        print(chunk.content, end='')
+async def avector_search_agent(state: State):
+    print("\n\n============ VECTOR SEARCH AGENT ============")
+
+    task = check_vector_search_task(state)
+
+    # 검색 계획은 retrieve 스키마로 세우고, 실행은 aretrieve_many로 한다.
+    search_plans = await aplan_searches("vector_search_agent", vector_search_system_prompt, retrieve, make_vector_search_inputs(state, task, await aprefetched_inputs(state, "vector_search_agent")))
+
+    queries = []
+    top_k = 5
+
+    for tool_call in search_plans.tool_calls:
+        print('-----------------------------------', tool_call)
+        args = tool_call["args"]
+        
+        queries.append(args["query"])
+        top_k = max(top_k, args.get("top_k", 5))
+
+    scored_docs = await aretrieve_many(queries, top_k=top_k, with_scores=True)
+
+    return finish_vector_search_agent(state, queries, scored_docs)
+
+
+# 사용자와 대화할 노드(agent): communicator
+communicator_system_prompt = PromptTemplate.from_template(
+    """
+    너는 책을 쓰는 AI팀의 커뮤니케이터로서, 
+    AI팀의 진행상황을 사용자에게 보고하고, 사용자의 의견을 파악하기 위한 대화를 나눈다. 
+
+    사용자도 outline(목차)을 이미 보고 있으므로, 다시 출력할 필요는 없다.
+
+    outline: {outline}
+    --------------------------------
+    messages: {messages}
+    --------------------------------
+    {budget_notice}
+    """
+)
+
+
+def budget_notice(state: State):
+    if not get_budget(state).handed_off:
+        return ""
+    return "이번 턴의 시간/토큰 예산을 다 써서 작업을 중간에 멈췄다. 지금까지의 결과(목차, 조사한 자료)를 보고하고, 이어서 진행할지 물어본다."
+
+
+def make_communicator_inputs(state: State, prefetched: dict):
+    return {
+        "messages": message_view(state, user_facing=True), # 내부 agent 메시지는 제외
+        "outline": prefetched["outline"],
+        "budget_notice": budget_notice(state)
+    }
 
-        if gathered is None:
-            gathered = chunk
-        else:
-            gathered += chunk
 
+def finish_communicator(state: State, gathered):
+    messages = state["messages"]
     messages.append(gathered)
 
     task_history = state.get("task_history", []) # 작업 이력 가져오기
@@ -616,73 +1446,307 @@ def communicator(state: State):
     }
 
 
-# 상태 그래프 정의
-graph_builder = StateGraph(State)
-
-# Nodes
-graph_builder.add_node("business_analyst", business_analyst)
-graph_builder.add_node("supervisor", supervisor)
-graph_builder.add_node("communicator", communicator)
-graph_builder.add_node("content_strategist", content_strategist)
-graph_builder.add_node("outline_reviewer", outline_reviewer)
-graph_builder.add_node("vector_search_agent", vector_search_agent)
-graph_builder.add_node("web_search_agent", web_search_agent)
-
-# Edges
-graph_builder.add_edge(START, "business_analyst")
-graph_builder.add_edge("business_analyst", "supervisor")
-graph_builder.add_conditional_edges(
-    "supervisor", 
-    supervisor_router,
-    {
-        "content_strategist": "content_strategist",
-        "communicator": "communicator",
-        "vector_search_agent": "vector_search_agent",
-        "web_search_agent": "web_search_agent"
-    }
-)
-graph_builder.add_edge("content_strategist", "outline_reviewer")
-graph_builder.add_edge("outline_reviewer", "business_analyst")
-graph_builder.add_edge("web_search_agent", "vector_search_agent")
-graph_builder.add_edge("vector_search_agent", "business_analyst")
-graph_builder.add_edge("communicator", END)
+def communicator(state: State): 
+    print("\n\n============ COMMUNICATOR ============")
 
-graph = graph_builder.compile()
+    # 시스템 프롬프트와 모델을 연결
+    system_chain = communicator_system_prompt | llm
 
+    # 스트림되는 메시지를 출력하면서, gathered에 모으기
+    gathered = None
 
-# 그래프 도식화
-graph.get_graph().draw_mermaid_png(output_file_path=absolute_path.replace('.py', '.png'))
+    print('\nAI\t: ', end='')
+    for chunk in system_chain.stream(make_communicator_inputs(state, prefetched_inputs(state, "communicator"))):
+        print(chunk.content, end='')
 
+        if gathered is None:
+            gathered = chunk
+        else:
+            gathered += chunk
 
-# 상태 초기화
-state = State(
-    messages = [
-        SystemMessage(
-                f"""
-            너희 AI들은 사용자의 요구에 맞는 책을 쓰는 작가팀이다.
-            사용자가 사용하는 언어로 대화하라.
+    return finish_communicator(state, gathered)
 
-            현재시각은 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}이다.
 
-            """
-        )
-    ],
-    task_history=[], 
-    references={"queries": [], "docs": []}, 
-    user_request=""
-)
+async def acommunicator(state: State): 
+    print("\n\n============ COMMUNICATOR ============")
 
+    system_chain = communicator_system_prompt | llm
 
-while True:
-    user_input = input("\nUser\t: ").strip()
+    gathered = None
 
-    if user_input.lower() in ['exit', 'quit', 'q']:
-        print("Goodbye!")
-        break
-    
-    state["messages"].append(HumanMessage(user_input))
-    state = graph.invoke(state)
+    print('\nAI\t: ', end='')
+    async for chunk in system_chain.astream(make_communicator_inputs(state, await aprefetched_inputs(state, "communicator"))):
+        print(chunk.content, end='')
+
+        if gathered is None:
+            gathered = chunk
+        else:
+            gathered += chunk
+
+    return finish_communicator(state, gathered)
+
+
+# 노드 이름과 (동기, 비동기) 함수 매핑
+nodes = {
+    "business_analyst": (business_analyst, abusiness_analyst),
+    "supervisor": (supervisor, asupervisor),
+    "communicator": (communicator, acommunicator),
+    "content_strategist": (content_strategist, acontent_strategist),
+    "outline_reviewer": (outline_reviewer, aoutline_reviewer),
+    "vector_search_agent": (vector_search_agent, avector_search_agent),
+    "web_search_agent": (web_search_agent, aweb_search_agent),
+}
+
+
+def record_checkpoint(name: str, state: State, result: dict, config: RunnableConfig):
+    # 노드 결과를 반영한 상태에서 바뀐 부분만 세션 journal에 기록한다.
+    journal = config.get("configurable", {}).get("journal")
+    if journal is None:
+        return
+
+    outline = get_outline(workspace_path()) if name == "content_strategist" else None
+    journal.record(name, {**state, **result}, outline=outline)
+
+
+def with_checkpoint(name, node):
+    # 노드 실행을 span으로 기록하고, 끝나면 체크포인트를 남긴다.
+    # 노드가 실행되는 동안 workspace를 config의 세션 폴더로, current_budget을 이번 턴의 예산으로 바꾼다.
+    if asyncio.iscoroutinefunction(node):
+        async def run(state: State, config: RunnableConfig):
+            token = workspace.set(config.get("configurable", {}).get("workspace", current_path))
+            budget_token = current_budget.set(get_budget(state))
+            try:
+                with tracer.span(name, kind="node") as span:
+                    result = await node(state)
+                    span.set(result_size=len(result))
+                await asyncio.to_thread(record_checkpoint, name, state, result, config)
+                return result
+            finally:
+                current_budget.reset(budget_token)
+                workspace.reset(token)
+    else:
+        def run(state: State, config: RunnableConfig):
+            token = workspace.set(config.get("configurable", {}).get("workspace", current_path))
+            budget_token = current_budget.set(get_budget(state))
+            try:
+                with tracer.span(name, kind="node") as span:
+                    result = node(state)
+                    span.set(result_size=len(result))
+                record_checkpoint(name, state, result, config)
+                return result
+            finally:
+                current_budget.reset(budget_token)
+                workspace.reset(token)
+    return run
+
+
+def build_graph(use_async=False):
+    # 상태 그래프 정의
+    graph_builder = StateGraph(State)
+
+    # Nodes (실행 후 journal에 체크포인트를 남기도록 감싼다)
+    for name, (sync_node, async_node) in nodes.items():
+        graph_builder.add_node(name, with_checkpoint(name, async_node if use_async else sync_node))
+    # Edges
+    graph_builder.add_edge(START, "business_analyst")
+    graph_builder.add_edge("business_analyst", "supervisor")
+    graph_builder.add_conditional_edges(
+        "supervisor", 
+        supervisor_router,
+        {
+            "content_strategist": "content_strategist",
+            "communicator": "communicator",
+            "vector_search_agent": "vector_search_agent",
+            "web_search_agent": "web_search_agent"
+        }
+    )
+    graph_builder.add_edge("content_strategist", "outline_reviewer")
+    graph_builder.add_edge("outline_reviewer", "business_analyst")
+    graph_builder.add_edge("web_search_agent", "vector_search_agent")
+    graph_builder.add_edge("vector_search_agent", "business_analyst")
+    graph_builder.add_edge("communicator", END)
+
+    return graph_builder.compile()
+
+
+graph = build_graph()
+async_graph = build_graph(use_async=True)
+
+
+def draw_graph(format="mermaid"):
+    """
+    그래프 도식화. import할 때가 아니라 --draw-graph 옵션으로 실행할 때만 그린다.
+
+    Args:
+        format (str): mermaid (로컬, .mmd 파일), ascii (로컬, grandalf 필요), png (mermaid.ink API 사용, 네트워크 필요)
+    """
+    drawable = graph.get_graph()
+
+    if format == "ascii":
+        print(drawable.draw_ascii())
+        return None
+
+    if format == "png":
+        output_path = absolute_path.replace('.py', '.png')
+        drawable.draw_mermaid_png(output_file_path=output_path)
+    else:
+        output_path = absolute_path.replace('.py', '.mmd')
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(drawable.draw_mermaid())
+
+    print(f"그래프 저장: {output_path}")
+    return output_path
+
+
+def initial_state():
+    # 상태 초기화
+    return State(
+        messages = [
+            SystemMessage(
+                    f"""
+                너희 AI들은 사용자의 요구에 맞는 책을 쓰는 작가팀이다.
+                사용자가 사용하는 언어로 대화하라.
+
+                현재시각은 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}이다.
+
+                """
+            )
+        ],
+        task_history=[], 
+        references=ReferenceStore(), 
+        user_request="",
+        history=HistoryManager(),
+        chapter_reviews=[]
+    )
+
+
+trace_dir = f"{current_path}/data/traces"
+
+
+def start_session(resume=False, workspace_dir=None, session_id=None):
+    """
+    새 세션을 시작하거나, resume이면 세션의 journal에서 State를 복원한다.
 
-    print('\n------------------------------------ MESSAGE COUNT\t', len(state["messages"]))
+    Args:
+        resume (bool): 이어서 진행할지 여부
+        workspace_dir (str): 세션 작업 폴더 (기본값은 이 파일이 있는 폴더)
+        session_id (str): 이어서 진행할 세션 ID (없으면 가장 최근 세션)
 
-    save_state(current_path, state) # 현재 state 내용 저장
\ No newline at end of file
+    Returns:
+        tuple: (state, journal)
+    """
+    workspace_dir = workspace_dir or current_path
+    session_checkpoint_dir = f"{workspace_dir}/data/checkpoints"
+
+    if resume:
+        if session_id is not None:
+            journal = CheckpointJournal(session_checkpoint_dir, session_id=session_id)
+        else:
+            journal = CheckpointJournal.latest(session_checkpoint_dir)
+        if journal is not None:
+            restored, outline = journal.resume()
+            if restored["messages"]:
+                if outline is not None:
+                    OutlineStore(workspace_dir).save_text(outline) # 목차 복원
+                print(f"세션 {journal.session_id}을(를) 이어서 진행합니다. (메시지 {len(restored['messages'])}개)")
+                return State(**restored), journal
+        print("이어서 진행할 세션이 없어 새 세션을 시작합니다.")
+
+    return initial_state(), CheckpointJournal(session_checkpoint_dir, session_id=session_id)
+
+
+def finish_turn_trace(turn, journal, trace_format="json"):
+    # 한 턴의 span을 요약 표로 출력하고 data/traces/<session_id>/에 내보낸다.
+    spans = tracer.pop_trace(turn.trace_id)
+    print(tracer.summary_table(spans))
+
+    if trace_format != "none":
+        extension = "otlp.json" if trace_format == "otlp" else "json"
+        path = f"{trace_dir}/{journal.session_id}/turn_{turn.start_ns}.{extension}"
+        tracer.export(spans, path, format=trace_format)
+
+
+def main(resume=False, trace_format="json"):
+    state, journal = start_session(resume)
+    config = {"configurable": {"journal": journal}}
+
+    while True:
+        user_input = input("\nUser\t: ").strip()
+
+        if user_input.lower() in ['exit', 'quit', 'q']:
+            save_state(current_path, state) # 사람이 읽을 수 있는 state.json은 종료할 때 한 번 저장
+            print("Goodbye!")
+            break
+        
+        start_turn(state, user_input)
+        with tracer.span("turn", kind="turn") as turn:
+            state = graph.invoke(state, config=config)
+        finish_turn_trace(turn, journal, trace_format)
+        print(fast_path_router.report())
+        print(usage_tracker.report())
+        print(scheduler.report())
+        print(hedger.report())
+        print(model_tier_stats.report())
+        print(prefetcher.report())
+        print(state["budget"].report())
+        if response_cache.mode != "passthrough":
+            print(response_cache.report())
+
+        print('\n------------------------------------ MESSAGE COUNT\t', len(state["messages"]))
+
+
+async def amain(resume=False, trace_format="json"):
+    # 비동기 드라이버: input()은 스레드에서 기다리고, 그래프는 ainvoke로 실행한다.
+    state, journal = start_session(resume)
+    config = {"configurable": {"journal": journal}}
+
+    while True:
+        user_input = (await asyncio.to_thread(input, "\nUser\t: ")).strip()
+
+        if user_input.lower() in ['exit', 'quit', 'q']:
+            await asyncio.to_thread(save_state, current_path, state)
+            print("Goodbye!")
+            break
+        
+        start_turn(state, user_input)
+        with tracer.span("turn", kind="turn") as turn:
+            state = await async_graph.ainvoke(state, config=config)
+        await asyncio.to_thread(finish_turn_trace, turn, journal, trace_format)
+        print(fast_path_router.report())
+        print(usage_tracker.report())
+        print(scheduler.report())
+        print(hedger.report())
+        print(model_tier_stats.report())
+        print(prefetcher.report())
+        print(state["budget"].report())
+        if response_cache.mode != "passthrough":
+            print(response_cache.report())
+
+        print('\n------------------------------------ MESSAGE COUNT\t', len(state["messages"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="책을 쓰는 AI 팀")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="비동기 그래프(ainvoke)로 실행")
+    parser.add_argument("--resume", action="store_true", help="가장 최근 세션의 체크포인트에서 이어서 실행")
+    parser.add_argument("--trace-format", choices=["json", "otlp", "none"], default="json", help="턴별 tracing span을 내보낼 형식")
+    parser.add_argument("--draw-graph", choices=["mermaid", "ascii", "png"], help="그래프를 그리고 종료 (png는 외부 렌더러 사용)")
+    parser.add_argument("--llm-cache", choices=llm_cache_modes, default=response_cache.mode,
+                        help="LLM 응답 캐시: record(없으면 호출해서 기록), replay(기록된 응답만 재생), passthrough(사용 안 함)")
+    parser.add_argument("--replay-timing", choices=llm_cache_timings, default=response_cache.timing,
+                        help="스트리밍 응답 재생 속도: original(기록된 간격대로), fast(최대 속도)")
+    parser.add_argument("--turn-deadline", type=float, default=turn_deadline_seconds, help="한 턴의 마감 시간(초)")
+    parser.add_argument("--turn-tokens", type=int, default=turn_max_tokens, help="한 턴의 토큰 예산")
+    args = parser.parse_args()
+
+    turn_deadline_seconds = args.turn_deadline
+    turn_max_tokens = args.turn_tokens
+    response_cache.mode = args.llm_cache
+    response_cache.timing = args.replay_timing
+
+    if args.draw_graph:
+        draw_graph(args.draw_graph)
+    elif args.use_async:
+        asyncio.run(amain(resume=args.resume, trace_format=args.trace_format))
+    else:
+        main(resume=args.resume, trace_format=args.trace_format)